@@ -1,8 +1,9 @@
 from flask import Flask, request, abort
-import json
 from functools import wraps
 from jose import jwt
-from urllib.request import urlopen
+
+from jwks import JWKSCache, JWKSUnavailable
+from token_cache import TokenCache
 
 
 app = Flask(__name__)
@@ -10,6 +11,23 @@ app = Flask(__name__)
 AUTH0_DOMAIN = @TODO_REPLACE_WITH_YOUR_DOMAIN
 ALGORITHMS = ['RS256']
 API_AUDIENCE = @TODO_REPLACE_WITH_YOUR_API_AUDIENCE
+# seconds a fetched key set is trusted before it is downloaded again
+JWKS_CACHE_TTL = 600
+# minimum seconds between key set fetches, failed ones included
+JWKS_MIN_REFRESH_INTERVAL = 30
+# seconds a key set fetch may take before it is given up
+JWKS_FETCH_TIMEOUT = 5
+
+jwks_cache = JWKSCache(
+    f'https://{AUTH0_DOMAIN}/.well-known/jwks.json',
+    ttl=JWKS_CACHE_TTL,
+    min_refresh_interval=JWKS_MIN_REFRESH_INTERVAL,
+    timeout=JWKS_FETCH_TIMEOUT
+)
+# number of verified tokens kept so repeat requests skip the RS256 check
+TOKEN_CACHE_SIZE = 1024
+
+token_cache = TokenCache(maxsize=TOKEN_CACHE_SIZE)
 
 
 class AuthError(Exception):
@@ -52,25 +70,24 @@ def get_token_auth_header():
 
 
 def verify_decode_jwt(token):
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
+    payload = token_cache.get(token)
+    if payload is not None:
+        return payload
+
     unverified_header = jwt.get_unverified_header(token)
-    rsa_key = {}
     if 'kid' not in unverified_header:
         raise AuthError({
             'code': 'invalid_header',
             'description': 'Authorization malformed.'
         }, 401)
 
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
+    try:
+        rsa_key = jwks_cache.get_key(unverified_header['kid'])
+    except JWKSUnavailable:
+        raise AuthError({
+            'code': 'jwks_unavailable',
+            'description': 'Unable to fetch the signing keys, please try again later.'
+        }, 503)
     if rsa_key:
         try:
             payload = jwt.decode(
@@ -80,6 +97,7 @@ def verify_decode_jwt(token):
                 audience=API_AUDIENCE,
                 issuer='https://' + AUTH0_DOMAIN + '/'
             )
+            token_cache.set(token, payload)
 
             return payload
 
@@ -111,6 +129,9 @@ def requires_auth(f):
         token = get_token_auth_header()
         try:
             payload = verify_decode_jwt(token)
+        except AuthError as error:
+            # an issuer that cannot be reached is not the client's fault
+            abort(503 if error.status_code == 503 else 401)
         except:
             abort(401)
         return f(payload, *args, **kwargs)
@@ -0,0 +1,125 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from jwks import JWKSCache, JWKSUnavailable
+from token_cache import TokenCache
+
+
+class Clock:
+    """A clock that only moves when told to"""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class JWKSCacheTestCase(unittest.TestCase):
+    """JWKSCache against a key set in a local file"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'jwks.json')
+        self.clock = Clock()
+        self.fetches = 0
+        self.cache = JWKSCache('file://' + self.path, ttl=600, min_refresh_interval=30, clock=self.clock)
+        fetch = self.cache.fetch
+
+        def counting_fetch():
+            self.fetches += 1
+            return fetch()
+        self.cache.fetch = counting_fetch
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def publish(self, *kids):
+        with open(self.path, 'w') as file:
+            json.dump({'keys': [
+                {'kty': 'RSA', 'kid': kid, 'use': 'sig', 'n': 'n-' + kid, 'e': 'AQAB'} for kid in kids
+            ]}, file)
+
+    def test_keys_are_fetched_once_until_the_ttl(self):
+        self.publish('a')
+        self.assertEqual(self.cache.get_key('a')['n'], 'n-a')
+        self.clock.now += 599
+        self.cache.get_key('a')
+        self.assertEqual(self.fetches, 1)
+
+        self.publish('b')
+        self.clock.now += 1
+        self.assertIsNone(self.cache.get_key('a'))
+        self.assertEqual(self.cache.get_key('b')['n'], 'n-b')
+        self.assertEqual(self.fetches, 2)
+
+    def test_unknown_kid_refetches_at_most_once_per_interval(self):
+        self.publish('a')
+        self.cache.get_key('a')
+        self.publish('a', 'b')
+        self.clock.now += 30
+        self.assertEqual(self.cache.get_key('b')['n'], 'n-b')
+
+        for kid in range(100):
+            self.assertIsNone(self.cache.get_key('forged-{}'.format(kid)))
+            self.clock.now += 0.1
+        self.assertEqual(self.fetches, 2)
+
+    def test_unavailable_key_set(self):
+        with self.assertRaises(JWKSUnavailable):
+            self.cache.get_key('a')
+        with self.assertRaises(JWKSUnavailable):
+            self.cache.get_key('a')
+        self.assertEqual(self.fetches, 1)
+
+        self.clock.now += 30
+        self.publish('a')
+        self.cache.get_key('a')
+        os.remove(self.path)
+        self.clock.now += 600
+        self.assertEqual(self.cache.get_key('a')['n'], 'n-a')
+        self.assertEqual(self.fetches, 3)
+
+
+class TokenCacheTestCase(unittest.TestCase):
+    """TokenCache expiry and eviction, on a clock that only moves when told to"""
+
+    def setUp(self):
+        self.clock = Clock()
+        self.cache = TokenCache(maxsize=2, clock=self.clock)
+
+    def test_payload_expires_at_exp(self):
+        self.cache.set('token', {'sub': 'a', 'exp': 1010})
+        self.assertEqual(self.cache.get('token'), {'sub': 'a', 'exp': 1010})
+        self.clock.now = 1009.9
+        self.assertIsNotNone(self.cache.get('token'))
+        self.clock.now = 1010
+        self.assertIsNone(self.cache.get('token'))
+        self.assertEqual(self.cache.stats()['size'], 0)
+
+    def test_tokens_without_exp_are_not_cached(self):
+        self.cache.set('token', {'sub': 'a'})
+        self.cache.set('other', {'sub': 'a', 'exp': 'never'})
+        self.assertIsNone(self.cache.get('token'))
+        self.assertIsNone(self.cache.get('other'))
+
+    def test_least_recently_used_is_evicted(self):
+        for token in ('a', 'b'):
+            self.cache.set(token, {'sub': token, 'exp': 2000})
+        self.cache.get('a')
+        self.cache.set('c', {'sub': 'c', 'exp': 2000})
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual([self.cache.get(token)['sub'] for token in ('a', 'c')], ['a', 'c'])
+        self.assertEqual(self.cache.stats(), {'hits': 3, 'misses': 1, 'size': 2, 'maxsize': 2})
+
+    def test_raw_token_is_not_kept(self):
+        self.cache.set('secret-token', {'exp': 2000})
+        self.assertNotIn('secret-token', self.cache._entries)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
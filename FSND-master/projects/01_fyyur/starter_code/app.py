@@ -3,15 +3,26 @@
 #----------------------------------------------------------------------------#
 
 import json
+from datetime import datetime
+from functools import lru_cache
 import dateutil.parser
 import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for
+import babel.dates
+from flask import Flask, render_template, request, Response, flash, redirect, url_for, abort, session, jsonify, stream_with_context
 from flask_moment import Moment
-from flask_sqlalchemy import SQLAlchemy
 import logging
 from logging import Formatter, FileHandler
 from flask_wtf import Form
 from forms import *
+from models import db, migrate, Venue, Artist, Show
+from cache import PageCache, make_backend, invalidate_on_commit
+from search import NameSearch, update_on_commit
+from bulk_import import Importer, read_rows, FALSE_VALUES
+import counters
+import deletion
+import geo
+import matchmaking
+import queries
 #----------------------------------------------------------------------------#
 # App Config.
 #----------------------------------------------------------------------------#
@@ -19,55 +30,84 @@ from forms import *
 app = Flask(__name__)
 moment = Moment(app)
 app.config.from_object('config')
-db = SQLAlchemy(app)
-
-# TODO: connect to a local postgresql database
-
-#----------------------------------------------------------------------------#
-# Models.
-#----------------------------------------------------------------------------#
-
-class Venue(db.Model):
-    __tablename__ = 'Venue'
-
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String)
-    city = db.Column(db.String(120))
-    state = db.Column(db.String(120))
-    address = db.Column(db.String(120))
-    phone = db.Column(db.String(120))
-    image_link = db.Column(db.String(500))
-    facebook_link = db.Column(db.String(120))
-
-    # TODO: implement any missing fields, as a database migration using Flask-Migrate
-
-class Artist(db.Model):
-    __tablename__ = 'Artist'
-
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String)
-    city = db.Column(db.String(120))
-    state = db.Column(db.String(120))
-    phone = db.Column(db.String(120))
-    genres = db.Column(db.String(120))
-    image_link = db.Column(db.String(500))
-    facebook_link = db.Column(db.String(120))
-
-    # TODO: implement any missing fields, as a database migration using Flask-Migrate
-
-# TODO Implement Show and Artist models, and complete all model relationships and properties, as a database migration.
+db.init_app(app)
+migrate.init_app(app, db)
+
+# rendered venue and artist pages, see cache.py
+page_cache = PageCache(make_backend(app.config), app.config.get('PAGE_CACHE_TIMEOUT', 300))
+invalidate_on_commit(page_cache, Venue, Artist, Show)
+
+# partial name search, see search.py
+venue_search = NameSearch(Venue, app.config.get('SEARCH_RESULTS_LIMIT', 50))
+artist_search = NameSearch(Artist, app.config.get('SEARCH_RESULTS_LIMIT', 50))
+update_on_commit(venue_search, artist_search)
+
+# nearby venues, see geo.py
+venue_locator = geo.VenueLocator(app.config.get('SEARCH_RESULTS_LIMIT', 50))
+geo.update_on_commit(venue_locator)
+geo.locate_on_write()
+
+# artists for a venue and venues for an artist, see matchmaking.py
+matchmaker = matchmaking.Matchmaker()
+matchmaking.update_on_commit(matchmaker)
+
+# upcoming / past show counters on venues and artists, see counters.py
+counters.maintain_on_write()
+
+@app.cli.command('rollover-counters')
+def rollover_counters():
+  # run every few minutes (cron), moves started shows to the past counts
+  print('{} shows moved to past'.format(counters.rollover()))
+
+@app.cli.command('purge-deleted')
+def purge_deleted():
+  # run in the background (cron), removes soft deleted venues and artists
+  print('{} venues and artists purged'.format(deletion.purge_deleted()))
+
+@app.cli.command('recount-counters')
+def recount_counters():
+  # rebuilds the counters from the Show table
+  print('{} shows counted'.format(counters.recount()))
+
+@app.cli.command('geocode-venues')
+def geocode_venues():
+  # places the venues without coordinates at their city centre (geocodes.csv)
+  print('{} venues located'.format(geo.geocode_venues()))
+  venue_locator.reset()
+  matchmaker.reset()
 
 #----------------------------------------------------------------------------#
 # Filters.
 #----------------------------------------------------------------------------#
 
-def format_datetime(value, format='medium'):
-  date = dateutil.parser.parse(value)
-  if format == 'full':
-      format="EEEE MMMM, d, y 'at' h:mma"
-  elif format == 'medium':
-      format="EE MM, dd, y h:mma"
-  return babel.dates.format_datetime(date, format, locale='en')
+# named formats of the datetime filter, anything else is a babel pattern
+DATETIME_FORMATS = {
+  'full': "EEEE MMMM, d, y 'at' h:mma",
+  'medium': "EE MM, dd, y h:mma",
+}
+
+@lru_cache(maxsize=None)
+def datetime_pattern(format, locale):
+  # the compiled babel pattern and locale, parsed once per format / locale.
+  # babel's own 'short' and 'long' have no single pattern, None for those
+  format = DATETIME_FORMATS.get(format, format)
+  if format in ('short', 'long'):
+    return None, babel.Locale.parse(locale)
+  return babel.dates.parse_pattern(format), babel.Locale.parse(locale)
+
+@lru_cache(maxsize=4096)
+def format_datetime(value, format='medium', locale='en'):
+  # value is a datetime, or a string parsed with dateutil. results are
+  # memoized, a page listing the same start times formats each of them once
+  date = value if isinstance(value, datetime) else dateutil.parser.parse(value)
+  pattern, locale = datetime_pattern(format, locale)
+  if pattern is None:
+    return babel.dates.format_datetime(date, format, locale=locale)
+  # the same tzinfo handling babel.dates.format_datetime does before it
+  # applies a pattern: naive values are UTC, aware ones keep their offset
+  if date.tzinfo is None:
+    date = date.replace(tzinfo=babel.dates.UTC)
+  return pattern.apply(date, locale)
 
 app.jinja_env.filters['datetime'] = format_datetime
 
@@ -75,6 +115,28 @@ app.jinja_env.filters['datetime'] = format_datetime
 # Controllers.
 #----------------------------------------------------------------------------#
 
+def cached_page(kind, id, load):
+  # the show_<kind> page from page_cache, rendered from load() on a miss.
+  # a page is kept until its entity or one of its shows is written, at most
+  # until its next upcoming show starts and moves to the past shows.
+  # pages carrying flashed messages are rendered for the request only.
+  # pages differ only by the show list pages asked for, other query
+  # parameters do not make new entries
+  if '_flashes' in session:
+    return render_detail(kind, load)[0]
+  variant = '{}:{}'.format(max(request.args.get('upcoming_page', 1, type=int), 1),
+    max(request.args.get('past_page', 1, type=int), 1))
+  return page_cache.page(kind, id, lambda: render_detail(kind, load), variant)
+
+def render_detail(kind, load):
+  data = load()
+  if data is None:
+    abort(404)
+  timeout = None
+  if data['next_show_time'] is not None:
+    timeout = (data['next_show_time'] - datetime.now()).total_seconds()
+  return render_template('pages/show_{}.html'.format(kind), **{kind: data}), timeout
+
 @app.route('/')
 def index():
   return render_template('pages/home.html')
@@ -83,131 +145,70 @@ def index():
 #  Venues
 #  ----------------------------------------------------------------
 
+# widest radius of /venues/nearby, in km
+MAX_NEARBY_KM = 500
+
+def listing_filters():
+  # ?genre= (in any case), ?city= and ?state= narrow listings and searches,
+  # "Jazz venues in San Francisco" is /venues?genre=jazz&city=San+Francisco.
+  # a genre that is not one of GENRES is a 400 rather than no filter
+  genre = request.values.get('genre', '').strip()
+  if genre and normalize_genre(genre) is None:
+    abort(400)
+  return {
+    'genre': normalize_genre(genre),
+    'city': request.values.get('city', '').strip() or None,
+    'state': request.values.get('state', '').strip() or None,
+  }
+
 @app.route('/venues')
 def venues():
-  # TODO: replace with real venues data.
-  #       num_shows should be aggregated based on number of upcoming shows per venue.
-  data=[{
-    "city": "San Francisco",
-    "state": "CA",
-    "venues": [{
-      "id": 1,
-      "name": "The Musical Hop",
-      "num_upcoming_shows": 0,
-    }, {
-      "id": 3,
-      "name": "Park Square Live Music & Coffee",
-      "num_upcoming_shows": 1,
-    }]
-  }, {
-    "city": "New York",
-    "state": "NY",
-    "venues": [{
-      "id": 2,
-      "name": "The Dueling Pianos Bar",
-      "num_upcoming_shows": 0,
-    }]
-  }]
-  return render_template('pages/venues.html', areas=data);
+  # venues grouped by area, num_upcoming_shows read from the counter column
+  filters = listing_filters()
+  return render_template('pages/venues.html',
+    areas=queries.venue_areas(*venue_search.filters(**filters), ids=venue_search.genre_ids(filters['genre'])),
+    filters=filters, genres=GENRES)
 
 @app.route('/venues/search', methods=['POST'])
 def search_venues():
-  # TODO: implement search on artists with partial string search. Ensure it is case-insensitive.
-  # seach for Hop should return "The Musical Hop".
-  # search for "Music" should return "The Musical Hop" and "Park Square Live Music & Coffee"
-  response={
-    "count": 1,
-    "data": [{
-      "id": 2,
-      "name": "The Dueling Pianos Bar",
-      "num_upcoming_shows": 0,
-    }]
-  }
-  return render_template('pages/search_venues.html', results=response, search_term=request.form.get('search_term', ''))
+  # case-insensitive partial match on the name, "Hop" finds "The Musical Hop"
+  search_term = request.form.get('search_term', '')
+  response = venue_search.search(search_term, **listing_filters())
+  return render_template('pages/search_venues.html', results=response, search_term=search_term)
+
+@app.route('/venues/nearby')
+def nearby_venues():
+  # venues within ?km= (25 by default) of ?near=City, ST or of ?lat= / ?lng=,
+  # nearest first, only those seeking talent with ?seeking_talent=1
+  near = request.args.get('near', '').strip()
+  km = min(request.args.get('km', 25, type=float), MAX_NEARBY_KM)
+  lat, lng = request.args.get('lat', type=float), request.args.get('lng', type=float)
+  if near:
+    city, _, state = near.rpartition(',')
+    point = geo.geocode(city, state)
+    if point is None:
+      flash('No location found for ' + near + '.')
+      return render_template('pages/nearby_venues.html', results=None, near=near, km=km)
+    lat, lng = point
+  if lat is None or lng is None or not -90 <= lat <= 90 or not -180 <= lng <= 180 or not km > 0:
+    abort(400)
+  seeking_talent = True if request.args.get('seeking_talent') else None
+  response = venue_locator.nearby(lat, lng, km, seeking_talent)
+  return render_template('pages/nearby_venues.html', results=response, near=near, km=km,
+    seeking_talent=seeking_talent)
+
+@app.route('/venues/autocomplete')
+def autocomplete_venues():
+  # search-as-you-type, venues with a word in their name starting with ?q=
+  return jsonify({"results": venue_search.complete(request.args.get('q', ''))})
 
 @app.route('/venues/<int:venue_id>')
 def show_venue(venue_id):
   # shows the venue page with the given venue_id
-  # TODO: replace with real venue data from the venues table, using venue_id
-  data1={
-    "id": 1,
-    "name": "The Musical Hop",
-    "genres": ["Jazz", "Reggae", "Swing", "Classical", "Folk"],
-    "address": "1015 Folsom Street",
-    "city": "San Francisco",
-    "state": "CA",
-    "phone": "123-123-1234",
-    "website": "https://www.themusicalhop.com",
-    "facebook_link": "https://www.facebook.com/TheMusicalHop",
-    "seeking_talent": True,
-    "seeking_description": "We are on the lookout for a local artist to play every two weeks. Please call us.",
-    "image_link": "https://images.unsplash.com/photo-1543900694-133f37abaaa5?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=400&q=60",
-    "past_shows": [{
-      "artist_id": 4,
-      "artist_name": "Guns N Petals",
-      "artist_image_link": "https://images.unsplash.com/photo-1549213783-8284d0336c4f?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=300&q=80",
-      "start_time": "2019-05-21T21:30:00.000Z"
-    }],
-    "upcoming_shows": [],
-    "past_shows_count": 1,
-    "upcoming_shows_count": 0,
-  }
-  data2={
-    "id": 2,
-    "name": "The Dueling Pianos Bar",
-    "genres": ["Classical", "R&B", "Hip-Hop"],
-    "address": "335 Delancey Street",
-    "city": "New York",
-    "state": "NY",
-    "phone": "914-003-1132",
-    "website": "https://www.theduelingpianos.com",
-    "facebook_link": "https://www.facebook.com/theduelingpianos",
-    "seeking_talent": False,
-    "image_link": "https://images.unsplash.com/photo-1497032205916-ac775f0649ae?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=750&q=80",
-    "past_shows": [],
-    "upcoming_shows": [],
-    "past_shows_count": 0,
-    "upcoming_shows_count": 0,
-  }
-  data3={
-    "id": 3,
-    "name": "Park Square Live Music & Coffee",
-    "genres": ["Rock n Roll", "Jazz", "Classical", "Folk"],
-    "address": "34 Whiskey Moore Ave",
-    "city": "San Francisco",
-    "state": "CA",
-    "phone": "415-000-1234",
-    "website": "https://www.parksquarelivemusicandcoffee.com",
-    "facebook_link": "https://www.facebook.com/ParkSquareLiveMusicAndCoffee",
-    "seeking_talent": False,
-    "image_link": "https://images.unsplash.com/photo-1485686531765-ba63b07845a7?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=747&q=80",
-    "past_shows": [{
-      "artist_id": 5,
-      "artist_name": "Matt Quevedo",
-      "artist_image_link": "https://images.unsplash.com/photo-1495223153807-b916f75de8c5?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=334&q=80",
-      "start_time": "2019-06-15T23:00:00.000Z"
-    }],
-    "upcoming_shows": [{
-      "artist_id": 6,
-      "artist_name": "The Wild Sax Band",
-      "artist_image_link": "https://images.unsplash.com/photo-1558369981-f9ca78462e61?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=794&q=80",
-      "start_time": "2035-04-01T20:00:00.000Z"
-    }, {
-      "artist_id": 6,
-      "artist_name": "The Wild Sax Band",
-      "artist_image_link": "https://images.unsplash.com/photo-1558369981-f9ca78462e61?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=794&q=80",
-      "start_time": "2035-04-08T20:00:00.000Z"
-    }, {
-      "artist_id": 6,
-      "artist_name": "The Wild Sax Band",
-      "artist_image_link": "https://images.unsplash.com/photo-1558369981-f9ca78462e61?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=794&q=80",
-      "start_time": "2035-04-15T20:00:00.000Z"
-    }],
-    "past_shows_count": 1,
-    "upcoming_shows_count": 1,
-  }
-  data = list(filter(lambda d: d['id'] == venue_id, [data1, data2, data3]))[0]
-  return render_template('pages/show_venue.html', venue=data)
+  # ?upcoming_page= and ?past_page= page through long show histories
+  return cached_page('venue', venue_id, lambda: queries.venue_detail(venue_id,
+    upcoming_page=request.args.get('upcoming_page', 1, type=int),
+    past_page=request.args.get('past_page', 1, type=int)))
 
 #  Create Venue
 #  ----------------------------------------------------------------
@@ -229,124 +230,98 @@ def create_venue_submission():
   # see: http://flask.pocoo.org/docs/1.0/patterns/flashing/
   return render_template('pages/home.html')
 
-@app.route('/venues/<venue_id>', methods=['DELETE'])
-def delete_venue(venue_id):
-  # TODO: Complete this endpoint for taking a venue_id, and using
-  # SQLAlchemy ORM to delete a record. Handle cases where the session commit could fail.
+@app.route('/venues/<int:venue_id>/matches')
+def venue_matches(venue_id):
+  # artists seeking a venue, best suited to this one first, see matchmaking.py
+  return matches(Venue, venue_id)
+
+def matches(model, id):
+  # ?limit= (20 by default, at most 100), ?same_city=1 for local matches only
+  limit = max(1, min(request.args.get('limit', 20, type=int), 100))
+  response = matchmaker.rank(model, id, limit, same_city=bool(request.args.get('same_city')))
+  if response is None:
+    abort(404)
+  return jsonify(response)
 
-  # BONUS CHALLENGE: Implement a button to delete a Venue on a Venue Page, have it so that
-  # clicking that button delete it from the db then redirect the user to the homepage
-  return None
+@app.route('/venues/<int:venue_id>', methods=['DELETE'])
+def delete_venue(venue_id):
+  # deletes the venue and its shows without loading them, see deletion.py
+  return delete_entity(Venue, venue_id)
+
+def parse_flag(value):
+  # a bare ?soft, ?soft=1 and ?soft=yes are set, ?soft=0 and ?soft=false are not
+  value = value.strip().lower()
+  return not value or value not in FALSE_VALUES
+
+def delete_entity(model, id):
+  # a venue or artist with more than SOFT_DELETE_MIN_SHOWS shows (or any
+  # with ?soft=1) is soft deleted, its rows are purged by `flask purge-deleted`
+  kind = model.__tablename__.lower()
+  entity = db.session.query(model.upcoming_shows_count, model.past_shows_count) \
+    .filter(model.id == id, model.deleted_at.is_(None)).first()
+  if entity is None:
+    abort(404)
+  soft = request.args.get('soft', False, type=parse_flag) or \
+    sum(entity) > app.config.get('SOFT_DELETE_MIN_SHOWS', 10000)
+  try:
+    others = (deletion.soft_delete if soft else deletion.delete)(model, id)
+  except Exception:
+    db.session.rollback()
+    app.logger.exception('could not delete %s %s', kind, id)
+    return jsonify({'success': False}), 500
+  finally:
+    db.session.close()
+
+  # set-based deletes skip the session events, tell the caches and indexes
+  page_cache.bump(kind, id)
+  for other_id in others or ():
+    page_cache.bump('artist' if model is Venue else 'venue', other_id)
+  (venue_search if model is Venue else artist_search).changed((), (id,))
+  if model is Venue:
+    venue_locator.changed((), (id,))
+  matchmaker.changed(model, (id,))
+  matchmaker.changed(Artist if model is Venue else Venue, others or ())
+  return jsonify({'success': True, 'soft': bool(soft)})
 
 #  Artists
 #  ----------------------------------------------------------------
 @app.route('/artists')
 def artists():
-  # TODO: replace with real data returned from querying the database
-  data=[{
-    "id": 4,
-    "name": "Guns N Petals",
-  }, {
-    "id": 5,
-    "name": "Matt Quevedo",
-  }, {
-    "id": 6,
-    "name": "The Wild Sax Band",
-  }]
-  return render_template('pages/artists.html', artists=data)
+  # artists by name, with the same filters as /venues
+  filters = listing_filters()
+  return render_template('pages/artists.html',
+    artists=queries.artist_list(*artist_search.filters(**filters), ids=artist_search.genre_ids(filters['genre'])),
+    filters=filters, genres=GENRES)
 
 @app.route('/artists/search', methods=['POST'])
 def search_artists():
-  # TODO: implement search on artists with partial string search. Ensure it is case-insensitive.
-  # seach for "A" should return "Guns N Petals", "Matt Quevado", and "The Wild Sax Band".
-  # search for "band" should return "The Wild Sax Band".
-  response={
-    "count": 1,
-    "data": [{
-      "id": 4,
-      "name": "Guns N Petals",
-      "num_upcoming_shows": 0,
-    }]
-  }
-  return render_template('pages/search_artists.html', results=response, search_term=request.form.get('search_term', ''))
+  # case-insensitive partial match on the name, "band" finds "The Wild Sax Band"
+  search_term = request.form.get('search_term', '')
+  response = artist_search.search(search_term, **listing_filters())
+  return render_template('pages/search_artists.html', results=response, search_term=search_term)
+
+@app.route('/artists/<int:artist_id>', methods=['DELETE'])
+def delete_artist(artist_id):
+  # deletes the artist and its shows without loading them, see deletion.py
+  return delete_entity(Artist, artist_id)
+
+@app.route('/artists/<int:artist_id>/matches')
+def artist_matches(artist_id):
+  # venues seeking talent, best suited to this artist first
+  return matches(Artist, artist_id)
+
+@app.route('/artists/autocomplete')
+def autocomplete_artists():
+  # search-as-you-type, artists with a word in their name starting with ?q=
+  return jsonify({"results": artist_search.complete(request.args.get('q', ''))})
 
 @app.route('/artists/<int:artist_id>')
 def show_artist(artist_id):
   # shows the artist page with the given artist_id
-  # TODO: replace with real artist data from the artist table, using artist_id
-  data1={
-    "id": 4,
-    "name": "Guns N Petals",
-    "genres": ["Rock n Roll"],
-    "city": "San Francisco",
-    "state": "CA",
-    "phone": "326-123-5000",
-    "website": "https://www.gunsnpetalsband.com",
-    "facebook_link": "https://www.facebook.com/GunsNPetals",
-    "seeking_venue": True,
-    "seeking_description": "Looking for shows to perform at in the San Francisco Bay Area!",
-    "image_link": "https://images.unsplash.com/photo-1549213783-8284d0336c4f?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=300&q=80",
-    "past_shows": [{
-      "venue_id": 1,
-      "venue_name": "The Musical Hop",
-      "venue_image_link": "https://images.unsplash.com/photo-1543900694-133f37abaaa5?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=400&q=60",
-      "start_time": "2019-05-21T21:30:00.000Z"
-    }],
-    "upcoming_shows": [],
-    "past_shows_count": 1,
-    "upcoming_shows_count": 0,
-  }
-  data2={
-    "id": 5,
-    "name": "Matt Quevedo",
-    "genres": ["Jazz"],
-    "city": "New York",
-    "state": "NY",
-    "phone": "300-400-5000",
-    "facebook_link": "https://www.facebook.com/mattquevedo923251523",
-    "seeking_venue": False,
-    "image_link": "https://images.unsplash.com/photo-1495223153807-b916f75de8c5?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=334&q=80",
-    "past_shows": [{
-      "venue_id": 3,
-      "venue_name": "Park Square Live Music & Coffee",
-      "venue_image_link": "https://images.unsplash.com/photo-1485686531765-ba63b07845a7?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=747&q=80",
-      "start_time": "2019-06-15T23:00:00.000Z"
-    }],
-    "upcoming_shows": [],
-    "past_shows_count": 1,
-    "upcoming_shows_count": 0,
-  }
-  data3={
-    "id": 6,
-    "name": "The Wild Sax Band",
-    "genres": ["Jazz", "Classical"],
-    "city": "San Francisco",
-    "state": "CA",
-    "phone": "432-325-5432",
-    "seeking_venue": False,
-    "image_link": "https://images.unsplash.com/photo-1558369981-f9ca78462e61?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=794&q=80",
-    "past_shows": [],
-    "upcoming_shows": [{
-      "venue_id": 3,
-      "venue_name": "Park Square Live Music & Coffee",
-      "venue_image_link": "https://images.unsplash.com/photo-1485686531765-ba63b07845a7?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=747&q=80",
-      "start_time": "2035-04-01T20:00:00.000Z"
-    }, {
-      "venue_id": 3,
-      "venue_name": "Park Square Live Music & Coffee",
-      "venue_image_link": "https://images.unsplash.com/photo-1485686531765-ba63b07845a7?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=747&q=80",
-      "start_time": "2035-04-08T20:00:00.000Z"
-    }, {
-      "venue_id": 3,
-      "venue_name": "Park Square Live Music & Coffee",
-      "venue_image_link": "https://images.unsplash.com/photo-1485686531765-ba63b07845a7?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=747&q=80",
-      "start_time": "2035-04-15T20:00:00.000Z"
-    }],
-    "past_shows_count": 0,
-    "upcoming_shows_count": 3,
-  }
-  data = list(filter(lambda d: d['id'] == artist_id, [data1, data2, data3]))[0]
-  return render_template('pages/show_artist.html', artist=data)
+  # ?upcoming_page= and ?past_page= page through long show histories
+  return cached_page('artist', artist_id, lambda: queries.artist_detail(artist_id,
+    upcoming_page=request.args.get('upcoming_page', 1, type=int),
+    past_page=request.args.get('past_page', 1, type=int)))
 
 #  Update
 #  ----------------------------------------------------------------
@@ -428,46 +403,42 @@ def create_artist_submission():
 
 @app.route('/shows')
 def shows():
-  # displays list of shows at /shows
-  # TODO: replace with real venues data.
-  #       num_shows should be aggregated based on number of upcoming shows per venue.
-  data=[{
-    "venue_id": 1,
-    "venue_name": "The Musical Hop",
-    "artist_id": 4,
-    "artist_name": "Guns N Petals",
-    "artist_image_link": "https://images.unsplash.com/photo-1549213783-8284d0336c4f?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=300&q=80",
-    "start_time": "2019-05-21T21:30:00.000Z"
-  }, {
-    "venue_id": 3,
-    "venue_name": "Park Square Live Music & Coffee",
-    "artist_id": 5,
-    "artist_name": "Matt Quevedo",
-    "artist_image_link": "https://images.unsplash.com/photo-1495223153807-b916f75de8c5?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=334&q=80",
-    "start_time": "2019-06-15T23:00:00.000Z"
-  }, {
-    "venue_id": 3,
-    "venue_name": "Park Square Live Music & Coffee",
-    "artist_id": 6,
-    "artist_name": "The Wild Sax Band",
-    "artist_image_link": "https://images.unsplash.com/photo-1558369981-f9ca78462e61?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=794&q=80",
-    "start_time": "2035-04-01T20:00:00.000Z"
-  }, {
-    "venue_id": 3,
-    "venue_name": "Park Square Live Music & Coffee",
-    "artist_id": 6,
-    "artist_name": "The Wild Sax Band",
-    "artist_image_link": "https://images.unsplash.com/photo-1558369981-f9ca78462e61?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=794&q=80",
-    "start_time": "2035-04-08T20:00:00.000Z"
-  }, {
-    "venue_id": 3,
-    "venue_name": "Park Square Live Music & Coffee",
-    "artist_id": 6,
-    "artist_name": "The Wild Sax Band",
-    "artist_image_link": "https://images.unsplash.com/photo-1558369981-f9ca78462e61?ixlib=rb-1.2.1&ixid=eyJhcHBfaWQiOjEyMDd9&auto=format&fit=crop&w=794&q=80",
-    "start_time": "2035-04-15T20:00:00.000Z"
-  }]
-  return render_template('pages/shows.html', shows=data)
+  # displays list of shows at /shows, ordered by start time
+  #   ?from= / ?to=  date range, upcoming shows only by default (?from=all for every show)
+  #   ?cursor=       the next page, as linked from the previous one
+  #   ?stream=1      every show in the range, rendered as the rows are fetched
+  try:
+    start = parse_date_arg('from', datetime.now())
+    end = parse_date_arg('to', None)
+  except ValueError:
+    abort(400)
+  filters = {key: request.args[key] for key in ('from', 'to') if key in request.args}
+
+  if request.args.get('stream'):
+    return Response(stream_with_context(
+      stream_template('pages/shows.html', shows=queries.iter_shows(start, end), filters=filters)))
+
+  try:
+    data, next_cursor = queries.shows_page(start, end, request.args.get('cursor'))
+  except ValueError:
+    abort(400)
+  return render_template('pages/shows.html', shows=data, next_cursor=next_cursor, filters=filters)
+
+def parse_date_arg(name, default):
+  value = request.args.get(name)
+  if not value:
+    return default
+  if value == 'all':
+    return None
+  return dateutil.parser.parse(value)
+
+def stream_template(template_name, **context):
+  # render_template as a generator, the page is sent in chunks while the
+  # template iterates over its data
+  app.update_template_context(context)
+  stream = app.jinja_env.get_template(template_name).stream(context)
+  stream.enable_buffering(20)
+  return stream
 
 @app.route('/shows/create')
 def create_shows():
@@ -478,15 +449,85 @@ def create_shows():
 @app.route('/shows/create', methods=['POST'])
 def create_show_submission():
   # called to create new shows in the db, upon submitting new show listing form
-  # TODO: insert form data as a new Show record in the db, instead
-
-  # on successful db insert, flash success
-  flash('Show was successfully listed!')
-  # TODO: on unsuccessful db insert, flash an error instead.
-  # e.g., flash('An error occurred. Show could not be listed.')
-  # see: http://flask.pocoo.org/docs/1.0/patterns/flashing/
+  # refused when the venue or the artist is already booked at that time
+  form = ShowForm(request.form, meta={'csrf': False})
+  if not form.validate():
+    flash('Show could not be listed, check the start time.')
+    return render_template('forms/new_show.html', form=form)
+  try:
+    venue_id, artist_id = int(form.venue_id.data), int(form.artist_id.data)
+  except (TypeError, ValueError):
+    flash('Show could not be listed, venue and artist IDs are numbers.')
+    return render_template('forms/new_show.html', form=form)
+  try:
+    # the venue and artist stay locked until the insert is committed, so
+    # two bookings of either cannot both pass the conflict check
+    venues, artists = queries.lock_for_booking((venue_id,), (artist_id,))
+    if venue_id not in venues or artist_id not in artists:
+      flash('Show could not be listed, there is no such venue or artist.')
+      return render_template('forms/new_show.html', form=form)
+
+    conflicts = queries.booking_conflicts(venue_id, artist_id, form.start_time.data)
+    if conflicts:
+      for conflict in conflicts:
+        flash('The {} is already booked for a show on {}.'.format(
+          conflict['with'], format_datetime(conflict['start_time'], 'full')))
+      return render_template('forms/new_show.html', form=form)
+
+    db.session.add(Show(venue_id=venue_id, artist_id=artist_id, start_time=form.start_time.data))
+    db.session.commit()
+    # on successful db insert, flash success
+    flash('Show was successfully listed!')
+  except Exception:
+    db.session.rollback()
+    flash('An error occurred. Show could not be listed.')
+  finally:
+    # also releases the locks when nothing was inserted
+    db.session.close()
   return render_template('pages/home.html')
 
+#  Import
+#  ----------------------------------------------------------------
+
+@app.route('/import', methods=['GET'])
+def import_form():
+  return render_template('forms/import.html')
+
+@app.route('/import', methods=['POST'])
+def import_submission():
+  # bulk venues, artists or shows from a CSV / JSON upload, see bulk_import.py
+  # answers with the per-row report, as JSON when asked for with ?format=json.
+  # a file that could not be read to the end is a 400, with the report of
+  # the rows imported before it
+  upload = request.files.get('file')
+  kind = request.form.get('kind')
+  if upload is None or kind not in ('venues', 'artists', 'shows'):
+    abort(400)
+  importer = Importer(kind)
+  try:
+    importer.run(read_rows(upload.stream, upload.filename or ''))
+  finally:
+    # bulk inserts skip the session events, tell the caches and indexes of
+    # the batches committed, whatever happened after them
+    report = importer.report
+    if kind == 'shows':
+      for venue_id in report.venue_ids:
+        page_cache.bump('venue', venue_id)
+      for artist_id in report.artist_ids:
+        page_cache.bump('artist', artist_id)
+      matchmaker.changed(Venue, report.venue_ids)
+      matchmaker.changed(Artist, report.artist_ids)
+    elif report.inserted:
+      (venue_search if kind == 'venues' else artist_search).reset()
+      if kind == 'venues':
+        venue_locator.reset()
+      matchmaker.reset()
+
+  status = 400 if report.stopped else 200
+  if request.args.get('format') == 'json':
+    return jsonify(report.to_dict()), status
+  return render_template('forms/import.html', report=report), status
+
 @app.errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
@@ -0,0 +1,98 @@
+#----------------------------------------------------------------------------#
+# bench_delete.py
+#   deletes venues with growing show histories and checks that deletion.py
+#   runs the same number of statements whatever the number of shows,
+#   for the hard delete, the soft delete and the ORM delete it replaces.
+#   test_fyyur.py checks the statement count for 10 and 1000 shows
+#
+#   python bench_delete.py [database_url]
+#----------------------------------------------------------------------------#
+
+import sys
+import time
+from datetime import datetime, timedelta
+
+from flask import Flask
+from sqlalchemy import event
+
+from models import db, Venue, Artist, Show
+import counters
+import deletion
+
+SIZES = (10, 1000, 50000)
+
+
+def seed(shows):
+  # venue 1 with shows spread over 10 artists, venue 2 untouched
+  now = datetime.now()
+  db.session.bulk_insert_mappings(Venue, [{
+    'id': id, 'name': 'Venue {}'.format(id), 'city': 'Austin', 'state': 'TX', 'phone': '0',
+  } for id in (1, 2)])
+  db.session.bulk_insert_mappings(Artist, [{
+    'id': id, 'name': 'Artist {}'.format(id), 'city': 'Austin', 'state': 'TX', 'phone': '0',
+  } for id in range(1, 11)])
+  db.session.bulk_insert_mappings(Show, [{
+    'venue_id': 1 + (i % 50 == 0), 'artist_id': 1 + i % 10,
+    'start_time': now + timedelta(hours=i - shows // 2),
+  } for i in range(shows)])
+  db.session.commit()
+  counters.recount(now)
+
+
+def orm_delete():
+  # the naive version: every show is loaded into the session first
+  venue = Venue.query.get(1)
+  for show in venue.shows:
+    db.session.delete(show)
+  db.session.delete(venue)
+  db.session.commit()
+
+
+def purge():
+  db.session.commit()
+  return deletion.purge_deleted(batch=5000)
+
+
+def measure(app, delete, shows):
+  with app.app_context():
+    db.drop_all()
+    db.create_all()
+    seed(shows)
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    started = time.perf_counter()
+    delete()
+    elapsed = time.perf_counter() - started
+    event.remove(db.engine, 'before_cursor_execute', listener)
+    counts = {artist.id: artist.upcoming_shows_count + artist.past_shows_count for artist in Artist.query}
+    assert Venue.query.get(1) is None or Venue.query.get(1).deleted_at is not None
+    assert sum(counts.values()) == Show.query.filter(Show.venue_id == 2).count()
+    db.session.remove()
+    return len(statements), elapsed
+
+
+def main(database_url='sqlite://'):
+  app = Flask(__name__)
+  app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+  app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+  db.init_app(app)
+  counters.maintain_on_write()
+
+  for name, delete in (('delete', lambda: deletion.delete(Venue, 1)),
+                       ('soft delete', lambda: deletion.soft_delete(Venue, 1)),
+                       ('ORM delete', orm_delete)):
+    results = [measure(app, delete, shows) for shows in SIZES]
+    print('{:12} '.format(name) + '  '.join(
+      '{} shows: {} statements {:.1f} ms'.format(shows, statements, elapsed * 1000)
+      for shows, (statements, elapsed) in zip(SIZES, results)))
+    if name != 'ORM delete':
+      assert len({statements for statements, _ in results}) == 1, 'statement count grows with shows'
+
+  statements, elapsed = measure(app, lambda: (deletion.soft_delete(Venue, 1), purge()), SIZES[-1])
+  print('soft delete + purge of {} shows in batches of 5000: {} statements {:.1f} ms'.format(
+    SIZES[-1], statements, elapsed * 1000))
+
+
+if __name__ == '__main__':
+  main(*sys.argv[1:2])
@@ -0,0 +1,78 @@
+#----------------------------------------------------------------------------#
+# bench_filters.py
+#   times rendering pages/shows.html with 1,000 shows through the datetime
+#   filter: the previous dateutil + babel.format_datetime version on ISO
+#   strings against the current one on datetimes, cold and memoized
+#
+#   python bench_filters.py [shows] [distinct start times]
+#----------------------------------------------------------------------------#
+
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+import babel.dates
+import dateutil.parser
+from flask import render_template
+
+from app import app, format_datetime, datetime_pattern
+
+
+def legacy_format_datetime(value, format='medium'):
+  date = dateutil.parser.parse(value)
+  if format == 'full':
+      format="EEEE MMMM, d, y 'at' h:mma"
+  elif format == 'medium':
+      format="EE MM, dd, y h:mma"
+  return babel.dates.format_datetime(date, format, locale='en')
+
+
+def make_shows(count, distinct):
+  rng = random.Random(0)
+  start = datetime(2026, 1, 1, 20, 0)
+  times = [start + timedelta(days=rng.randint(0, 365), minutes=30 * rng.randint(0, 8)) for _ in range(distinct)]
+  return [{
+    'venue_id': i % 50, 'venue_name': 'Venue {}'.format(i % 50),
+    'artist_id': i % 200, 'artist_name': 'Artist {}'.format(i % 200),
+    'artist_image_link': 'https://example.com/{}.jpg'.format(i % 200),
+    'start_time': rng.choice(times),
+  } for i in range(count)]
+
+
+def timed(render, repeat=20, before=None):
+  best = float('inf')
+  for _ in range(repeat):
+    if before:
+      before()
+    started = time.perf_counter()
+    render()
+    best = min(best, time.perf_counter() - started)
+  return best * 1000
+
+
+def cold():
+  format_datetime.cache_clear()
+  datetime_pattern.cache_clear()
+
+
+if __name__ == '__main__':
+  count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+  distinct = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+  shows = make_shows(count, distinct)
+  iso_shows = [dict(show, start_time=show['start_time'].isoformat()) for show in shows]
+  render = lambda data: render_template('pages/shows.html', shows=data)
+
+  with app.test_request_context('/shows'):
+    filters = app.jinja_env.filters
+    filters['datetime'] = legacy_format_datetime
+    legacy = timed(lambda: render(iso_shows))
+    filters['datetime'] = format_datetime
+    assert render(iso_shows) == render(shows)
+    uncached = timed(lambda: render(shows), before=cold)
+    memoized = timed(lambda: render(shows))
+
+  print('{} shows, {} distinct start times'.format(count, distinct))
+  print('parse + format per call  {:8.1f} ms'.format(legacy))
+  print('compiled pattern, cold   {:8.1f} ms'.format(uncached))
+  print('compiled pattern, warm   {:8.1f} ms'.format(memoized))
@@ -0,0 +1,85 @@
+#----------------------------------------------------------------------------#
+# bench_geo.py
+#   "venues seeking talent within N km" over 100k venues scattered around
+#   the cities of geocodes.csv: the grid index, the bounding box range scan
+#   (the postgres path, here run on the same database) and a full scan
+#
+#   python bench_geo.py [database_url]
+#----------------------------------------------------------------------------#
+
+import random
+import sys
+import time
+
+from flask import Flask
+
+from models import db, Venue
+import geo
+
+VENUES = 100000
+RADII = (10, 25, 100)
+ROUNDS = 20
+SAN_FRANCISCO = (37.7749, -122.4194)
+
+
+def seed(venues):
+  random.seed(1)
+  cities = list(geo.geocodes().values())
+  for start in range(0, venues, 10000):
+    rows = []
+    for id in range(start + 1, min(venues, start + 10000) + 1):
+      lat, lng = random.choice(cities)
+      rows.append({
+        'id': id, 'name': 'Venue {}'.format(id), 'city': 'Somewhere', 'state': 'CA', 'phone': '0',
+        'seeking_talent': random.random() < 0.5,
+        'latitude': lat + random.gauss(0, 0.3), 'longitude': lng + random.gauss(0, 0.3),
+      })
+    db.session.bulk_insert_mappings(Venue, rows)
+  db.session.commit()
+
+
+def full_scan(lat, lng, km):
+  return sum(1 for point_lat, point_lng in db.session.query(Venue.latitude, Venue.longitude)
+    .filter(Venue.seeking_talent.is_(True))
+    if geo.distance_km(lat, lng, point_lat, point_lng) <= km)
+
+
+def timed(query):
+  started = time.perf_counter()
+  for _ in range(ROUNDS):
+    result = query()
+  return result, (time.perf_counter() - started) / ROUNDS * 1000
+
+
+def main(database_url='sqlite://'):
+  app = Flask(__name__)
+  app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+  app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+  db.init_app(app)
+
+  with app.app_context():
+    db.drop_all()
+    db.create_all()
+    seed(VENUES)
+
+    grid = geo.VenueLocator()
+    grid.use_postgres = False
+    started = time.perf_counter()
+    grid.nearby(*SAN_FRANCISCO, 1)
+    print('grid loaded in {:.0f} ms'.format((time.perf_counter() - started) * 1000))
+    box = geo.VenueLocator()
+    box.use_postgres = True
+
+    for km in RADII:
+      line = []
+      for name, locator in (('grid', grid), ('bounding box', box)):
+        result, elapsed = timed(lambda: locator.nearby(*SAN_FRANCISCO, km, seeking_talent=True))
+        line.append('{} {:.1f} ms'.format(name, elapsed))
+      count, elapsed = timed(lambda: full_scan(*SAN_FRANCISCO, km))
+      assert count == result['count'], 'the indexes and the full scan disagree'
+      line.append('full scan {:.1f} ms'.format(elapsed))
+      print('{:>4} km, {:>5} venues: '.format(km, count) + '  '.join(line))
+
+
+if __name__ == '__main__':
+  main(*sys.argv[1:2])
@@ -0,0 +1,119 @@
+#----------------------------------------------------------------------------#
+# bench_matchmaking.py
+#   ranks 50k artists seeking a venue for a venue with matchmaking.py, and
+#   the same ranking computed a candidate at a time in python, and times
+#   merging in one artist written against loading them all
+#
+#   python bench_matchmaking.py [database_url]
+#----------------------------------------------------------------------------#
+
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from flask import Flask
+
+from forms import GENRES
+from models import db, Venue, Artist, Show
+import counters
+import geo
+import matchmaking
+
+ARTISTS = 50000
+VENUES = 1000
+SHOWS = 20000
+ROUNDS = 20
+
+
+def seed():
+  random.seed(1)
+  places = list(geo.geocodes())
+  db.session.bulk_insert_mappings(Venue, [{
+    'id': id, 'name': 'Venue {}'.format(id), 'city': places[id % len(places)][0].title(),
+    'state': places[id % len(places)][1], 'phone': '0', 'seeking_talent': True,
+    'genres': random.sample(GENRES, random.randint(1, 4)),
+  } for id in range(1, VENUES + 1)])
+  for start in range(0, ARTISTS, 10000):
+    db.session.bulk_insert_mappings(Artist, [{
+      'id': id, 'name': 'Artist {}'.format(id), 'city': places[id % len(places)][0].title(),
+      'state': places[id % len(places)][1], 'phone': '0', 'seeking_venue': True,
+      'genres': random.sample(GENRES, random.randint(1, 3)),
+    } for id in range(start + 1, start + 10001)])
+  now = datetime.now()
+  db.session.bulk_insert_mappings(Show, [{
+    'venue_id': random.randint(1, VENUES), 'artist_id': random.randint(1, ARTISTS),
+    'start_time': now - timedelta(days=random.randint(1, 1000)),
+  } for _ in range(SHOWS)])
+  db.session.commit()
+  counters.recount(now)
+
+
+def python_rank(matchmaker, venue_id, limit):
+  # the top scores, computed one candidate at a time
+  candidates = matchmaker._load()[Artist]
+  mask, city, lat, lng = matchmaker._subject(Venue, venue_id)
+  pair = matchmaker._pair_shows(Venue, venue_id, candidates)
+  scores = []
+  for i in range(len(candidates)):
+    masks = int(candidates.masks[i])
+    union = bin(masks | mask).count('1')
+    genre = bin(masks & mask).count('1') / union if union else 0.0
+    if candidates.cities[i] == city:
+      location = 1.0
+    elif np.isnan(candidates.lats[i]) or np.isnan(lat):
+      location = 0.0
+    else:
+      location = np.exp(-geo.distance_km(lat, lng, candidates.lats[i], candidates.lngs[i])
+        / matchmaking.LOCATION_SCALE_KM)
+    history = 0.5 * min(pair[i], matchmaking.PAIR_SHOWS) / matchmaking.PAIR_SHOWS + 0.5 * candidates.experience[i]
+    weights = matchmaking.WEIGHTS
+    scores.append((weights['genre'] * genre + weights['location'] * location + weights['history'] * history, i))
+  scores.sort(key=lambda score: -score[0])
+  return [round(score, 3) for score, _ in scores[:limit]]
+
+
+def timed(rank):
+  started = time.perf_counter()
+  for venue_id in range(1, ROUNDS + 1):
+    result = rank(venue_id)
+  return result, (time.perf_counter() - started) / ROUNDS * 1000
+
+
+def main(database_url='sqlite://'):
+  app = Flask(__name__)
+  app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+  app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+  db.init_app(app)
+
+  with app.app_context():
+    db.drop_all()
+    db.create_all()
+    seed()
+
+    matchmaker = matchmaking.Matchmaker()
+    started = time.perf_counter()
+    matchmaker._load()
+    print('{} artists loaded in {:.0f} ms'.format(
+      len(matchmaker._load()[Artist]), (time.perf_counter() - started) * 1000))
+
+    _, elapsed = timed(lambda id: matchmaker.rank(Venue, id, 20))
+    print('numpy ranking: {:.1f} ms'.format(elapsed))
+    _, elapsed = timed(lambda id: matchmaker.rank(Venue, id, 20, same_city=True))
+    print('numpy ranking, same city pool: {:.1f} ms'.format(elapsed))
+    expected = python_rank(matchmaker, 1, 20)
+    # many candidates tie, the scores are compared rather than the ids
+    assert [row['score'] for row in matchmaker.rank(Venue, 1, 20)['data']] == expected, 'rankings differ'
+    started = time.perf_counter()
+    python_rank(matchmaker, 1, 20)
+    print('python ranking: {:.1f} ms'.format((time.perf_counter() - started) * 1000))
+
+    matchmaker.changed(Artist, (ARTISTS // 2,))
+    started = time.perf_counter()
+    matchmaker._load()
+    print('one artist written, merged in {:.1f} ms'.format((time.perf_counter() - started) * 1000))
+
+
+if __name__ == '__main__':
+  main(*sys.argv[1:2])
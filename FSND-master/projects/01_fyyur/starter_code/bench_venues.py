@@ -0,0 +1,105 @@
+#----------------------------------------------------------------------------#
+# bench_venues.py
+#   times the /venues data, per-area and per-venue queries (N+1) against
+#   one join-and-count query and against queries.venue_areas, which reads
+#   the denormalized upcoming_shows_count column
+#
+#   python bench_venues.py [venues] [shows] [database_url]
+#   the default database is a throwaway in-memory sqlite database, pass a
+#   postgres url of an empty scratch database to measure on postgres
+#----------------------------------------------------------------------------#
+
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from itertools import groupby
+
+from flask import Flask
+from sqlalchemy import and_, func
+
+from models import db, Venue, Artist, Show
+import counters
+import queries
+
+CITIES = [('San Francisco', 'CA'), ('New York', 'NY'), ('Austin', 'TX'), ('Seattle', 'WA'),
+          ('Chicago', 'IL'), ('Denver', 'CO'), ('Boston', 'MA'), ('Portland', 'OR')]
+
+
+def seed(venue_count, show_count, artist_count=1000):
+  rng = random.Random(0)
+  now = datetime.now()
+  db.session.bulk_insert_mappings(Venue, [{
+    'id': i + 1, 'name': 'Venue {}'.format(i), 'phone': '000-000-0000',
+    'city': rng.choice(CITIES)[0] if i % 10 else 'Small Town {}'.format(i), 'state': rng.choice(CITIES)[1],
+  } for i in range(venue_count)])
+  db.session.bulk_insert_mappings(Artist, [{
+    'id': i + 1, 'name': 'Artist {}'.format(i), 'phone': '000-000-0000', 'city': 'Austin', 'state': 'TX',
+  } for i in range(artist_count)])
+  db.session.bulk_insert_mappings(Show, [{
+    'venue_id': rng.randint(1, venue_count), 'artist_id': rng.randint(1, artist_count),
+    'start_time': now + timedelta(days=rng.randint(-730, 365)),
+  } for _ in range(show_count)])
+  db.session.commit()
+
+
+def n_plus_one_areas(now):
+  # the straightforward version: one query per area, one count per venue
+  data = []
+  for city, state in db.session.query(Venue.city, Venue.state).distinct().order_by(Venue.state, Venue.city):
+    venues = Venue.query.filter_by(city=city, state=state).order_by(Venue.name).all()
+    data.append({'city': city, 'state': state, 'venues': [{
+      'id': venue.id,
+      'name': venue.name,
+      'num_upcoming_shows': Show.query.filter(Show.venue_id == venue.id, Show.start_time > now).count(),
+    } for venue in venues]})
+  return data
+
+
+def join_count_areas(now):
+  # one query, counting each venue's upcoming shows through an outer join
+  rows = db.session.query(
+      Venue.city, Venue.state, Venue.id, Venue.name, func.count(Show.id)
+    ).outerjoin(Show, and_(Show.venue_id == Venue.id, Show.start_time > now)) \
+    .group_by(Venue.id) \
+    .order_by(Venue.state, Venue.city, Venue.name) \
+    .all()
+  return [{'city': city, 'state': state, 'venues': [{
+    'id': id,
+    'name': name,
+    'num_upcoming_shows': num_upcoming_shows,
+  } for _, _, id, name, num_upcoming_shows in venues]}
+    for (city, state), venues in groupby(rows, key=lambda row: (row[0], row[1]))]
+
+
+def timed(function, *args):
+  start = time.perf_counter()
+  result = function(*args)
+  return result, time.perf_counter() - start
+
+
+def main(venue_count=10000, show_count=100000, database_url='sqlite://'):
+  app = Flask(__name__)
+  app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+  app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+  db.init_app(app)
+  with app.app_context():
+    db.create_all()
+    seed(venue_count, show_count)
+    now = datetime.now()
+    counters.recount(now)
+    print('{} venues, {} shows'.format(venue_count, show_count))
+    column, column_time = timed(queries.venue_areas)
+    aggregate, aggregate_time = timed(join_count_areas, now)
+    naive, naive_time = timed(n_plus_one_areas, now)
+    assert column == aggregate == naive
+    print('  N+1 queries     {:9.1f} ms'.format(naive_time * 1000))
+    print('  join and count  {:9.1f} ms'.format(aggregate_time * 1000))
+    print('  counter column  {:9.1f} ms'.format(column_time * 1000))
+    db.drop_all()
+
+
+if __name__ == '__main__':
+  args = sys.argv[1:]
+  main(*[int(arg) for arg in args[:2]], *args[2:3])
@@ -0,0 +1,454 @@
+#----------------------------------------------------------------------------#
+# Bulk import.
+#   venues, artists and shows from an uploaded CSV or JSON file, read a row
+#   at a time, validated with the same forms as the create pages and
+#   inserted in batches, one transaction per batch
+#
+#   CSV has a header row with the form field names, genres separated by ';'.
+#   venues may give latitude and longitude, else they are at their city centre.
+#   JSON is an array of objects or one object per line (JSON lines), both
+#   decoded an object at a time.
+#   a show row may repeat: repeat is 'daily', 'weekly' or a number of days,
+#   with until (a date, inclusive) or occurrences, e.g. a weekly residency
+#----------------------------------------------------------------------------#
+
+import codecs
+import csv
+import json
+from bisect import bisect_right, insort
+from json.decoder import WHITESPACE
+from datetime import timedelta
+from itertools import groupby
+
+import dateutil.parser
+from sqlalchemy import exc, or_
+from werkzeug.datastructures import MultiDict
+
+from forms import VenueForm, ArtistForm, ShowForm, normalize_genre
+from models import db, Venue, Artist, Show
+from queries import SHOW_DURATION, deleted, lock_for_booking
+from counters import apply_deltas
+from geo import geocode
+
+BATCH_SIZE = 500
+MAX_OCCURRENCES = 366
+
+# characters read at a time from a JSON array
+CHUNK_SIZE = 64 * 1024
+
+REPEATS = {'daily': 1, 'weekly': 7, 'biweekly': 14}
+FALSE_VALUES = ('', '0', 'false', 'no', 'n', 'off')
+
+
+#  Reading
+#  ----------------------------------------------------------------
+
+def read_rows(stream, filename):
+  # (line, row dict) pairs from an uploaded file, the format is picked from
+  # the file name. CSV and JSON lines are read a line at a time, a JSON
+  # array an item at a time (line is then the item's position). a file
+  # that stops being readable raises ValueError or csv.Error on that row
+  text = codecs.getreader('utf-8-sig')(stream)
+  if filename.lower().endswith('.csv'):
+    reader = csv.DictReader(text)
+    for row in reader:
+      yield reader.line_num, row
+    return
+
+  first = text.read(1)
+  while first.isspace():
+    first = text.read(1)
+  if first == '[':
+    for line, row in enumerate(_array_items(text), 1):
+      yield line, row
+    return
+  for line, raw in enumerate(_prepend(first, text), 1):
+    if raw.strip():
+      try:
+        yield line, json.loads(raw)
+      except ValueError:
+        yield line, None
+
+def _prepend(first, text):
+  lines = iter(text)
+  yield first + next(lines, '')
+  yield from lines
+
+def _array_items(text, chunk_size=CHUNK_SIZE):
+  # the items of a JSON array whose '[' has been read, each decoded once the
+  # buffer holds all of it. the buffer keeps the item being read and what
+  # follows it in the current chunk, never the whole array
+  decoder = json.JSONDecoder()
+  buffer, position, eof = '', 0, False
+  items, separator = 0, False
+  while True:
+    position = WHITESPACE.match(buffer, position).end()
+    if position < len(buffer):
+      char = buffer[position]
+      if char == ']' and (not items or separator):
+        return
+      if separator:
+        if char != ',':
+          raise ValueError('Expected , or ] after item {} of the JSON array.'.format(items))
+        position, separator = position + 1, False
+        continue
+      try:
+        item, end = decoder.raw_decode(buffer, position)
+      except ValueError as error:
+        if eof:
+          raise ValueError('The JSON array is not valid: {}.'.format(error))
+      else:
+        # at the end of the buffer a number may go on in the next chunk
+        if end < len(buffer) or eof:
+          yield item
+          position, items, separator = end, items + 1, True
+          continue
+    elif eof:
+      raise ValueError('The JSON array is not closed.')
+    chunk = text.read(chunk_size)
+    buffer, position, eof = buffer[position:] + chunk, 0, not chunk
+
+
+#  Validation
+#  ----------------------------------------------------------------
+
+def _formdata(row, booleans=()):
+  data = MultiDict()
+  for key, value in row.items():
+    if key is None or value is None:
+      continue
+    if key in booleans:
+      if str(value).strip().lower() in FALSE_VALUES or value is False:
+        continue
+      value = 'y'
+    if key == 'genres':
+      # "jazz" is imported as Jazz, genres not in the list fail validation
+      genres = value if isinstance(value, list) else str(value).split(';')
+      genres = [str(genre).strip() for genre in genres if str(genre).strip()]
+      data.setlist(key, [normalize_genre(genre) or genre for genre in genres])
+    elif isinstance(value, list):
+      data.setlist(key, [str(item) for item in value])
+    else:
+      data.add(key, str(value))
+  return data
+
+def _venue(row):
+  form = VenueForm(formdata=_formdata(row, ('seeking_talent',)), meta={'csrf': False})
+  errors = {} if form.validate() else dict(form.errors)
+  try:
+    point = _point(row) or geocode(form.city.data, form.state.data) or (None, None)
+  except ValueError as error:
+    errors['latitude'] = [str(error)]
+  if errors:
+    return None, errors
+  return [{
+    'name': form.name.data,
+    'city': form.city.data,
+    'state': form.state.data,
+    'address': form.address.data,
+    'phone': form.phone.data,
+    'genres': form.genres.data,
+    'image_link': form.image_link.data or None,
+    'facebook_link': form.facebook_link.data or None,
+    'website': form.website_link.data or None,
+    'seeking_talent': form.seeking_talent.data,
+    'seeking_description': form.seeking_description.data or None,
+    'latitude': point[0],
+    'longitude': point[1],
+  }], None
+
+def _point(row):
+  # explicit latitude / longitude of a venue row, None to geocode its city
+  if row.get('latitude') in (None, '') and row.get('longitude') in (None, ''):
+    return None
+  try:
+    lat, lng = float(row['latitude']), float(row['longitude'])
+  except (KeyError, TypeError, ValueError):
+    raise ValueError('latitude and longitude must both be numbers.')
+  if not -90 <= lat <= 90 or not -180 <= lng <= 180:
+    raise ValueError('latitude and longitude are out of range.')
+  return lat, lng
+
+def _artist(row):
+  form = ArtistForm(formdata=_formdata(row, ('seeking_venue',)), meta={'csrf': False})
+  if not form.validate():
+    return None, form.errors
+  return [{
+    'name': form.name.data,
+    'city': form.city.data,
+    'state': form.state.data,
+    'phone': form.phone.data,
+    'genres': form.genres.data,
+    'image_link': form.image_link.data or None,
+    'facebook_link': form.facebook_link.data or None,
+    'website': form.website_link.data or None,
+    'seeking_venue': form.seeking_venue.data,
+    'seeking_description': form.seeking_description.data or None,
+  }], None
+
+def _show(row):
+  # one mapping per occurrence of the show
+  form = ShowForm(formdata=_formdata(row), meta={'csrf': False})
+  errors = {} if form.validate() else dict(form.errors)
+  ids = {}
+  for field in ('artist_id', 'venue_id'):
+    try:
+      ids[field] = int(getattr(form, field).data)
+    except (TypeError, ValueError):
+      errors[field] = ['Not a valid id.']
+  try:
+    times = _occurrences(form.start_time.data, row) if not errors else []
+  except ValueError as error:
+    errors['repeat'] = [str(error)]
+  if errors:
+    return None, errors
+  return [dict(ids, start_time=start_time) for start_time in times], None
+
+def _occurrences(start_time, row):
+  repeat = str(row.get('repeat') or '').strip().lower()
+  if not repeat:
+    return [start_time]
+  if repeat in REPEATS:
+    step = timedelta(days=REPEATS[repeat])
+  elif repeat.isdigit() and int(repeat) > 0:
+    step = timedelta(days=int(repeat))
+  else:
+    raise ValueError('repeat must be daily, weekly, biweekly or a number of days.')
+
+  occurrences, until = None, None
+  if row.get('occurrences'):
+    occurrences = int(row['occurrences'])
+  elif row.get('until'):
+    until = dateutil.parser.parse(str(row['until']))
+    if len(str(row['until']).strip()) <= 10:
+      # a bare date includes the shows on that day
+      until += timedelta(days=1, microseconds=-1)
+  else:
+    raise ValueError('a repeating show needs until or occurrences.')
+
+  times = []
+  start = start_time
+  while (occurrences is None or len(times) < occurrences) and (until is None or start <= until):
+    if len(times) == MAX_OCCURRENCES:
+      raise ValueError('a repeating show has at most {} occurrences.'.format(MAX_OCCURRENCES))
+    times.append(start)
+    start += step
+  if not times:
+    raise ValueError('a repeating show needs at least one occurrence.')
+  return times
+
+
+#  Importing
+#  ----------------------------------------------------------------
+
+class ImportReport:
+
+  def __init__(self, kind):
+    self.kind = kind
+    self.rows = 0
+    # rows inserted, and the records they made (a repeating show row makes several)
+    self.inserted = 0
+    self.records = 0
+    self.errors = []
+    # {'after_line', 'error'} when the file could not be read to the end
+    self.stopped = None
+    self.venue_ids = set()
+    self.artist_ids = set()
+
+  def error(self, line, errors):
+    self.errors.append({'line': line, 'errors': errors})
+
+  def to_dict(self):
+    return {
+      'kind': self.kind,
+      'rows': self.rows,
+      'inserted': self.inserted,
+      'records': self.records,
+      'failed': len(self.errors),
+      'errors': self.errors,
+      'stopped': self.stopped,
+    }
+
+
+class Importer:
+  # validates rows and inserts them batch_size mappings per transaction.
+  # names already taken (in the database or earlier in the file) and shows
+  # of unknown venues or artists or overlapping other bookings are reported
+  # against their line, checked with one query per batch. the venues and
+  # artists of a batch of shows are locked from the check to the commit. a
+  # batch the database still rejects is retried a row at a time so only the
+  # failing rows are reported. a file that cannot be read to the end stops
+  # the import there: the rows before it are inserted, report.stopped says
+  # where and why
+
+  def __init__(self, kind, batch_size=BATCH_SIZE):
+    self.kind = kind
+    self.model, self.validate = {
+      'venues': (Venue, _venue),
+      'artists': (Artist, _artist),
+      'shows': (Show, _show),
+    }[kind]
+    self.batch_size = batch_size
+    self.report = ImportReport(kind)
+    self._names = set()
+
+  def run(self, rows):
+    batch = []
+    rows = iter(rows)
+    line = 0
+    while True:
+      try:
+        line, row = next(rows)
+      except StopIteration:
+        break
+      except (ValueError, csv.Error) as error:
+        self.report.stopped = {'after_line': line, 'error': str(error)}
+        break
+      self.report.rows += 1
+      if not isinstance(row, dict):
+        self.report.error(line, {'row': ['Not a JSON object.']})
+        continue
+      mappings, errors = self.validate(row)
+      if errors:
+        self.report.error(line, errors)
+        continue
+      batch.extend((line, mapping) for mapping in mappings)
+      if len(batch) >= self.batch_size:
+        self._insert(batch)
+        batch = []
+    if batch:
+      self._insert(batch)
+    self.report.errors.sort(key=lambda error: error['line'])
+    return self.report
+
+  def _insert(self, batch):
+    batch = self._check(batch)
+    if not batch:
+      return
+    try:
+      self._insert_mappings([mapping for _, mapping in batch])
+      db.session.commit()
+    except exc.SQLAlchemyError:
+      db.session.rollback()
+      # a transaction per row, so a repeating show is inserted or refused whole
+      for line, row in groupby(batch, key=lambda entry: entry[0]):
+        row = list(row)
+        if self.kind == 'shows':
+          # the locks went with the rollback, take them and check again
+          row = self._check(row)
+          if not row:
+            db.session.rollback()
+            continue
+        try:
+          self._insert_mappings([mapping for _, mapping in row])
+          db.session.commit()
+        except exc.SQLAlchemyError as error:
+          db.session.rollback()
+          self.report.error(line, {'row': [str(error.orig if hasattr(error, 'orig') else error)]})
+          continue
+        self._inserted(row)
+      return
+    self._inserted(batch)
+
+  def _insert_mappings(self, mappings):
+    db.session.bulk_insert_mappings(self.model, mappings)
+    if self.kind == 'shows':
+      # bulk inserts skip the session events that maintain the counters
+      apply_deltas(db.session, [
+        (mapping['venue_id'], mapping['artist_id'], mapping['start_time'], 1) for mapping in mappings])
+
+  def _inserted(self, batch):
+    # the mappings of a row are next to each other and never split across batches
+    self.report.inserted += len({line for line, _ in batch})
+    self.report.records += len(batch)
+    if self.kind == 'shows':
+      self.report.venue_ids.update(mapping['venue_id'] for _, mapping in batch)
+      self.report.artist_ids.update(mapping['artist_id'] for _, mapping in batch)
+
+  def _check(self, batch):
+    if self.kind == 'shows':
+      # locked until the batch is committed, see queries.lock_for_booking
+      venues, artists = lock_for_booking(
+        {mapping['venue_id'] for _, mapping in batch}, {mapping['artist_id'] for _, mapping in batch})
+      checked, failed = [], set()
+      for line, mapping in batch:
+        errors = {}
+        if mapping['venue_id'] not in venues:
+          errors['venue_id'] = ['No venue with id {}.'.format(mapping['venue_id'])]
+        if mapping['artist_id'] not in artists:
+          errors['artist_id'] = ['No artist with id {}.'.format(mapping['artist_id'])]
+        if errors:
+          if line not in failed:
+            failed.add(line)
+            self.report.error(line, errors)
+        else:
+          checked.append((line, mapping))
+      return self._check_bookings(checked)
+
+    taken = _existing(self.model.name, {mapping['name'] for _, mapping in batch})
+    checked = []
+    for line, mapping in batch:
+      if mapping['name'] in taken or mapping['name'] in self._names:
+        self.report.error(line, {'name': ['{} already exists.'.format(mapping['name'])]})
+        continue
+      self._names.add(mapping['name'])
+      checked.append((line, mapping))
+    return checked
+
+  def _check_bookings(self, batch):
+    # rows with a show overlapping one already booked, or one accepted
+    # earlier in the file, are refused whole (every occurrence)
+    if not batch:
+      return batch
+    booked = _booked(batch, SHOW_DURATION)
+    checked = []
+    for line, occurrences in groupby(batch, key=lambda entry: entry[0]):
+      occurrences = list(occurrences)
+      errors = {}
+      for _, mapping in occurrences:
+        for side in ('venue', 'artist'):
+          key = (side, mapping[side + '_id'])
+          if _overlaps(booked.get(key, ()), mapping['start_time'], SHOW_DURATION):
+            errors.setdefault(side + '_id', []).append('The {} is already booked around {}.'.format(
+              side, mapping['start_time'].isoformat(' ')))
+      if errors:
+        self.report.error(line, errors)
+        continue
+      for _, mapping in occurrences:
+        insort(booked.setdefault(('venue', mapping['venue_id']), []), mapping['start_time'])
+        insort(booked.setdefault(('artist', mapping['artist_id']), []), mapping['start_time'])
+      checked.extend(occurrences)
+    return checked
+
+def _booked(batch, duration):
+  # sorted start times already booked per ('venue' | 'artist', id) around the
+  # batch, from one query over the batch's venues, artists and time window.
+  # shows of soft deleted venues or artists do not count, as in
+  # queries.booking_conflicts
+  times = [mapping['start_time'] for _, mapping in batch]
+  venue_ids = {mapping['venue_id'] for _, mapping in batch}
+  artist_ids = {mapping['artist_id'] for _, mapping in batch}
+  rows = db.session.query(Show.venue_id, Show.artist_id, Show.start_time).filter(
+    or_(Show.venue_id.in_(venue_ids), Show.artist_id.in_(artist_ids)),
+    Show.start_time > min(times) - duration,
+    Show.start_time < max(times) + duration,
+    Show.venue_id.notin_(deleted(Venue)),
+    Show.artist_id.notin_(deleted(Artist)))
+  booked = {}
+  for venue_id, artist_id, start_time in rows:
+    if venue_id in venue_ids:
+      booked.setdefault(('venue', venue_id), []).append(start_time)
+    if artist_id in artist_ids:
+      booked.setdefault(('artist', artist_id), []).append(start_time)
+  for times in booked.values():
+    times.sort()
+  return booked
+
+def _overlaps(times, start_time, duration):
+  position = bisect_right(times, start_time - duration)
+  return position < len(times) and times[position] < start_time + duration
+
+def _existing(column, values, *conditions):
+  if not values:
+    return set()
+  return {value for value, in db.session.query(column).filter(column.in_(values), *conditions)}
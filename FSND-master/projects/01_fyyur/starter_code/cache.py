@@ -0,0 +1,209 @@
+#----------------------------------------------------------------------------#
+# Page cache.
+#   rendered detail pages, keyed by entity and a version counter that is
+#   bumped whenever the entity or one of its shows is written, so a popular
+#   venue page is served without running its queries or its template
+#----------------------------------------------------------------------------#
+
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+
+#  Backends
+#  ----------------------------------------------------------------
+#  get(key), set(key, value, timeout) and incr(key), values are str/bytes,
+#  timeout is in seconds (None keeps the value until it is evicted).
+#  counters made by incr must outlive the pages they version: one evicted
+#  would restart at 0 and bring back the pages cached under the old numbers
+
+class LRUBackend:
+  # in-process, keeps at most maxsize entries, least recently used out
+  # first. counters are kept apart and never evicted, there is one per
+  # venue or artist written at most
+
+  def __init__(self, maxsize=1024, clock=time.monotonic):
+    self.maxsize = maxsize
+    self.clock = clock
+    self._entries = OrderedDict()
+    self._counters = {}
+    self._lock = threading.Lock()
+
+  def __len__(self):
+    return len(self._entries)
+
+  def get(self, key):
+    with self._lock:
+      if key in self._counters:
+        return self._counters[key]
+      entry = self._entries.get(key)
+      if entry is None:
+        return None
+      value, expires = entry
+      if expires is not None and expires <= self.clock():
+        del self._entries[key]
+        return None
+      self._entries.move_to_end(key)
+      return value
+
+  def set(self, key, value, timeout=None):
+    expires = None if timeout is None else self.clock() + timeout
+    with self._lock:
+      self._entries[key] = (value, expires)
+      self._entries.move_to_end(key)
+      while len(self._entries) > self.maxsize:
+        self._entries.popitem(last=False)
+
+  def incr(self, key):
+    with self._lock:
+      self._counters[key] = self._counters.get(key, 0) + 1
+      return self._counters[key]
+
+  def clear(self):
+    with self._lock:
+      self._entries.clear()
+      self._counters.clear()
+
+
+class RedisBackend:
+  # shared between processes, client is a redis.Redis or anything with the
+  # same get / set(ex=) / incr methods, such as LocalRedis. pages are set
+  # with a timeout and counters without, run redis with
+  # maxmemory-policy volatile-lru so only pages are evicted
+
+  def __init__(self, client, prefix='fyyur:'):
+    self.client = client
+    self.prefix = prefix
+
+  def get(self, key):
+    return self.client.get(self.prefix + key)
+
+  def set(self, key, value, timeout=None):
+    self.client.set(self.prefix + key, value, ex=None if timeout is None else max(int(timeout), 1))
+
+  def incr(self, key):
+    return self.client.incr(self.prefix + key)
+
+
+class LocalRedis:
+  # the subset of the redis client used by RedisBackend, in process memory,
+  # for running with a shared backend configured but no redis server
+
+  def __init__(self, clock=time.time):
+    self.clock = clock
+    self._values = {}
+    self._lock = threading.Lock()
+
+  def get(self, key):
+    with self._lock:
+      value, expires = self._values.get(key, (None, None))
+      if expires is not None and expires <= self.clock():
+        del self._values[key]
+        return None
+      return value
+
+  def set(self, key, value, ex=None):
+    with self._lock:
+      self._values[key] = (value, None if ex is None else self.clock() + ex)
+
+  def incr(self, key):
+    with self._lock:
+      value, expires = self._values.get(key, (0, None))
+      self._values[key] = (int(value) + 1, expires)
+      return int(value) + 1
+
+
+def make_backend(config):
+  # PAGE_CACHE_REDIS_URL selects the shared backend, 'local' for LocalRedis,
+  # otherwise pages are cached in process with PAGE_CACHE_SIZE entries.
+  # versions are bumped in the process that commits the write, so with more
+  # than one worker (WORKERS) the others would keep serving stale pages:
+  # only redis is shared between them
+  url = config.get('PAGE_CACHE_REDIS_URL')
+  if config.get('WORKERS', 1) > 1 and (not url or url == 'local'):
+    raise RuntimeError('PAGE_CACHE_REDIS_URL must name a redis server when WORKERS is more than 1')
+  if not url:
+    return LRUBackend(config.get('PAGE_CACHE_SIZE', 1024))
+  if url == 'local':
+    return RedisBackend(LocalRedis())
+  import redis
+  return RedisBackend(redis.Redis.from_url(url))
+
+
+#  Page cache
+#  ----------------------------------------------------------------
+
+class PageCache:
+
+  def __init__(self, backend=None, timeout=300):
+    self.backend = backend or LRUBackend()
+    self.timeout = timeout
+
+  def version(self, kind, id):
+    return int(self.backend.get('version:{}:{}'.format(kind, id)) or 0)
+
+  def bump(self, kind, id):
+    # every cached page of the entity is orphaned, old entries age out
+    self.backend.incr('version:{}:{}'.format(kind, id))
+
+  def key(self, kind, id, variant=''):
+    return 'page:{}:{}:{}:{}'.format(kind, id, self.version(kind, id), variant)
+
+  def get(self, kind, id, variant=''):
+    page = self.backend.get(self.key(kind, id, variant))
+    if isinstance(page, bytes):
+      page = page.decode('utf-8')
+    return page
+
+  def set(self, kind, id, page, variant='', timeout=None):
+    timeout = self.timeout if timeout is None else min(timeout, self.timeout)
+    if timeout > 0:
+      self.backend.set(self.key(kind, id, variant), page, timeout)
+
+  def page(self, kind, id, render, variant=''):
+    # the cached page, or render() -> (page, timeout) stored and returned;
+    # render returns a timeout of None for the default one
+    page = self.get(kind, id, variant)
+    if page is None:
+      page, timeout = render()
+      self.set(kind, id, page, variant, timeout)
+    return page
+
+
+#  Invalidation
+#  ----------------------------------------------------------------
+
+def invalidate_on_commit(page_cache, venue, artist, show):
+  # bumps the version of every venue and artist written in a transaction
+  # once it commits, a show write bumps both its venue and its artist
+
+  def pending(session):
+    return session.info.setdefault('page_cache_pending', set())
+
+  @event.listens_for(Session, 'after_flush')
+  def collect(session, flush_context):
+    for target in list(session.new) + list(session.dirty) + list(session.deleted):
+      if isinstance(target, venue):
+        pending(session).add(('venue', target.id))
+      elif isinstance(target, artist):
+        pending(session).add(('artist', target.id))
+      elif isinstance(target, show):
+        # a show moved to another venue or artist changes both pages
+        state = inspect(target)
+        for kind in ('venue', 'artist'):
+          history = state.attrs[kind + '_id'].history
+          ids = set(history.added or ()) | set(history.deleted or ()) | {getattr(target, kind + '_id')}
+          pending(session).update((kind, id) for id in ids)
+
+  @event.listens_for(Session, 'after_commit')
+  def bump(session):
+    for kind, id in session.info.pop('page_cache_pending', ()):
+      if id is not None:
+        page_cache.bump(kind, id)
+
+  @event.listens_for(Session, 'after_rollback')
+  def discard(session):
+    session.info.pop('page_cache_pending', None)
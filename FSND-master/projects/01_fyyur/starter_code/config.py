@@ -10,3 +10,22 @@ DEBUG = True
 # TODO IMPLEMENT DATABASE URL
 SQLALCHEMY_DATABASE_URI = 'postgresql://Maurice@localhost:5432/fyyur'
 
+
+# Rendered venue and artist pages (see cache.py)
+# set PAGE_CACHE_REDIS_URL to share them between processes,
+# 'local' uses an in-process stand-in for redis
+PAGE_CACHE_SIZE = 1024
+PAGE_CACHE_TIMEOUT = 300
+PAGE_CACHE_REDIS_URL = os.environ.get('PAGE_CACHE_REDIS_URL')
+
+# Processes serving the app, as gunicorn reads it. more than one
+# needs PAGE_CACHE_REDIS_URL, pages cached in one process are not
+# invalidated by writes made in another
+WORKERS = int(os.environ.get('WEB_CONCURRENCY', 1))
+
+# Most venues / artists listed for a search
+SEARCH_RESULTS_LIMIT = 50
+
+# Venues and artists with more shows than this are soft deleted,
+# and purged in the background with `flask purge-deleted`
+SOFT_DELETE_MIN_SHOWS = 10000
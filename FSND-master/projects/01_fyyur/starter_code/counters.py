@@ -0,0 +1,146 @@
+#----------------------------------------------------------------------------#
+# Show counters.
+#   upcoming_shows_count / past_shows_count on Venue and Artist, so the
+#   listing and search pages read a column instead of counting shows
+#
+#   a show is counted as upcoming while it starts after the rolled_over_at
+#   time of the ShowCounters row. show writes adjust the counters of their
+#   venue and artist in the same transaction, and rollover() (run every few
+#   minutes with `flask rollover-counters`) moves the shows that started
+#   since the last run from upcoming to past and advances rolled_over_at
+#----------------------------------------------------------------------------#
+
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import and_, event, func, inspect, select
+from sqlalchemy.orm import Session
+
+from models import db, Venue, Artist, Show, ShowCounters
+
+SIDES = ((Venue, 'venue_id'), (Artist, 'artist_id'))
+
+
+def rolled_over_at(session, lock=False, exclusive=False):
+  # the current rollover time, None on a database created before the
+  # ShowCounters row was (see models.py), writes then split at now. lock=True
+  # takes a shared lock on the row, so a show write and a rollover running
+  # at the same time cannot both miss or both count the same show.
+  # exclusive=True is for the rollover, which updates the row: two shared
+  # locks could not both be upgraded and would deadlock
+  query = select([ShowCounters.rolled_over_at]).where(ShowCounters.id == 1)
+  if lock:
+    query = query.with_for_update(read=not exclusive)
+  return session.execute(query).scalar()
+
+
+def live_show():
+  # shows of soft deleted venues or artists are already off the counters
+  return and_(
+    Show.venue_id.notin_(select([Venue.id]).where(Venue.deleted_at.isnot(None))),
+    Show.artist_id.notin_(select([Artist.id]).where(Artist.deleted_at.isnot(None))))
+
+
+#  Maintenance on write
+#  ----------------------------------------------------------------
+
+def apply_deltas(session, shows):
+  # shows are (venue_id, artist_id, start_time, +1 | -1), one UPDATE per
+  # venue or artist whose counters change
+  if not shows:
+    return
+  since = rolled_over_at(session, lock=True) or datetime.now()
+  deltas = defaultdict(lambda: [0, 0])
+  for venue_id, artist_id, start_time, sign in shows:
+    upcoming = start_time is None or start_time > since
+    for (model, _), id in zip(SIDES, (venue_id, artist_id)):
+      if id is not None:
+        deltas[model, id][0 if upcoming else 1] += sign
+  for (model, id), (upcoming, past) in deltas.items():
+    if upcoming or past:
+      session.execute(model.__table__.update()
+        .where(model.id == id)
+        .values(upcoming_shows_count=model.upcoming_shows_count + upcoming,
+                past_shows_count=model.past_shows_count + past))
+
+def _show_changes(session):
+  changes = []
+  for show in session.new:
+    if isinstance(show, Show):
+      changes.append((show.venue_id, show.artist_id, show.start_time, 1))
+  for show in session.deleted:
+    if isinstance(show, Show):
+      changes.append((show.venue_id, show.artist_id, show.start_time, -1))
+  for show in session.dirty:
+    if not isinstance(show, Show):
+      continue
+    state = inspect(show)
+    old, new = [], []
+    for key in ('venue_id', 'artist_id', 'start_time'):
+      history = state.attrs[key].history
+      old.append(history.deleted[0] if history.deleted else getattr(show, key))
+      new.append(getattr(show, key))
+    if old != new:
+      changes.append(tuple(old) + (-1,))
+      changes.append(tuple(new) + (1,))
+  return changes
+
+def maintain_on_write():
+  # counters follow every show inserted, deleted or moved through the ORM,
+  # after the flush so the ids of new venues and artists are known.
+  # bulk writes skip these events and call apply_deltas themselves
+
+  @event.listens_for(Session, 'after_flush')
+  def count(session, flush_context):
+    apply_deltas(session, _show_changes(session))
+
+
+#  Rollover
+#  ----------------------------------------------------------------
+
+def rollover(now=None):
+  # moves the shows starting in (rolled_over_at, now] from upcoming to past
+  # with one grouped UPDATE per side, returns the number of shows moved
+  now = now or datetime.now()
+  since = rolled_over_at(db.session, lock=True, exclusive=True)
+  if since is None:
+    return recount(now)
+  if now <= since:
+    db.session.rollback()
+    return 0
+
+  db.session.execute(ShowCounters.__table__.update()
+    .where(ShowCounters.id == 1)
+    .values(rolled_over_at=now))
+  window = (Show.start_time > since, Show.start_time <= now, live_show())
+  moved = db.session.query(func.count(Show.id)).filter(*window).scalar()
+  for model, fk in SIDES:
+    started = db.session.query(getattr(Show, fk).label('id'), func.count(Show.id).label('shows')) \
+      .filter(*window) \
+      .group_by(getattr(Show, fk)) \
+      .subquery()
+    count = select([started.c.shows]).where(started.c.id == model.id).as_scalar()
+    db.session.execute(model.__table__.update()
+      .where(model.id.in_(select([started.c.id])))
+      .values(upcoming_shows_count=model.upcoming_shows_count - count,
+              past_shows_count=model.past_shows_count + count))
+  db.session.commit()
+  return moved
+
+def recount(now=None):
+  # rebuilds every counter from the Show table, to initialise them or to
+  # repair them after writes that went around the ORM
+  now = now or datetime.now()
+  db.session.execute(ShowCounters.__table__.delete())
+  db.session.execute(ShowCounters.__table__.insert().values(id=1, rolled_over_at=now))
+  for model, fk in SIDES:
+    def shows(condition):
+      return select([func.count(Show.id)]) \
+        .where(getattr(Show, fk) == model.id) \
+        .where(and_(condition, live_show())) \
+        .as_scalar()
+    db.session.execute(model.__table__.update().values(
+      upcoming_shows_count=shows(Show.start_time > now),
+      past_shows_count=shows(Show.start_time <= now)))
+  db.session.commit()
+  return db.session.query(func.count(Show.id)).scalar()
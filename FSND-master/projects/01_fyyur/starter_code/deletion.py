@@ -0,0 +1,90 @@
+#----------------------------------------------------------------------------#
+# Deletion.
+#   set-based delete of venues and artists: a fixed number of statements
+#   whatever the number of shows, no Show (or Venue / Artist) objects loaded
+#
+#   delete() removes the entity and its shows at once. soft_delete() only
+#   marks it deleted_at, which hides it and its shows everywhere, and leaves
+#   the rows to purge_deleted() (`flask purge-deleted`), which removes the
+#   shows in bounded batches so a long history never holds one huge lock
+#----------------------------------------------------------------------------#
+
+from datetime import datetime
+
+from sqlalchemy import and_, func, select
+
+from models import db, Venue, Artist, Show
+from counters import rolled_over_at
+
+PURGE_BATCH = 10000
+
+# the Show column pointing at the entity, and the other side of its shows
+SIDES = {
+  Venue: (Show.venue_id, Artist, Show.artist_id),
+  Artist: (Show.artist_id, Venue, Show.venue_id),
+}
+
+
+def _discount(model, id):
+  # takes the entity's shows off the counters of the venues / artists on
+  # their other side, returns the ids of those. two statements
+  fk, other, other_fk = SIDES[model]
+  others = [other_id for other_id, in db.session.query(other_fk).filter(fk == id).distinct()]
+  if not others:
+    return others
+  since = rolled_over_at(db.session, lock=True) or datetime.now()
+
+  def shows(condition):
+    return select([func.count(Show.id)]) \
+      .where(and_(fk == id, other_fk == other.id, condition)) \
+      .as_scalar()
+  db.session.execute(other.__table__.update()
+    .where(other.id.in_(others))
+    .values(upcoming_shows_count=other.upcoming_shows_count - shows(Show.start_time > since),
+            past_shows_count=other.past_shows_count - shows(Show.start_time <= since)))
+  return others
+
+def delete(model, id):
+  # deletes the entity and all its shows in one transaction, returns the
+  # ids of the other side that lost shows, None when there is no such entity.
+  # shows are deleted explicitly rather than through ON DELETE CASCADE so
+  # this also holds on sqlite, where foreign keys are not enforced by default
+  fk = SIDES[model][0]
+  deleted_at = db.session.query(model.deleted_at).filter(model.id == id).first()
+  if deleted_at is None:
+    return None
+  others = _discount(model, id) if deleted_at[0] is None else []
+  db.session.query(Show).filter(fk == id).delete(synchronize_session=False)
+  db.session.query(model).filter(model.id == id).delete(synchronize_session=False)
+  db.session.commit()
+  return others
+
+def soft_delete(model, id, now=None):
+  # marks the entity deleted, its shows are purged later. same return value
+  now = now or datetime.now()
+  deleted_at = db.session.query(model.deleted_at).filter(model.id == id).first()
+  if deleted_at is None or deleted_at[0] is not None:
+    return None
+  others = _discount(model, id)
+  db.session.query(model).filter(model.id == id) \
+    .update({model.deleted_at: now}, synchronize_session=False)
+  db.session.commit()
+  return others
+
+def purge_deleted(batch=PURGE_BATCH):
+  # removes soft deleted venues and artists, their shows batch rows per
+  # transaction first, returns the number of entities removed
+  purged = 0
+  for model in (Venue, Artist):
+    fk = SIDES[model][0]
+    for id, in db.session.query(model.id).filter(model.deleted_at.isnot(None)).all():
+      while True:
+        ids = select([Show.id]).where(fk == id).limit(batch)
+        deleted = db.session.query(Show).filter(Show.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        if deleted < batch:
+          break
+      db.session.query(model).filter(model.id == id).delete(synchronize_session=False)
+      db.session.commit()
+      purged += 1
+  return purged
@@ -0,0 +1,296 @@
+#----------------------------------------------------------------------------#
+# Geo.
+#   venue coordinates and "venues within N km of X" queries
+#
+#   coordinates come from geocodes.csv, an offline table of city centres
+#   looked up by (city, state), or are given explicitly on import. on
+#   postgres a query is a range scan of the (latitude, longitude) index over
+#   the bounding box of the circle, elsewhere (sqlite) an in-process grid
+#   index loaded on first query and updated as venues are committed. either
+#   way only the venues in the box have their distance computed
+#----------------------------------------------------------------------------#
+
+import csv
+import math
+import os
+import threading
+from functools import lru_cache
+
+from sqlalchemy import event, inspect, or_
+from sqlalchemy.orm import Session
+
+from models import db, Venue
+
+EARTH_RADIUS_KM = 6371.0088
+
+GEOCODES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'geocodes.csv')
+
+# grid cells are CELL_DEGREES of latitude by CELL_DEGREES of longitude
+CELL_DEGREES = 0.5
+
+
+def distance_km(lat1, lng1, lat2, lng2):
+  # great-circle (haversine) distance
+  lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+  a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+  return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+def bounding_box(lat, lng, km):
+  # (south, north, [(west, east), ...]) around the circle, two longitude
+  # ranges when it crosses the antimeridian, [(-180, 180)] near a pole
+  delta = math.degrees(km / EARTH_RADIUS_KM)
+  south, north = max(-90.0, lat - delta), min(90.0, lat + delta)
+  if south <= -90 or north >= 90:
+    return south, north, [(-180.0, 180.0)]
+  # the widest longitude span is at the latitude furthest from the equator
+  width = math.degrees(math.asin(min(1.0, math.sin(km / EARTH_RADIUS_KM) / math.cos(math.radians(lat)))))
+  west, east = lng - width, lng + width
+  if west < -180:
+    return south, north, [(west + 360, 180.0), (-180.0, east)]
+  if east > 180:
+    return south, north, [(west, 180.0), (-180.0, east - 360)]
+  return south, north, [(west, east)]
+
+
+#  Geocoding
+#  ----------------------------------------------------------------
+
+def _place(city, state):
+  return ' '.join((city or '').split()).lower(), (state or '').strip().upper()
+
+@lru_cache(maxsize=None)
+def geocodes(path=GEOCODES_FILE):
+  # {(city, state): (latitude, longitude)}, read once
+  with open(path, newline='', encoding='utf-8') as file:
+    return {
+      _place(row['city'], row['state']): (float(row['latitude']), float(row['longitude']))
+      for row in csv.DictReader(file)
+    }
+
+def geocode(city, state):
+  # (latitude, longitude) of the city centre, None for a city not listed
+  return geocodes().get(_place(city, state))
+
+def geocode_venues():
+  # fills in the coordinates of the venues that have none and are in the
+  # table, one UPDATE per city. returns the number of venues located
+  located = 0
+  places = db.session.query(Venue.city, Venue.state) \
+    .filter(Venue.latitude.is_(None)) \
+    .distinct() \
+    .all()
+  for city, state in places:
+    point = geocode(city, state)
+    if point is None:
+      continue
+    located += db.session.query(Venue) \
+      .filter(Venue.city == city, Venue.state == state, Venue.latitude.is_(None)) \
+      .update({Venue.latitude: point[0], Venue.longitude: point[1]}, synchronize_session=False)
+    db.session.commit()
+  return located
+
+def locate_on_write():
+  # venues written through the ORM without coordinates are placed at their
+  # city centre, and moved with it when their city changes. bulk writes
+  # skip these events and call geocode themselves
+
+  @event.listens_for(Venue, 'before_insert')
+  def locate(mapper, connection, venue):
+    if venue.latitude is None:
+      venue.latitude, venue.longitude = geocode(venue.city, venue.state) or (None, None)
+
+  @event.listens_for(Venue, 'before_update')
+  def relocate(mapper, connection, venue):
+    state = inspect(venue)
+    moved = state.attrs.city.history.has_changes() or state.attrs.state.history.has_changes()
+    located = state.attrs.latitude.history.has_changes() or state.attrs.longitude.history.has_changes()
+    if moved and not located:
+      venue.latitude, venue.longitude = geocode(venue.city, venue.state) or (None, None)
+
+
+#  Grid index
+#  ----------------------------------------------------------------
+
+class GridIndex:
+  # ids bucketed by CELL_DEGREES cells of (latitude, longitude), a query
+  # visits the cells overlapping its bounding box and measures the points
+  # in them. each point carries a flag (here seeking_talent) to filter on
+
+  def __init__(self, cell=CELL_DEGREES):
+    self.cell = cell
+    self._points = {}
+    self._cells = {}
+    self._lock = threading.Lock()
+
+  def __len__(self):
+    return len(self._points)
+
+  def _key(self, lat, lng):
+    return int(math.floor(lat / self.cell)), int(math.floor(lng / self.cell))
+
+  def add(self, id, lat, lng, flag=False):
+    with self._lock:
+      self._remove(id)
+      if lat is None or lng is None:
+        return
+      self._points[id] = (lat, lng, flag)
+      self._cells.setdefault(self._key(lat, lng), set()).add(id)
+
+  def remove(self, id):
+    with self._lock:
+      self._remove(id)
+
+  def _remove(self, id):
+    point = self._points.pop(id, None)
+    if point is None:
+      return
+    key = self._key(point[0], point[1])
+    ids = self._cells.get(key)
+    if ids is not None:
+      ids.discard(id)
+      if not ids:
+        del self._cells[key]
+
+  def clear(self):
+    with self._lock:
+      self._points = {}
+      self._cells = {}
+
+  def within(self, lat, lng, km, flag=None):
+    # [(distance, id)] of the points within km, nearest first, only those
+    # whose flag is flag unless it is None
+    south, north, ranges = bounding_box(lat, lng, km)
+    rows = range(self._key(south, 0)[0], self._key(north, 0)[0] + 1)
+    found = []
+    with self._lock:
+      for west, east in ranges:
+        columns = range(self._key(0, west)[1], self._key(0, east)[1] + 1)
+        for row in rows:
+          for column in columns:
+            for id in self._cells.get((row, column), ()):
+              point_lat, point_lng, point_flag = self._points[id]
+              if flag is not None and point_flag != flag:
+                continue
+              distance = distance_km(lat, lng, point_lat, point_lng)
+              if distance <= km:
+                found.append((distance, id))
+    found.sort()
+    return found
+
+
+#  Nearby venues
+#  ----------------------------------------------------------------
+
+class VenueLocator:
+  # nearby(lat, lng, km) -> {"count": ..., "data": [{id, name, city, state,
+  # distance_km, num_upcoming_shows}]}, the nearest limit venues first
+
+  def __init__(self, limit=50):
+    self.limit = limit
+    self.grid = GridIndex()
+    self.use_postgres = None
+    self._loaded = False
+    self._lock = threading.Lock()
+
+  def _dialect(self):
+    if self.use_postgres is None:
+      self.use_postgres = db.engine.dialect.name == 'postgresql'
+
+  def _load(self):
+    with self._lock:
+      if self._loaded:
+        return
+      self.grid.clear()
+      for id, lat, lng, seeking_talent in db.session.query(
+          Venue.id, Venue.latitude, Venue.longitude, Venue.seeking_talent) \
+          .filter(Venue.deleted_at.is_(None), Venue.latitude.isnot(None)):
+        self.grid.add(id, lat, lng, bool(seeking_talent))
+      self._loaded = True
+
+  def reset(self):
+    # reloaded on the next query, after writes the events did not see
+    with self._lock:
+      self._loaded = False
+
+  def changed(self, added, removed):
+    # venues committed since the grid was loaded, (id, latitude, longitude,
+    # seeking_talent) tuples and ids
+    if not self._loaded:
+      return
+    for id in removed:
+      self.grid.remove(id)
+    for id, lat, lng, seeking_talent in added:
+      self.grid.add(id, lat, lng, bool(seeking_talent))
+
+  def _within(self, lat, lng, km, seeking_talent):
+    # [(distance, id)] nearest first, every venue within km
+    self._dialect()
+    if not self.use_postgres:
+      self._load()
+      return self.grid.within(lat, lng, km, seeking_talent)
+
+    south, north, ranges = bounding_box(lat, lng, km)
+    conditions = [
+      Venue.deleted_at.is_(None),
+      Venue.latitude.between(south, north),
+      or_(*[Venue.longitude.between(west, east) for west, east in ranges]),
+    ]
+    if seeking_talent is not None:
+      conditions.append(Venue.seeking_talent.is_(seeking_talent))
+    found = []
+    for id, point_lat, point_lng in db.session.query(Venue.id, Venue.latitude, Venue.longitude) \
+        .filter(*conditions):
+      distance = distance_km(lat, lng, point_lat, point_lng)
+      if distance <= km:
+        found.append((distance, id))
+    found.sort()
+    return found
+
+  def nearby(self, lat, lng, km, seeking_talent=None, limit=None):
+    limit = limit or self.limit
+    found = self._within(lat, lng, km, seeking_talent)
+    page = found[:limit]
+    by_id = {row[0]: row for row in db.session.query(
+        Venue.id, Venue.name, Venue.city, Venue.state, Venue.upcoming_shows_count) \
+      .filter(Venue.id.in_([id for _, id in page]), Venue.deleted_at.is_(None))} if page else {}
+
+    return {
+      "count": len(found),
+      "data": [{
+        "id": id,
+        "name": by_id[id][1],
+        "city": by_id[id][2],
+        "state": by_id[id][3],
+        "distance_km": round(distance, 1),
+        "num_upcoming_shows": by_id[id][4],
+      } for distance, id in page if id in by_id]
+    }
+
+
+def update_on_commit(locator):
+  # keeps the grid of locator in step with committed venues
+
+  @event.listens_for(Session, 'after_flush')
+  def collect(session, flush_context):
+    pending = session.info.setdefault('geo_pending', [])
+    for target in list(session.new) + list(session.dirty):
+      if isinstance(target, Venue):
+        if target.deleted_at is None:
+          pending.append((target.id, target.latitude, target.longitude, target.seeking_talent))
+        else:
+          pending.append(target.id)
+    for target in session.deleted:
+      if isinstance(target, Venue):
+        pending.append(target.id)
+
+  @event.listens_for(Session, 'after_commit')
+  def apply(session):
+    for row in session.info.pop('geo_pending', ()):
+      if isinstance(row, tuple):
+        locator.changed((row,), ())
+      else:
+        locator.changed((), (row,))
+
+  @event.listens_for(Session, 'after_rollback')
+  def discard(session):
+    session.info.pop('geo_pending', None)
@@ -0,0 +1,309 @@
+#----------------------------------------------------------------------------#
+# Matchmaking.
+#   artists to book at a venue seeking talent, and venues for an artist
+#   seeking a venue, ranked by genre overlap, location and show history
+#
+#   the venues and artists are held in process as numpy arrays: genres as
+#   one bitmask each (a bit per forms.GENRES entry), city as an integer code
+#   with a precomputed pool of indices per city, coordinates, past show
+#   counts. a ranking scores every candidate in a few vector operations,
+#   the database is only asked for the subject and its show history. the arrays
+#   are loaded once, then the venues and artists written since (directly or
+#   through their shows, or by a counter rollover) are re-read and merged in
+#   on the next ranking
+#----------------------------------------------------------------------------#
+
+import threading
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import event, func, inspect, null
+from sqlalchemy.orm import Session
+
+from forms import GENRES, normalize_genre
+from models import db, Venue, Artist, Show
+from counters import rolled_over_at
+from geo import EARTH_RADIUS_KM, geocode
+
+# how much each part counts in a score, which is between 0 and 1
+WEIGHTS = {'genre': 0.5, 'location': 0.3, 'history': 0.2}
+
+# candidates this far away (between city centres) score about a third
+# of a candidate in the same city
+LOCATION_SCALE_KM = 100.0
+
+# past shows together at which the pair part of the history is full
+PAIR_SHOWS = 10
+
+# weaker matches are not listed
+MIN_SCORE = 0.05
+
+# changed venues or artists are re-read this many ids per IN (...)
+RELOAD_BATCH = 500
+
+GENRE_BITS = {genre: 1 << bit for bit, genre in enumerate(GENRES)}
+
+# set bits of every 16 bit value, a mask is counted in two lookups
+POPCOUNT16 = np.array([bin(value).count('1') for value in range(1 << 16)], dtype=np.uint8)
+
+
+def genre_mask(genres):
+  mask = 0
+  for genre in genres or ():
+    mask |= GENRE_BITS.get(normalize_genre(genre), 0)
+  return mask
+
+def popcount(masks):
+  return POPCOUNT16[masks & 0xFFFF] + POPCOUNT16[masks >> 16]
+
+def objects(values):
+  # a one dimensional object array, np.array would make (city, state) pairs two
+  array = np.empty(len(values), dtype=object)
+  for position, value in enumerate(values):
+    array[position] = value
+  return array
+
+def distances_km(lat, lng, lats, lngs):
+  # haversine from one point to arrays of points, nan where one is unknown
+  lat, lng, lats, lngs = np.radians(lat), np.radians(lng), np.radians(lats), np.radians(lngs)
+  a = np.sin((lats - lat) / 2) ** 2 + np.cos(lat) * np.cos(lats) * np.sin((lngs - lng) / 2) ** 2
+  return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class Candidates:
+  # one side (venues or artists) as parallel arrays, sorted by id, only
+  # those seeking a match and not deleted
+
+  def __init__(self, rows, city_code, locate):
+    # rows are (id, name, city, state, genres, past_shows_count, lat, lng)
+    self.ids = np.array([row[0] for row in rows], dtype=np.int64)
+    self.names = objects([row[1] for row in rows])
+    self.places = objects([(row[2], row[3]) for row in rows])
+    self.masks = np.array([genre_mask(row[4]) for row in rows], dtype=np.uint32)
+    self.past = np.array([row[5] or 0 for row in rows], dtype=np.float64)
+    self.cities = np.array([city_code(row[2], row[3]) for row in rows], dtype=np.int32)
+    points = [locate(row) for row in rows]
+    self.lats = np.array([point[0] for point in points], dtype=np.float64)
+    self.lngs = np.array([point[1] for point in points], dtype=np.float64)
+    self._derive()
+
+  def _derive(self):
+    # the city pools and experience, from cities and past
+    order = np.argsort(self.cities, kind='stable')
+    bounds = np.flatnonzero(np.diff(self.cities[order])) + 1
+    self.pools = {int(self.cities[pool[0]]): pool for pool in np.split(order, bounds) if len(pool)}
+    # log scaled so a few hundred shows do not dwarf a few dozen
+    self.experience = np.log1p(self.past) / np.log1p(self.past.max()) if len(self) and self.past.max() else \
+      np.zeros(len(self))
+
+  def __len__(self):
+    return len(self.ids)
+
+  def merged(self, rows, removed, city_code, locate):
+    # a copy with rows (as for __init__) added or in place of those with the
+    # same id, and the ids in removed left out. a copy rather than in place,
+    # so rankings running meanwhile keep a consistent set
+    new = Candidates(rows, city_code, locate)
+    dropped = np.concatenate([new.ids, np.array(sorted(removed), dtype=np.int64)])
+    keep = np.flatnonzero(~np.isin(self.ids, dropped))
+    order = np.argsort(np.concatenate([self.ids[keep], new.ids]), kind='stable')
+    merged = Candidates((), city_code, locate)
+    for name in ('ids', 'names', 'places', 'masks', 'past', 'cities', 'lats', 'lngs'):
+      setattr(merged, name, np.concatenate([getattr(self, name)[keep], getattr(new, name)])[order])
+    merged._derive()
+    return merged
+
+  def pool(self, city):
+    return self.pools.get(city, np.empty(0, dtype=np.int64))
+
+
+class Matchmaker:
+  # rank(Venue, id) -> {"count": ..., "data": [{id, name, city, state, score,
+  # genre, location, history}]}, the artists seeking a venue that suit the
+  # venue best first. rank(Artist, id) ranks venues seeking talent
+
+  def __init__(self, limit=20):
+    self.limit = limit
+    self._candidates = None
+    self._rolled_over_at = None
+    self._pending = {Venue: set(), Artist: set()}
+    self._codes = {}
+    self._centres = {}
+    self._lock = threading.Lock()
+    self._places_lock = threading.Lock()
+
+  def _city_code(self, city, state):
+    place = ' '.join((city or '').split()).lower(), (state or '').strip().upper()
+    with self._places_lock:
+      return self._codes.setdefault(place, len(self._codes))
+
+  def _centre(self, row):
+    # artists, and venues without coordinates, are at their city centre
+    if row[6] is not None and row[7] is not None:
+      return row[6], row[7]
+    with self._places_lock:
+      if (row[2], row[3]) not in self._centres:
+        self._centres[row[2], row[3]] = geocode(row[2], row[3]) or (np.nan, np.nan)
+      return self._centres[row[2], row[3]]
+
+  def _query(self, model):
+    # (id, name, city, state, genres, past_shows_count, lat, lng) rows
+    return db.session.query(model.id, model.name, model.city, model.state, model.genres,
+      model.past_shows_count,
+      model.latitude if model is Venue else null(),
+      model.longitude if model is Venue else null()) \
+      .filter(model.deleted_at.is_(None))
+
+  def _candidate_rows(self, model):
+    # the rows of the venues seeking talent or the artists seeking a venue
+    seeking = Venue.seeking_talent if model is Venue else Artist.seeking_venue
+    return self._query(model).filter(seeking.is_(True))
+
+  def _rolled_over(self, since):
+    # the venues and artists with shows started since the last rollover seen,
+    # their past show counts have moved. False when that cannot be told
+    if self._rolled_over_at is None or since is None or since < self._rolled_over_at:
+      return False
+    window = (Show.start_time > self._rolled_over_at, Show.start_time <= since)
+    for model, fk in ((Venue, Show.venue_id), (Artist, Show.artist_id)):
+      self._pending[model].update(id for id, in db.session.query(fk).filter(*window).distinct())
+    return True
+
+  def _load(self):
+    with self._lock:
+      since = rolled_over_at(db.session)
+      if since != self._rolled_over_at and not self._rolled_over(since):
+        self._candidates = None
+      self._rolled_over_at = since
+
+      if self._candidates is None:
+        self._pending = {Venue: set(), Artist: set()}
+        self._candidates = {
+          model: Candidates(self._candidate_rows(model).order_by(model.id).all(), self._city_code, self._centre)
+          for model in (Venue, Artist)
+        }
+      elif self._pending[Venue] or self._pending[Artist]:
+        candidates = dict(self._candidates)
+        for model, ids in self._pending.items():
+          if not ids:
+            continue
+          ids = sorted(ids)
+          rows = []
+          for start in range(0, len(ids), RELOAD_BATCH):
+            rows += self._candidate_rows(model).filter(model.id.in_(ids[start:start + RELOAD_BATCH])).all()
+          # the ids not read back are deleted or no longer seeking
+          candidates[model] = candidates[model].merged(rows, set(ids) - {row[0] for row in rows},
+            self._city_code, self._centre)
+        self._pending = {Venue: set(), Artist: set()}
+        self._candidates = candidates
+      return self._candidates
+
+  def changed(self, model, ids):
+    # venues or artists written since the arrays were loaded, re-read on the
+    # next ranking
+    with self._lock:
+      if self._candidates is not None:
+        self._pending[model].update(ids)
+
+  def reset(self):
+    # reloaded whole on the next ranking, after bulk writes
+    with self._lock:
+      self._candidates = None
+
+  def _subject(self, model, id):
+    # genres, city and location of the venue or artist to find matches
+    # for, seeking or not
+    row = self._query(model).filter(model.id == id).first()
+    if row is None:
+      return None
+    lat, lng = self._centre(row)
+    return genre_mask(row[4]), self._city_code(row[2], row[3]), lat, lng
+
+  def _pair_shows(self, model, id, candidates):
+    # past shows of the subject with each candidate, as an array
+    fk, other_fk = (Show.venue_id, Show.artist_id) if model is Venue else (Show.artist_id, Show.venue_id)
+    shows = np.zeros(len(candidates))
+    rows = db.session.query(other_fk, func.count(Show.id)) \
+      .filter(fk == id, Show.start_time <= datetime.now()) \
+      .group_by(other_fk) \
+      .all()
+    if rows:
+      other_ids = np.array([row[0] for row in rows], dtype=np.int64)
+      counts = np.array([row[1] for row in rows], dtype=np.float64)
+      positions = np.minimum(np.searchsorted(candidates.ids, other_ids), len(candidates) - 1)
+      found = candidates.ids[positions] == other_ids
+      shows[positions[found]] = counts[found]
+    return shows
+
+  def rank(self, model, id, limit=None, same_city=False):
+    limit = limit or self.limit
+    candidates = self._load()[Artist if model is Venue else Venue]
+    subject = self._subject(model, id)
+    if subject is None:
+      return None
+    mask, city, lat, lng = subject
+    if not len(candidates):
+      return {"count": 0, "data": []}
+
+    # candidates in the subject's city only, from the precomputed pool
+    index = candidates.pool(city) if same_city else slice(None)
+    masks = candidates.masks[index]
+    union = popcount(masks | np.uint32(mask)).astype(np.float64)
+    genre = np.divide(popcount(masks & np.uint32(mask)), union, out=np.zeros(len(union)), where=union > 0)
+
+    location = np.exp(-distances_km(lat, lng, candidates.lats[index], candidates.lngs[index]) / LOCATION_SCALE_KM)
+    location = np.nan_to_num(location, nan=0.0)
+    location[candidates.cities[index] == city] = 1.0
+
+    pair = np.minimum(self._pair_shows(model, id, candidates)[index], PAIR_SHOWS) / PAIR_SHOWS
+    history = 0.5 * pair + 0.5 * candidates.experience[index]
+
+    score = WEIGHTS['genre'] * genre + WEIGHTS['location'] * location + WEIGHTS['history'] * history
+    matching = np.flatnonzero(score >= MIN_SCORE)
+    top = matching[np.argpartition(-score[matching], min(limit, len(matching)) - 1)[:limit]] \
+      if len(matching) > limit else matching
+    top = top[np.argsort(-score[top], kind='stable')]
+    positions = np.arange(len(candidates))[index][top]
+
+    return {
+      "count": int(len(matching)),
+      "data": [{
+        "id": int(candidates.ids[position]),
+        "name": candidates.names[position],
+        "city": candidates.places[position][0],
+        "state": candidates.places[position][1],
+        "score": round(float(score[at]), 3),
+        "genre": round(float(genre[at]), 3),
+        "location": round(float(location[at]), 3),
+        "history": round(float(history[at]), 3),
+      } for at, position in zip(top, positions)]
+    }
+
+
+def update_on_commit(matchmaker):
+  # tells matchmaker of the venues and artists committed, and of the two
+  # sides of the shows committed, whose past_shows_count may have changed
+
+  @event.listens_for(Session, 'after_flush')
+  def collect(session, flush_context):
+    pending = session.info.setdefault('matchmaking_pending', {Venue: set(), Artist: set()})
+    for target in list(session.new) + list(session.dirty) + list(session.deleted):
+      if isinstance(target, Venue):
+        pending[Venue].add(target.id)
+      elif isinstance(target, Artist):
+        pending[Artist].add(target.id)
+      elif isinstance(target, Show):
+        # a moved show changes the counts on both its old and new sides
+        state = inspect(target)
+        for model, key in ((Venue, 'venue_id'), (Artist, 'artist_id')):
+          pending[model].update(id for id in state.attrs[key].history.deleted if id is not None)
+          pending[model].add(getattr(target, key))
+
+  @event.listens_for(Session, 'after_commit')
+  def apply(session):
+    for model, ids in session.info.pop('matchmaking_pending', {}).items():
+      matchmaker.changed(model, ids)
+
+  @event.listens_for(Session, 'after_rollback')
+  def discard(session):
+    session.info.pop('matchmaking_pending', None)
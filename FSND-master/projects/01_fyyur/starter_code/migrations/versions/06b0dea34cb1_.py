@@ -0,0 +1,26 @@
+"""index venue areas and upcoming shows per venue
+
+Revision ID: 06b0dea34cb1
+Revises: 6ef2284dee65
+Create Date: 2026-10-18 10:12:41.118209
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '06b0dea34cb1'
+down_revision = '6ef2284dee65'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_Venue_city_state', 'Venue', ['city', 'state'], unique=False)
+    op.create_index('ix_Show_venue_id_start_time', 'Show', ['venue_id', 'start_time'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_Show_venue_id_start_time', table_name='Show')
+    op.drop_index('ix_Venue_city_state', table_name='Venue')
@@ -0,0 +1,24 @@
+"""index shows per artist by start time
+
+Revision ID: 3f1c9a7d2b44
+Revises: 06b0dea34cb1
+Create Date: 2026-10-18 11:02:17.530641
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c9a7d2b44'
+down_revision = '06b0dea34cb1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_Show_artist_id_start_time', 'Show', ['artist_id', 'start_time'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_Show_artist_id_start_time', table_name='Show')
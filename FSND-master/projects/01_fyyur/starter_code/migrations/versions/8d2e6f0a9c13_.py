@@ -0,0 +1,27 @@
+"""trigram indexes for venue and artist name search
+
+Revision ID: 8d2e6f0a9c13
+Revises: 3f1c9a7d2b44
+Create Date: 2026-10-18 11:48:05.204117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d2e6f0a9c13'
+down_revision = '3f1c9a7d2b44'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.execute('CREATE INDEX "ix_Venue_name_trgm" ON "Venue" USING gin (name gin_trgm_ops)')
+    op.execute('CREATE INDEX "ix_Artist_name_trgm" ON "Artist" USING gin (name gin_trgm_ops)')
+
+
+def downgrade():
+    op.drop_index('ix_Artist_name_trgm', table_name='Artist')
+    op.drop_index('ix_Venue_name_trgm', table_name='Venue')
@@ -0,0 +1,24 @@
+"""index shows by start time for the /shows listing
+
+Revision ID: b5a4c1e7d920
+Revises: 8d2e6f0a9c13
+Create Date: 2026-10-18 12:31:44.907385
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5a4c1e7d920'
+down_revision = '8d2e6f0a9c13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_Show_start_time_id', 'Show', ['start_time', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_Show_start_time_id', table_name='Show')
@@ -0,0 +1,45 @@
+"""denormalized upcoming / past show counters on venues and artists
+
+Revision ID: c7e3f58a1d06
+Revises: b5a4c1e7d920
+Create Date: 2026-10-18 13:40:22.618930
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7e3f58a1d06'
+down_revision = 'b5a4c1e7d920'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ('Venue', 'Artist'):
+        op.add_column(table, sa.Column('upcoming_shows_count', sa.Integer(), nullable=False, server_default='0'))
+        op.add_column(table, sa.Column('past_shows_count', sa.Integer(), nullable=False, server_default='0'))
+    op.create_table('ShowCounters',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('rolled_over_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+    # backfill, counting as of now
+    op.execute('INSERT INTO "ShowCounters" (id, rolled_over_at) VALUES (1, LOCALTIMESTAMP)')
+    for table, fk in (('Venue', 'venue_id'), ('Artist', 'artist_id')):
+        op.execute(
+            'UPDATE "{table}" SET '
+            'upcoming_shows_count = (SELECT count(*) FROM "Show" WHERE "Show".{fk} = "{table}".id '
+            'AND "Show".start_time > (SELECT rolled_over_at FROM "ShowCounters")), '
+            'past_shows_count = (SELECT count(*) FROM "Show" WHERE "Show".{fk} = "{table}".id '
+            'AND "Show".start_time <= (SELECT rolled_over_at FROM "ShowCounters"))'.format(table=table, fk=fk)
+        )
+
+
+def downgrade():
+    op.drop_table('ShowCounters')
+    for table in ('Artist', 'Venue'):
+        op.drop_column(table, 'past_shows_count')
+        op.drop_column(table, 'upcoming_shows_count')
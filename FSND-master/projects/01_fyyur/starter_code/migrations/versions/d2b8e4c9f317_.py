@@ -0,0 +1,26 @@
+"""soft delete for venues and artists
+
+Revision ID: d2b8e4c9f317
+Revises: c7e3f58a1d06
+Create Date: 2026-10-18 14:22:51.340172
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2b8e4c9f317'
+down_revision = 'c7e3f58a1d06'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('Venue', sa.Column('deleted_at', sa.DateTime(), nullable=True))
+    op.add_column('Artist', sa.Column('deleted_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('Artist', 'deleted_at')
+    op.drop_column('Venue', 'deleted_at')
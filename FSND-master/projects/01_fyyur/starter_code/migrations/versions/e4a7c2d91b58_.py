@@ -0,0 +1,26 @@
+"""GIN indexes for genre filters on venues and artists
+
+Revision ID: e4a7c2d91b58
+Revises: d2b8e4c9f317
+Create Date: 2026-10-18 15:37:12.681904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4a7c2d91b58'
+down_revision = 'd2b8e4c9f317'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_Venue_genres', 'Venue', ['genres'], unique=False, postgresql_using='gin')
+    op.create_index('ix_Artist_genres', 'Artist', ['genres'], unique=False, postgresql_using='gin')
+
+
+def downgrade():
+    op.drop_index('ix_Artist_genres', table_name='Artist')
+    op.drop_index('ix_Venue_genres', table_name='Venue')
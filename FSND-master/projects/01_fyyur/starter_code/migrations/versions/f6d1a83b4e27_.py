@@ -0,0 +1,28 @@
+"""venue coordinates for nearby venue queries
+
+Revision ID: f6d1a83b4e27
+Revises: e4a7c2d91b58
+Create Date: 2026-10-18 16:52:40.118263
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f6d1a83b4e27'
+down_revision = 'e4a7c2d91b58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('Venue', sa.Column('latitude', sa.Float(), nullable=True))
+    op.add_column('Venue', sa.Column('longitude', sa.Float(), nullable=True))
+    op.create_index('ix_Venue_latitude_longitude', 'Venue', ['latitude', 'longitude'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_Venue_latitude_longitude', table_name='Venue')
+    op.drop_column('Venue', 'longitude')
+    op.drop_column('Venue', 'latitude')
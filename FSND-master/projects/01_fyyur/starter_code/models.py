@@ -1,11 +1,15 @@
-from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from datetime import datetime
+from sqlalchemy import event
 
-app = Flask(__name__)
-db = SQLAlchemy(app)
-migrate = Migrate(app, db)
+# bound to the app in app.py with db.init_app(app) and migrate.init_app(app, db)
+db = SQLAlchemy()
+migrate = Migrate()
+
+# genres are a postgres ARRAY, stored as json on sqlite so the models
+# can also be created on a throwaway sqlite database (benchmarks, tests)
+Genres = db.ARRAY(db.String(120)).with_variant(db.JSON(), 'sqlite')
 
 #----------------------------------------------------------------------------#
 # Models.
@@ -20,14 +24,31 @@ class Venue(db.Model):
     state = db.Column(db.String(120), nullable=False)
     address = db.Column(db.String(120))
     phone = db.Column(db.String(120), nullable=False)
-    genres = db.Column(db.ARRAY(db.String(120)))
+    genres = db.Column(Genres)
     image_link = db.Column(db.String(500))
     seeking_talent = db.Column(db.Boolean, default=True)
     seeking_description = db.Column(db.String(500))
     website = db.Column(db.String(120))
     facebook_link = db.Column(db.String(120))
+    # city centre from geocodes.csv unless given, see geo.py
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    # kept up to date on show writes and by the rollover job, see counters.py
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # set by a soft delete, the row and its shows are purged later, see deletion.py
+    deleted_at = db.Column(db.DateTime)
     shows = db.relationship('Show', backref='venue', passive_deletes=True)
 
+    __table_args__ = (
+      # /venues lists venues grouped by area
+      db.Index('ix_Venue_city_state', 'city', 'state'),
+      # genre filters are genres @> ARRAY[genre], see search.py
+      db.Index('ix_Venue_genres', 'genres', postgresql_using='gin'),
+      # nearby venues are a range scan over a bounding box, see geo.py
+      db.Index('ix_Venue_latitude_longitude', 'latitude', 'longitude'),
+    )
+
     def __repr__(self):
       return '<Venue ' + str(self.id) + ' '+ str(self.name)+ '>'
       @property
@@ -47,14 +68,22 @@ class Artist(db.Model):
     city = db.Column(db.String(120), nullable=False)
     state = db.Column(db.String(120), nullable=False)
     phone = db.Column(db.String(120), nullable=False)
-    genres = db.Column(db.ARRAY(db.String(120)))
+    genres = db.Column(Genres)
     image_link = db.Column(db.String(500))
     seeking_venue =db.Column(db.Boolean, default=True)
     seeking_description = db.Column(db.String(500))
     website = db.Column(db.String(120))
     facebook_link = db.Column(db.String(120))
+    # kept up to date on show writes and by the rollover job, see counters.py
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # set by a soft delete, the row and its shows are purged later, see deletion.py
+    deleted_at = db.Column(db.DateTime)
     shows = db.relationship('Show', backref='artist', passive_deletes=True)
 
+    # genre filters are genres @> ARRAY[genre], see search.py
+    __table_args__ = (db.Index('ix_Artist_genres', 'genres', postgresql_using='gin'),)
+
     def __repr__(self):
       return '<Artist ' + str(self.id) + ' '+ str(self.name)+ '>'
 
@@ -70,9 +99,27 @@ class Show(db.Model):
     venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id', ondelete='CASCADE'))
     artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id', ondelete='CASCADE'))
 
+    # past / upcoming shows of a venue or an artist are range scans on these indexes
+    __table_args__ = (
+      db.Index('ix_Show_venue_id_start_time', 'venue_id', 'start_time'),
+      db.Index('ix_Show_artist_id_start_time', 'artist_id', 'start_time'),
+      # /shows pages through all shows in (start_time, id) order
+      db.Index('ix_Show_start_time_id', 'start_time', 'id'),
+    )
+
     def __repr__(self):
       return '<Show ' + str(self.id) + ' '+ str(self.start_time)+ '>'
 
-  
+class ShowCounters(db.Model):
+    # a single row, shows starting after rolled_over_at are counted in the
+    # upcoming_shows_count columns, the others in past_shows_count
+    __tablename__ = 'ShowCounters'
+
+    id = db.Column(db.Integer, primary_key=True)
+    rolled_over_at = db.Column(db.DateTime, nullable=False)
 
-  
\ No newline at end of file
+@event.listens_for(ShowCounters.__table__, 'after_create')
+def start_counting(table, connection, **kw):
+    # the row is created with the table (db.create_all()), so show writes
+    # split upcoming from past from the start. migrations insert it themselves
+    connection.execute(table.insert().values(id=1, rolled_over_at=datetime.now()))
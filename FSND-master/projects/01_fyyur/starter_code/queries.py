@@ -0,0 +1,264 @@
+#----------------------------------------------------------------------------#
+# Queries.
+#   read-side queries behind the listing pages, each page is built from a
+#   fixed number of queries whatever the number of venues, artists or shows
+#----------------------------------------------------------------------------#
+
+import base64
+import json
+from datetime import datetime, timedelta
+from itertools import groupby
+
+from sqlalchemy import and_, case, func, literal, or_, select, text
+
+from models import db, Venue, Artist, Show
+from counters import rolled_over_at
+
+# past and upcoming show lists on the detail pages are paginated,
+# so a venue or artist with years of history renders a bounded page
+SHOWS_PER_PAGE = 12
+
+# rows per page of /shows, and per database round trip when it is streamed
+SHOWS_LISTING_PAGE = 60
+
+# shows only have a start time, each is taken to block its venue and its
+# artist for this long when checking bookings for overlaps
+SHOW_DURATION = timedelta(hours=3)
+
+
+def deleted(model):
+  # ids of the soft deleted venues or artists, hidden until they are purged
+  return select([model.id]).where(model.deleted_at.isnot(None))
+
+
+#  Venues
+#  ----------------------------------------------------------------
+
+def venue_areas(*conditions, ids=None):
+  # venues grouped by (city, state), each with its number of upcoming shows,
+  # read from the denormalized counter column (see counters.py) and ordered
+  # by area so the grouping is a single pass over the rows. conditions are
+  # the genre / area filters, see NameSearch.filters, and ids when given
+  # keeps only those venues (the genre where the database cannot filter it)
+  rows = db.session.query(
+      Venue.city, Venue.state, Venue.id, Venue.name, Venue.upcoming_shows_count
+    ).filter(Venue.deleted_at.is_(None), *conditions) \
+    .order_by(Venue.state, Venue.city, Venue.name) \
+    .all()
+  if ids is not None:
+    rows = [row for row in rows if row[2] in ids]
+
+  return [{
+    "city": city,
+    "state": state,
+    "venues": [{
+      "id": id,
+      "name": name,
+      "num_upcoming_shows": num_upcoming_shows,
+    } for _, _, id, name, num_upcoming_shows in venues]
+  } for (city, state), venues in groupby(rows, key=lambda row: (row[0], row[1]))]
+
+
+#  Artists
+#  ----------------------------------------------------------------
+
+def artist_list(*conditions, ids=None):
+  # artists by name, conditions and ids as for venue_areas
+  rows = db.session.query(Artist.id, Artist.name) \
+    .filter(Artist.deleted_at.is_(None), *conditions) \
+    .order_by(Artist.name) \
+    .all()
+  return [{"id": id, "name": name} for id, name in rows if ids is None or id in ids]
+
+
+#  Detail pages
+#  ----------------------------------------------------------------
+
+def _detail(model, id, fk, other, other_fk, prefix, now, upcoming_page, past_page, per_page):
+  # the entity and its past / upcoming show counts in one query, then one page
+  # of each list with the other side's columns joined in, in a second query.
+  # past and upcoming are split by the database on start_time, upcoming
+  # soonest first and past most recent first
+  upcoming = Show.start_time > now
+  row = db.session.query(
+      model,
+      func.count(case([(upcoming, Show.id)])),
+      func.count(case([(~upcoming, Show.id)])),
+      func.min(case([(upcoming, Show.start_time)]))
+    ).outerjoin(Show, and_(fk == model.id, other_fk.notin_(deleted(other)))) \
+    .filter(model.id == id, model.deleted_at.is_(None)) \
+    .group_by(model.id) \
+    .first()
+  if row is None:
+    return None
+  entity, upcoming_count, past_count, next_show_time = row
+
+  def shows_page(is_upcoming, condition, order, page):
+    return db.session.query(
+        literal(is_upcoming).label('upcoming'), Show.start_time, other.id, other.name, other.image_link
+      ).join(other, other.id == other_fk) \
+      .filter(fk == id, condition, other.deleted_at.is_(None)) \
+      .order_by(order, Show.id) \
+      .limit(per_page).offset((page - 1) * per_page) \
+      .subquery()
+
+  upcoming_page, past_page = max(upcoming_page, 1), max(past_page, 1)
+  shows = {True: [], False: []}
+  if upcoming_count or past_count:
+    pages = db.session.query(shows_page(True, upcoming, Show.start_time, upcoming_page)).union_all(
+      db.session.query(shows_page(False, ~upcoming, Show.start_time.desc(), past_page)))
+    for is_upcoming, start_time, other_id, name, image_link in pages:
+      shows[bool(is_upcoming)].append({
+        prefix + "_id": other_id,
+        prefix + "_name": name,
+        prefix + "_image_link": image_link,
+        "start_time": start_time,
+      })
+  shows[True].sort(key=lambda show: show["start_time"])
+  shows[False].sort(key=lambda show: show["start_time"], reverse=True)
+
+  data = {column.key: getattr(entity, column.key) for column in model.__table__.columns}
+  data.update({
+    "genres": entity.genres or [],
+    "upcoming_shows": shows[True],
+    "past_shows": shows[False],
+    "upcoming_shows_count": upcoming_count,
+    "past_shows_count": past_count,
+    "upcoming_shows_page": upcoming_page,
+    "past_shows_page": past_page,
+    "upcoming_shows_pages": max(-(-upcoming_count // per_page), 1),
+    "past_shows_pages": max(-(-past_count // per_page), 1),
+    # the page changes on its own once this show starts
+    "next_show_time": next_show_time,
+  })
+  return data
+
+def venue_detail(venue_id, upcoming_page=1, past_page=1, per_page=SHOWS_PER_PAGE, now=None):
+  # the show_venue page data, None when there is no such venue
+  return _detail(Venue, venue_id, Show.venue_id, Artist, Show.artist_id, "artist",
+    now or datetime.now(), upcoming_page, past_page, per_page)
+
+def artist_detail(artist_id, upcoming_page=1, past_page=1, per_page=SHOWS_PER_PAGE, now=None):
+  # the show_artist page data, None when there is no such artist
+  return _detail(Artist, artist_id, Show.artist_id, Venue, Show.venue_id, "venue",
+    now or datetime.now(), upcoming_page, past_page, per_page)
+
+
+#  Shows
+#  ----------------------------------------------------------------
+
+def encode_cursor(start_time, id):
+  # the opaque /shows cursor of the page following the show (start_time, id)
+  key = json.dumps([start_time.isoformat(), id])
+  return base64.urlsafe_b64encode(key.encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+  # (start_time, id), ValueError for anything encode_cursor did not produce
+  try:
+    start_time, id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    return datetime.fromisoformat(start_time), int(id)
+  except Exception:
+    raise ValueError('invalid cursor')
+
+def _shows_query(start, end):
+  query = db.session.query(
+      Show.id, Show.start_time,
+      Venue.id, Venue.name,
+      Artist.id, Artist.name, Artist.image_link
+    ).join(Venue, Venue.id == Show.venue_id) \
+    .join(Artist, Artist.id == Show.artist_id) \
+    .filter(Venue.deleted_at.is_(None), Artist.deleted_at.is_(None))
+  if start is not None:
+    query = query.filter(Show.start_time >= start)
+  if end is not None:
+    query = query.filter(Show.start_time < end)
+  return query
+
+def _seek(query, after, limit):
+  # keyset on (start_time, id), served by the Show(start_time, id) index
+  if after is not None:
+    start_time, id = after
+    query = query.filter(or_(Show.start_time > start_time, and_(Show.start_time == start_time, Show.id > id)))
+  return query.order_by(Show.start_time, Show.id).limit(limit)
+
+def _show(row):
+  _, start_time, venue_id, venue_name, artist_id, artist_name, artist_image_link = row
+  return {
+    "venue_id": venue_id,
+    "venue_name": venue_name,
+    "artist_id": artist_id,
+    "artist_name": artist_name,
+    "artist_image_link": artist_image_link,
+    "start_time": start_time,
+  }
+
+def shows_page(start=None, end=None, cursor=None, limit=SHOWS_LISTING_PAGE):
+  # (shows, next_cursor) for one page of shows starting in [start, end),
+  # ordered by start time. next_cursor is None on the last page
+  after = decode_cursor(cursor) if cursor else None
+  rows = _seek(_shows_query(start, end), after, limit + 1).all()
+  next_cursor = None
+  if len(rows) > limit:
+    rows = rows[:limit]
+    next_cursor = encode_cursor(rows[-1][1], rows[-1][0])
+  return [_show(row) for row in rows], next_cursor
+
+def iter_shows(start=None, end=None, batch=SHOWS_LISTING_PAGE):
+  # every show in [start, end) in start time order, fetched batch rows at a
+  # time, for streaming a listing without holding it in memory
+  query = _shows_query(start, end)
+  after = None
+  while True:
+    rows = _seek(query, after, batch).all()
+    for row in rows:
+      yield _show(row)
+    if len(rows) < batch:
+      return
+    after = rows[-1][1], rows[-1][0]
+
+
+#  Bookings
+#  ----------------------------------------------------------------
+
+def lock_for_booking(venue_ids, artist_ids):
+  # locks the rows of the venues and artists shows are about to be booked
+  # for until the transaction ends, so a concurrent booking of any of them
+  # waits for this one's insert before looking for conflicts. taken in the
+  # order the counters take them (ShowCounters, venues by id, artists by
+  # id) so the two cannot deadlock. returns the ids that exist and are not
+  # deleted, as two sets. sqlite has no FOR UPDATE, there the transaction
+  # is begun IMMEDIATE, taking the database write lock before the check:
+  # a concurrent booking waits for this one's commit (up to the busy
+  # timeout) instead of running the same check alongside it
+  connection = db.session.connection()
+  if connection.dialect.name == 'sqlite' and not connection.connection.in_transaction:
+    # pysqlite only begins a transaction at the first write
+    connection.execute(text('BEGIN IMMEDIATE'))
+  rolled_over_at(db.session, lock=True)
+  venues = {id for id, in db.session.query(Venue.id)
+    .filter(Venue.id.in_(sorted(venue_ids)), Venue.deleted_at.is_(None))
+    .order_by(Venue.id)
+    .with_for_update()}
+  artists = {id for id, in db.session.query(Artist.id)
+    .filter(Artist.id.in_(sorted(artist_ids)), Artist.deleted_at.is_(None))
+    .order_by(Artist.id)
+    .with_for_update()}
+  return venues, artists
+
+def booking_conflicts(venue_id, artist_id, start_time, duration=SHOW_DURATION):
+  # the shows a new show would overlap, at its venue or with its artist,
+  # as {"with": "venue" | "artist", "show_id", "start_time"}. two shows
+  # overlap when they start less than duration apart, so each side is one
+  # range scan on its (venue_id | artist_id, start_time) index. shows of a
+  # soft deleted venue or artist are hidden and do not count
+  window = and_(Show.start_time > start_time - duration, Show.start_time < start_time + duration,
+    Show.venue_id.notin_(deleted(Venue)), Show.artist_id.notin_(deleted(Artist)))
+  venue = db.session.query(literal('venue'), Show.id, Show.start_time) \
+    .filter(Show.venue_id == venue_id, window)
+  artist = db.session.query(literal('artist'), Show.id, Show.start_time) \
+    .filter(Show.artist_id == artist_id, window)
+  return [{
+    "with": side,
+    "show_id": id,
+    "start_time": start_time,
+  } for side, id, start_time in venue.union_all(artist)]
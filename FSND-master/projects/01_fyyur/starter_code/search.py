@@ -0,0 +1,372 @@
+#----------------------------------------------------------------------------#
+# Search.
+#   case-insensitive partial search on venue and artist names
+#
+#   on postgres ILIKE '%term%' is served by the pg_trgm GIN indexes created
+#   in migration 8d2e6f0a9c13, elsewhere (sqlite) by an in-process trigram
+#   index loaded on first search and updated as names are committed.
+#   autocompletion is always answered from an in-process prefix index
+#
+#   searches and listings can be narrowed to a genre, served on postgres by
+#   the GIN indexes on the genres arrays (migration e4a7c2d91b58), elsewhere
+#   by an in-process genre -> ids index kept alongside the trigram index
+#----------------------------------------------------------------------------#
+
+import re
+import threading
+from bisect import bisect_left, insort
+
+from sqlalchemy import String, cast, event, func
+from sqlalchemy.dialects.postgresql import ARRAY, array
+from sqlalchemy.orm import Session
+
+from models import db
+
+
+def trigrams(value):
+  return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+#  In-process indexes
+#  ----------------------------------------------------------------
+
+class PostingIndex:
+  # ids listed under keys, the in-process stand-in for a GIN index. each
+  # row is stored as value (see _value) and listed under _keys(value):
+  # the trigrams of a name, the genres of a venue or artist
+
+  def __init__(self):
+    self._values = {}
+    self._postings = {}
+    self._lock = threading.Lock()
+
+  def __len__(self):
+    return len(self._values)
+
+  def _value(self, value):
+    return value
+
+  def _keys(self, value):
+    return value
+
+  def add(self, id, value):
+    with self._lock:
+      self._remove(id)
+      self._values[id] = value = self._value(value)
+      for key in self._keys(value):
+        self._postings.setdefault(key, set()).add(id)
+
+  def remove(self, id):
+    with self._lock:
+      self._remove(id)
+
+  def _remove(self, id):
+    if id not in self._values:
+      return
+    for key in self._keys(self._values.pop(id)):
+      posting = self._postings.get(key)
+      if posting is not None:
+        posting.discard(id)
+        if not posting:
+          del self._postings[key]
+
+  def clear(self):
+    with self._lock:
+      self._values = {}
+      self._postings = {}
+
+  def _listed(self, keys):
+    # ids listed under every key, from the shortest posting down.
+    # the caller holds the lock
+    keys = sorted(keys, key=lambda key: len(self._postings.get(key, ())))
+    ids = set(self._postings.get(keys[0], ()))
+    for key in keys[1:]:
+      if not ids:
+        break
+      ids &= self._postings.get(key, set())
+    return ids
+
+
+class TrigramIndex(PostingIndex):
+  # lowercased names by trigram, a search confirms the few names listed
+  # under all of the term's trigrams. terms shorter than 3 characters scan
+  # the names instead, which are short and few enough per venue or artist
+
+  def _value(self, name):
+    return (name or '').lower()
+
+  def _keys(self, name):
+    return trigrams(name)
+
+  def search(self, term):
+    # ids of the names containing term, matches at a word start first, then
+    # earlier matches, then shorter names, then by name as on postgres
+    term = term.lower()
+    with self._lock:
+      grams = trigrams(term)
+      candidates = self._listed(grams) if grams else self._values.keys()
+      ranked = []
+      for id in candidates:
+        name = self._values[id]
+        position = name.find(term)
+        if position < 0:
+          continue
+        inside_word = position > 0 and name[position - 1].isalnum()
+        ranked.append((inside_word, position, len(name), name, id))
+    ranked.sort()
+    return [row[-1] for row in ranked]
+
+
+class GenreIndex(PostingIndex):
+  # ids by genre, for the genre filter where there is no GIN index
+
+  def _value(self, genres):
+    return tuple(genres or ())
+
+  def ids(self, genre):
+    with self._lock:
+      return frozenset(self._postings.get(genre, ()))
+
+
+#  Prefix index
+#  ----------------------------------------------------------------
+
+WORD_START = re.compile(r'(?<!\w)\w')
+
+def word_suffixes(name):
+  # the name from each word start on, so "hop" and "the mus" both
+  # complete "The Musical Hop"
+  return [name[match.start():] for match in WORD_START.finditer(name)]
+
+
+class PrefixIndex:
+  # a sorted array of (lowercased name suffix, id), a completion is one
+  # bisect to the first key at or after the prefix and a walk while keys
+  # still start with it. names are added and removed in place with insort
+
+  def __init__(self):
+    self._keys = []
+    self._names = {}
+    self._lock = threading.Lock()
+
+  def __len__(self):
+    return len(self._names)
+
+  def load(self, names):
+    # (id, name) pairs, sorted once rather than inserted one by one
+    with self._lock:
+      self._names = {id: name or '' for id, name in names}
+      self._keys = sorted(
+        (suffix, id) for id, name in self._names.items() for suffix in word_suffixes(name.lower()))
+
+  def add(self, id, name):
+    with self._lock:
+      self._remove(id)
+      name = name or ''
+      self._names[id] = name
+      for suffix in word_suffixes(name.lower()):
+        insort(self._keys, (suffix, id))
+
+  def remove(self, id):
+    with self._lock:
+      self._remove(id)
+
+  def _remove(self, id):
+    name = self._names.pop(id, None)
+    if name is None:
+      return
+    for suffix in word_suffixes(name.lower()):
+      position = bisect_left(self._keys, (suffix, id))
+      if position < len(self._keys) and self._keys[position] == (suffix, id):
+        del self._keys[position]
+
+  def complete(self, prefix, limit=10):
+    # [(id, name)] of up to limit names with a word starting with prefix
+    prefix = prefix.lower()
+    results = []
+    seen = set()
+    with self._lock:
+      position = bisect_left(self._keys, (prefix,))
+      while position < len(self._keys) and len(results) < limit:
+        key, id = self._keys[position]
+        if not key.startswith(prefix):
+          break
+        if id not in seen:
+          seen.add(id)
+          results.append((id, self._names[id]))
+        position += 1
+    return results
+
+
+#  Name search
+#  ----------------------------------------------------------------
+
+class NameSearch:
+  # search(term) -> {"count": ..., "data": [{id, name, num_upcoming_shows}]}
+  # the shape the search_venues / search_artists templates expect, at most
+  # limit results, each with its upcoming show count
+
+  def __init__(self, model, limit=50):
+    self.model = model
+    self.limit = limit
+    self.index = TrigramIndex()
+    self.genres = GenreIndex()
+    self.prefixes = PrefixIndex()
+    self.use_postgres = None
+    self._loaded = False
+    self._lock = threading.Lock()
+
+  def _dialect(self):
+    if self.use_postgres is None:
+      self.use_postgres = db.engine.dialect.name == 'postgresql'
+
+  def _load(self):
+    # the trigram and genre indexes are only needed where there is no
+    # pg_trgm and no GIN index on genres
+    self._dialect()
+    with self._lock:
+      if self._loaded:
+        return
+      self.index.clear()
+      self.genres.clear()
+      rows = db.session.query(self.model.id, self.model.name, self.model.genres) \
+        .filter(self.model.deleted_at.is_(None)).all()
+      if not self.use_postgres:
+        for id, name, genres in rows:
+          self.index.add(id, name)
+          self.genres.add(id, genres)
+      self.prefixes.load((id, name) for id, name, _ in rows)
+      self._loaded = True
+
+  def reset(self):
+    # reloaded on the next search, after writes the events did not see
+    with self._lock:
+      self._loaded = False
+
+  def changed(self, added, removed):
+    # rows committed since the indexes were loaded, (id, name, genres)
+    # triples and ids
+    if not self._loaded:
+      return
+    for id in removed:
+      self.index.remove(id)
+      self.genres.remove(id)
+      self.prefixes.remove(id)
+    for id, name, genres in added:
+      if not self.use_postgres:
+        self.index.add(id, name)
+        self.genres.add(id, genres)
+      self.prefixes.add(id, name)
+
+  def filters(self, genre=None, city=None, state=None):
+    # conditions on the model for the listing and search filters. a genre
+    # is a GIN index scan on postgres (genres @> ARRAY[genre]), elsewhere
+    # it is not a condition: its ids would not fit in one IN (...) on
+    # sqlite, the rows are kept or not with genre_ids after the query
+    model = self.model
+    conditions = []
+    if genre:
+      self._dialect()
+      if self.use_postgres:
+        # cast so the operands are both varchar[], as the index expects
+        conditions.append(model.genres.op('@>')(cast(array([genre]), ARRAY(String(120)))))
+    if city:
+      conditions.append(model.city == city)
+    if state:
+      conditions.append(model.state == state)
+    return conditions
+
+  def genre_ids(self, genre=None):
+    # the ids listing genre, from the genre index, where filters leaves the
+    # genre out. None when there is nothing to filter after the query
+    self._dialect()
+    if not genre or self.use_postgres:
+      return None
+    self._load()
+    return self.genres.ids(genre)
+
+  def complete(self, prefix, limit=10):
+    # autocompletion from the in-process prefix index, on every database
+    prefix = prefix.strip()
+    if not prefix:
+      return []
+    self._load()
+    return [{"id": id, "name": name} for id, name in self.prefixes.complete(prefix, limit)]
+
+  def _rows(self, *conditions, with_total=False):
+    # upcoming show counts come from the denormalized column, see counters.py
+    model = self.model
+    columns = [model.id, model.name, model.upcoming_shows_count]
+    if with_total:
+      columns.append(func.count().over())
+    return db.session.query(*columns).filter(model.deleted_at.is_(None), *conditions)
+
+  def search(self, term, limit=None, genre=None, city=None, state=None):
+    # "Jazz venues in San Francisco" is search('', genre='Jazz', city='San Francisco')
+    limit = limit or self.limit
+    term = term.strip()
+    self._dialect()
+
+    if self.use_postgres:
+      pattern = '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+      rows = self._rows(self.model.name.ilike(pattern, escape='\\'), *self.filters(genre, city, state),
+          with_total=True) \
+        .order_by(func.similarity(self.model.name, term).desc(), self.model.name) \
+        .limit(limit) \
+        .all()
+      count = rows[0][3] if rows else 0
+    else:
+      self._load()
+      ids = self.index.search(term)
+      if genre:
+        listed = self.genres.ids(genre)
+        ids = [id for id in ids if id in listed]
+      if city or state:
+        # the rest of the filters need the rows of every match to count them,
+        # the rows of the area are read and matched here rather than sending
+        # every id in one IN (...)
+        by_id = {row[0]: row for row in self._rows(*self.filters(None, city, state))} if ids else {}
+        ids = [id for id in ids if id in by_id]
+      else:
+        page = ids[:limit]
+        by_id = {row[0]: row for row in self._rows(self.model.id.in_(page))} if page else {}
+      count = len(ids)
+      rows = [by_id[id] for id in ids[:limit] if id in by_id]
+
+    return {
+      "count": count,
+      "data": [{
+        "id": row[0],
+        "name": row[1],
+        "num_upcoming_shows": row[2],
+      } for row in rows]
+    }
+
+
+def update_on_commit(*searches):
+  # keeps the in-process indexes of searches in step with committed rows
+
+  def pending(session):
+    return session.info.setdefault('search_pending', [])
+
+  @event.listens_for(Session, 'after_flush')
+  def collect(session, flush_context):
+    for search in searches:
+      for target in list(session.new) + list(session.dirty):
+        if isinstance(target, search.model) and target.deleted_at is None:
+          pending(session).append((search, (target.id, target.name, target.genres)))
+      for target in session.deleted:
+        if isinstance(target, search.model):
+          pending(session).append((search, target.id))
+
+  @event.listens_for(Session, 'after_commit')
+  def apply(session):
+    for search, row in session.info.pop('search_pending', ()):
+      if isinstance(row, tuple):
+        search.changed((row,), ())
+      else:
+        search.changed((), (row,))
+
+  @event.listens_for(Session, 'after_rollback')
+  def discard(session):
+    session.info.pop('search_pending', None)
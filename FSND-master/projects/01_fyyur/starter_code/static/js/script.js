@@ -2,3 +2,56 @@ window.parseISOString = function parseISOString(s) {
   var b = s.split(/\D+/);
   return new Date(Date.UTC(b[0], --b[1], b[2], b[3], b[4], b[5], b[6]));
 };
+
+// search-as-you-type: suggestions for the navbar search boxes, requested
+// once typing pauses for 150ms; answers to outdated terms are dropped
+(function () {
+  var input = document.querySelector('input[data-autocomplete]');
+  var list = document.getElementById('search-suggestions');
+  if (!input || !list || !window.fetch) return;
+  var timer = null;
+  var latest = '';
+  input.addEventListener('input', function () {
+    clearTimeout(timer);
+    timer = setTimeout(function () {
+      var term = input.value.trim();
+      latest = term;
+      if (!term) {
+        list.innerHTML = '';
+        return;
+      }
+      fetch(input.dataset.autocomplete + '?q=' + encodeURIComponent(term))
+        .then(function (response) { return response.json(); })
+        .then(function (body) {
+          if (term !== latest) return;
+          list.innerHTML = '';
+          body.results.forEach(function (result) {
+            var option = document.createElement('option');
+            option.value = result.name;
+            list.appendChild(option);
+          });
+        });
+    }, 150);
+  });
+})();
+
+// delete buttons on the venue and artist pages, back to the homepage once done
+(function () {
+  var buttons = document.querySelectorAll('button[data-delete]');
+  Array.prototype.forEach.call(buttons, function (button) {
+    button.addEventListener('click', function () {
+      if (!window.confirm('Delete it and all of its shows?')) return;
+      button.disabled = true;
+      fetch(button.dataset.delete, { method: 'DELETE' })
+        .then(function (response) { return response.json(); })
+        .then(function (body) {
+          if (body.success) {
+            window.location = '/';
+          } else {
+            button.disabled = false;
+            window.alert('It could not be deleted, please try again.');
+          }
+        });
+    });
+  });
+})();
@@ -0,0 +1,530 @@
+import io
+import json
+import re
+import unittest
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, exc
+
+from models import db, Venue, Artist, Show
+from bulk_import import Importer, read_rows
+from search import NameSearch, TrigramIndex
+import app as fyyur
+import counters
+import deletion
+import matchmaking
+import queries
+
+# the app with its caches, indexes and write listeners, on sqlite
+fyyur.app.config.update(
+    SQLALCHEMY_DATABASE_URI='sqlite://',
+    SQLALCHEMY_TRACK_MODIFICATIONS=False,
+    WTF_CSRF_ENABLED=False,
+    TESTING=True,
+)
+matchmaker = fyyur.matchmaker
+
+
+class FyyurTestCase(unittest.TestCase):
+    """Runs against a throwaway sqlite database created with db.create_all()"""
+
+    def setUp(self):
+        self.app = fyyur.app
+        self.client = self.app.test_client()
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+        fyyur.page_cache.backend.clear()
+        for index in (fyyur.venue_search, fyyur.artist_search, fyyur.venue_locator, fyyur.matchmaker):
+            index.reset()
+        db.session.add(Venue(id=1, name='The Musical Hop', city='San Francisco', state='CA', phone='0'))
+        db.session.add(Artist(id=1, name='Guns N Petals', city='San Francisco', state='CA', phone='0'))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def test_past_show_counted_as_past_on_fresh_database(self):
+        db.session.add(Show(venue_id=1, artist_id=1, start_time=datetime(2020, 5, 21, 21, 30)))
+        db.session.commit()
+
+        venue = Venue.query.get(1)
+        self.assertEqual(venue.upcoming_shows_count, 0)
+        self.assertEqual(venue.past_shows_count, 1)
+        self.assertEqual(Artist.query.get(1).past_shows_count, 1)
+
+    def test_upcoming_show_counted_as_upcoming_on_fresh_database(self):
+        db.session.add(Show(venue_id=1, artist_id=1, start_time=datetime.now() + timedelta(days=7)))
+        db.session.commit()
+
+        venue = Venue.query.get(1)
+        self.assertEqual(venue.upcoming_shows_count, 1)
+        self.assertEqual(venue.past_shows_count, 0)
+
+    def test_bulk_show_deltas_on_fresh_database(self):
+        counters.apply_deltas(db.session, [(1, 1, datetime(2020, 5, 21, 21, 30), 1)])
+        db.session.commit()
+
+        venue = Venue.query.get(1)
+        self.assertEqual((venue.upcoming_shows_count, venue.past_shows_count), (0, 1))
+
+    def test_import_retries_a_failed_batch_a_row_at_a_time(self):
+        refused = datetime(2027, 1, 15, 20)
+
+        class FlakyImporter(Importer):
+            def _insert_mappings(self, mappings):
+                if any(mapping['start_time'] == refused for mapping in mappings):
+                    raise exc.IntegrityError('INSERT', {}, Exception('refused'))
+                super()._insert_mappings(mappings)
+
+        db.session.add(Artist(id=2, name='Matt Quevedo', city='New York', state='NY', phone='0'))
+        db.session.commit()
+        report = FlakyImporter('shows').run([
+            (1, {'artist_id': 1, 'venue_id': 1, 'start_time': '2027-01-01 20:00:00',
+                 'repeat': 'weekly', 'occurrences': 4}),
+            (2, {'artist_id': 2, 'venue_id': 1, 'start_time': '2027-06-01 20:00:00'}),
+        ])
+
+        # the weekly row is refused whole, not three of its four shows
+        self.assertEqual([error['line'] for error in report.errors], [1])
+        self.assertEqual((report.inserted, report.records), (1, 1))
+        self.assertEqual(Show.query.count(), 1)
+
+    def import_file(self, kind, name, data):
+        return self.client.post('/import?format=json', content_type='multipart/form-data', data={
+            'kind': kind, 'file': (io.BytesIO(data), name)})
+
+    def test_import_stopped_by_a_bad_file_keeps_and_reports_committed_rows(self):
+        rows = ''.join('Artist {},Austin,TX,0,Jazz,https://www.facebook.com/{}\n'.format(id, id)
+                       for id in range(2, 603))
+        data = ('name,city,state,phone,genres,facebook_link\n' + rows).encode('utf-8') + b'\xff\xfebad,row\n'
+        self.client.get('/artists/autocomplete?q=artist')
+
+        res = self.import_file('artists', 'artists.csv', data)
+        report = json.loads(res.data)
+
+        # the decoder reads ahead, it may stop a few lines before the bad one
+        self.assertEqual(res.status_code, 400)
+        self.assertIn('decode', report['stopped']['error'])
+        self.assertGreater(report['inserted'], 500)
+        self.assertEqual((report['inserted'], report['failed']), (report['rows'], 0))
+        self.assertEqual(Artist.query.count(), 1 + report['inserted'])
+        # the indexes were told of the rows committed before the error
+        results = json.loads(self.client.get('/artists/autocomplete?q=artist 50').data)['results']
+        self.assertIn('Artist 500', [result['name'] for result in results])
+
+    def test_json_array_is_read_an_item_at_a_time(self):
+        class Upload(io.BytesIO):
+            def read(self, size=-1):
+                assert 0 <= size <= 64 * 1024, 'the array was read whole'
+                return super().read(size)
+
+        rows = [{'name': 'Artist {}'.format(id), 'city': 'Austin', 'state': 'TX', 'phone': '0'}
+                for id in range(20000)]
+        read = list(read_rows(Upload(json.dumps(rows).encode('utf-8')), 'artists.json'))
+        self.assertEqual(read, list(enumerate(rows, 1)))
+
+        with self.assertRaises(ValueError):
+            list(read_rows(io.BytesIO(b'[{"name": "a"}, {"name": '), 'artists.json'))
+
+    def book(self, venue_id, artist_id, start_time):
+        return self.client.post('/shows/create', data={
+            'venue_id': venue_id, 'artist_id': artist_id, 'start_time': start_time})
+
+    def test_overlapping_booking_is_refused(self):
+        db.session.add(Artist(id=2, name='Matt Quevedo', city='New York', state='NY', phone='0'))
+        db.session.add(Venue(id=2, name='Park Square Live Music & Coffee', city='San Francisco', state='CA',
+                             phone='0'))
+        db.session.commit()
+        self.assertIn(b'successfully listed', self.book(1, 1, '2027-01-01 20:00:00').data)
+
+        # the venue is taken until 23:00, the artist as well
+        res = self.book(1, 2, '2027-01-01 22:00:00')
+        self.assertIn(b'The venue is already booked', res.data)
+        res = self.book(2, 1, '2027-01-01 18:00:00')
+        self.assertIn(b'The artist is already booked', res.data)
+        self.assertNotIn(b'The venue is already booked', res.data)
+        self.assertEqual(Show.query.count(), 1)
+
+        self.assertIn(b'successfully listed', self.book(1, 2, '2027-01-01 23:00:00').data)
+        self.assertEqual(Show.query.count(), 2)
+
+    def test_shows_of_soft_deleted_artists_do_not_block_bookings(self):
+        db.session.add(Artist(id=2, name='Matt Quevedo', city='New York', state='NY', phone='0'))
+        db.session.add(Show(venue_id=1, artist_id=1, start_time=datetime(2027, 1, 1, 20)))
+        db.session.commit()
+        deletion.soft_delete(Artist, 1)
+
+        self.assertEqual(queries.booking_conflicts(1, 2, datetime(2027, 1, 1, 21)), [])
+        self.assertIn(b'successfully listed', self.book(1, 2, '2027-01-01 21:00:00').data)
+
+    def statements(self, delete, shows):
+        """Statements run by delete() of venue 1 with shows shows, on a new database"""
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        now = datetime.now()
+        db.session.bulk_insert_mappings(Venue, [{
+            'id': id, 'name': 'Venue {}'.format(id), 'city': 'Austin', 'state': 'TX', 'phone': '0',
+        } for id in (1, 2)])
+        db.session.bulk_insert_mappings(Artist, [{
+            'id': id, 'name': 'Artist {}'.format(id), 'city': 'Austin', 'state': 'TX', 'phone': '0',
+        } for id in range(1, 11)])
+        db.session.bulk_insert_mappings(Show, [{
+            'venue_id': 1 + (i % 50 == 0), 'artist_id': 1 + i % 10,
+            'start_time': now + timedelta(hours=i - shows // 2),
+        } for i in range(shows)])
+        db.session.commit()
+        counters.recount(now)
+
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            delete()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+
+        # the shows left are those of venue 2, the artists' counters agree
+        artists = Artist.query.all()
+        self.assertEqual(
+            sum(artist.upcoming_shows_count + artist.past_shows_count for artist in artists),
+            Show.query.filter(Show.venue_id == 2).count())
+        return len(statements)
+
+    def test_delete_runs_constant_statements(self):
+        counts = [self.statements(lambda: deletion.delete(Venue, 1), shows) for shows in (10, 1000)]
+
+        self.assertEqual(counts[0], counts[1])
+        self.assertIsNone(Venue.query.get(1))
+        self.assertEqual(Show.query.filter(Show.venue_id == 1).count(), 0)
+
+    def test_soft_delete_runs_constant_statements(self):
+        counts = [self.statements(lambda: deletion.soft_delete(Venue, 1), shows) for shows in (10, 1000)]
+
+        self.assertEqual(counts[0], counts[1])
+        self.assertIsNotNone(Venue.query.get(1).deleted_at)
+
+    def test_genre_filter_beyond_sqlite_variable_limit(self):
+        db.session.bulk_insert_mappings(Artist, [{
+            'id': id, 'name': 'Artist {}'.format(id), 'city': 'Austin', 'state': 'TX', 'phone': '0',
+            'genres': ['Jazz'] if id % 3 else ['Folk'],
+        } for id in range(2, 3002)])
+        db.session.commit()
+        search = NameSearch(Artist)
+
+        # the 2000 jazz ids are not sent to sqlite as one IN (...)
+        artists = queries.artist_list(*search.filters('Jazz'), ids=search.genre_ids('Jazz'))
+        self.assertEqual(len(artists), 2000)
+        self.assertEqual(search.search('', genre='Jazz', city='Austin')['count'], 2000)
+
+    def test_trigram_index_ranks_word_starts_then_names(self):
+        index = TrigramIndex()
+        for id, name in ((1, 'The Musical Hop'), (2, 'Park Square Live Music & Coffee'),
+                         (3, 'The Dueling Pianos Bar'), (4, 'Hip Hop Shop'), (5, 'Bishop Hall'),
+                         (6, 'Music Box'), (7, 'Music Bay')):
+            index.add(id, name)
+        index.remove(3)
+
+        self.assertEqual(index.search('HOP'), [4, 1, 5])
+        # ties on where and how long are ordered by name
+        self.assertEqual(index.search('music'), [7, 6, 1, 2])
+        self.assertEqual(index.search('bar'), [])
+        self.assertEqual(index.search('ho'), [4, 1, 5])
+
+    def test_matchmaker_follows_commits_without_reloading(self):
+        Venue.query.get(1).seeking_talent = True
+        Artist.query.get(1).seeking_venue = False
+        db.session.add(Artist(id=2, name='Matt Quevedo', city='New York', state='NY', phone='0',
+                              seeking_venue=True, genres=['Jazz']))
+        db.session.add(Artist(id=3, name='The Wild Sax Band', city='San Francisco', state='CA', phone='0',
+                              seeking_venue=True, genres=['Jazz']))
+        db.session.commit()
+        counters.recount()
+        matchmaker.reset()
+        candidates = matchmaker._load
+        experience = lambda: dict(zip(candidates()[Artist].ids.tolist(), candidates()[Artist].experience))
+        self.assertEqual(experience(), {2: 0.0, 3: 0.0})
+
+        # a past show raises the experience of both sides
+        db.session.add(Show(venue_id=1, artist_id=3, start_time=datetime(2020, 5, 21, 21, 30)))
+        db.session.commit()
+        self.assertEqual(experience(), {2: 0.0, 3: 1.0})
+        self.assertEqual(list(candidates()[Venue].experience), [1.0])
+
+        # a venue written leaves the artists as they are
+        artists = candidates()[Artist]
+        Venue.query.get(1).genres = ['Jazz']
+        db.session.commit()
+        self.assertIs(candidates()[Artist], artists)
+        self.assertEqual(int(candidates()[Venue].masks[0]), matchmaking.genre_mask(['Jazz']))
+
+        # an artist no longer seeking a venue leaves the candidates
+        Artist.query.get(2).seeking_venue = False
+        db.session.commit()
+        self.assertEqual(list(candidates()[Artist].ids), [3])
+
+        # a show started since the last rollover counts once it is rolled over
+        start_time = datetime.now() + timedelta(minutes=1)
+        db.session.add(Show(venue_id=1, artist_id=1, start_time=start_time))
+        db.session.commit()
+        Artist.query.get(1).seeking_venue = True
+        db.session.commit()
+        self.assertEqual(experience()[1], 0.0)
+        counters.rollover(start_time + timedelta(minutes=1))
+        self.assertEqual(experience()[1], 1.0)
+
+    def test_page_cache_serves_until_a_write_bumps_the_version(self):
+        self.assertIn(b'The Musical Hop', self.client.get('/venues/1').data)
+        db.session.execute(Venue.__table__.update().values(name='The Musical Hip'))
+        db.session.commit()
+
+        # written around the orm, the cached page is still served
+        self.assertIn(b'The Musical Hop', self.client.get('/venues/1').data)
+        # a show written through the orm bumps its venue, the page is rendered again
+        db.session.add(Show(venue_id=1, artist_id=1, start_time=datetime(2020, 5, 21, 21, 30)))
+        db.session.commit()
+        self.assertIn(b'The Musical Hip', self.client.get('/venues/1').data)
+
+    def test_page_cache_versions_outlive_evicted_pages(self):
+        backend = fyyur.page_cache.backend
+        version = fyyur.page_cache.version('venue', 1)
+        fyyur.page_cache.bump('venue', 1)
+        for id in range(backend.maxsize + 1):
+            backend.set('page:{}'.format(id), 'page')
+        self.assertEqual(fyyur.page_cache.version('venue', 1), version + 1)
+
+    def test_page_cache_variant_ignores_other_parameters(self):
+        self.client.get('/venues/1')
+        entries = len(fyyur.page_cache.backend)
+        self.client.get('/venues/1?utm_source=x')
+        self.client.get('/venues/1?past_page=1&junk=1')
+        self.assertEqual(len(fyyur.page_cache.backend), entries)
+        self.client.get('/venues/1?past_page=2')
+        self.assertEqual(len(fyyur.page_cache.backend), entries + 1)
+
+    def test_datetime_filter_matches_babel(self):
+        values = ['2019-05-21T21:30:00.000Z', '2019-05-21T21:30:00+02:00', '2019-05-21T21:30:00-07:00',
+                  '2019-05-21T21:30:00', datetime(2019, 5, 21, 21, 30)]
+        for value in values:
+            date = value if isinstance(value, datetime) else fyyur.dateutil.parser.parse(value)
+            for format in ('full', 'medium', 'short', 'long', "h:mma zzzz", "HH:mm ZZZZZ"):
+                expected = fyyur.babel.dates.format_datetime(
+                    date, fyyur.DATETIME_FORMATS.get(format, format), locale='en')
+                self.assertEqual(fyyur.format_datetime(value, format), expected, (value, format))
+
+    def test_autocomplete_completes_any_word_of_the_name(self):
+        db.session.add(Venue(id=2, name='Park Square Live Music & Coffee', city='San Francisco', state='CA',
+                             phone='0'))
+        db.session.add(Venue(id=3, name='The Dueling Pianos Bar', city='New York', state='NY', phone='0'))
+        db.session.commit()
+
+        def complete(q):
+            return self.client.get('/venues/autocomplete', query_string={'q': q}).get_json()['results']
+
+        # ordered by the word matched, 'music' before 'musical'
+        self.assertEqual(complete('mus'), [{'id': 2, 'name': 'Park Square Live Music & Coffee'},
+                                           {'id': 1, 'name': 'The Musical Hop'}])
+        # across word boundaries, in any case
+        self.assertEqual([venue['id'] for venue in complete('THE')], [3, 1])
+        self.assertEqual(complete('pianos b'), [{'id': 3, 'name': 'The Dueling Pianos Bar'}])
+        # each venue once, however many of its words match
+        db.session.add(Venue(id=4, name='Pop Pop Club', city='Austin', state='TX', phone='0'))
+        db.session.commit()
+        self.assertEqual([venue['id'] for venue in complete('pop')], [4])
+        self.assertEqual(complete('xyz'), [])
+        self.assertEqual(complete('  '), [])
+        self.assertEqual(self.client.get('/artists/autocomplete?q=pet').get_json()['results'],
+                         [{'id': 1, 'name': 'Guns N Petals'}])
+
+    def test_shows_cursor_walks_every_show_once_in_order(self):
+        # pairs of shows at the same time, ordered by id within a pair. show
+        # id is its artist's id
+        db.session.bulk_insert_mappings(Artist, [{
+            'id': id, 'name': 'Artist {}'.format(id), 'city': 'Austin', 'state': 'TX', 'phone': '0',
+        } for id in range(2, 121)])
+        db.session.bulk_insert_mappings(Show, [{
+            'id': id, 'venue_id': 1, 'artist_id': id, 'start_time': datetime(2020, 1, 1) + timedelta(hours=id // 2),
+        } for id in range(1, 121)])
+        db.session.commit()
+
+        seen, pages, cursor = [], 0, None
+        while True:
+            shows, cursor = queries.shows_page(cursor=cursor, limit=40)
+            seen.extend((show['start_time'], show['artist_id']) for show in shows)
+            pages += 1
+            if cursor is None:
+                break
+        # three full pages, the last without a cursor to an empty one
+        self.assertEqual(pages, 3)
+        self.assertEqual(seen, sorted(seen))
+        self.assertEqual([id for _, id in seen], list(range(1, 121)))
+
+        # the route links to the next page with the filters kept
+        res = self.client.get('/shows?from=all')
+        self.assertEqual(res.data.count(b'tile-show'), queries.SHOWS_LISTING_PAGE)
+        link = re.search(rb'href="(/shows\?[^"]+)">Later shows', res.data).group(1).decode().replace('&amp;', '&')
+        self.assertIn('from=all', link)
+        res = self.client.get(link)
+        self.assertEqual(res.data.count(b'tile-show'), 120 - queries.SHOWS_LISTING_PAGE)
+        self.assertNotIn(b'Later shows', res.data)
+        self.assertEqual(self.client.get('/shows?cursor=junk').status_code, 400)
+
+    def test_shows_date_filter(self):
+        db.session.add_all([Show(venue_id=1, artist_id=1, start_time=start_time) for start_time in (
+            datetime(2019, 12, 31, 23), datetime(2020, 1, 1, 20), datetime(2020, 1, 31, 20), datetime(2020, 2, 1),
+            datetime.now() + timedelta(days=1))])
+        db.session.commit()
+
+        def count(query):
+            return self.client.get('/shows' + query).data.count(b'tile-show')
+
+        # [from, to), upcoming only unless from is given
+        self.assertEqual(count('?from=2020-01-01&to=2020-02-01'), 2)
+        self.assertEqual(count('?from=2020-01-01'), 4)
+        self.assertEqual(count('?from=all&to=2020-01-01'), 1)
+        self.assertEqual(count('?from=all'), 5)
+        self.assertEqual(count(''), 1)
+        self.assertEqual(self.client.get('/shows?from=someday').status_code, 400)
+
+    def test_nearby_venues_within_the_radius_nearest_first(self):
+        # San Francisco (venue 1) is 13 km from Oakland, 68 km from San Jose
+        # and 120 km from Sacramento
+        db.session.add_all([
+            Venue(id=2, name='Oakland Venue', city='Oakland', state='CA', phone='0', seeking_talent=True),
+            Venue(id=3, name='San Jose Venue', city='San Jose', state='CA', phone='0', seeking_talent=False),
+            Venue(id=4, name='Sacramento Venue', city='Sacramento', state='CA', phone='0', seeking_talent=False),
+            Venue(id=5, name='New York Venue', city='New York', state='NY', phone='0', seeking_talent=True),
+        ])
+        db.session.commit()
+
+        def nearby(**args):
+            return [venue['id'] for venue in fyyur.venue_locator.nearby(**args)['data']]
+
+        self.assertEqual(nearby(lat=37.7749, lng=-122.4194, km=20), [1, 2])
+        self.assertEqual(nearby(lat=37.7749, lng=-122.4194, km=100), [1, 2, 3])
+        self.assertEqual(nearby(lat=37.3382, lng=-121.8863, km=200), [3, 2, 1, 4])
+        self.assertEqual(nearby(lat=37.7749, lng=-122.4194, km=100, seeking_talent=True), [1, 2])
+        Venue.query.get(1).seeking_talent = False
+        db.session.commit()
+        self.assertEqual(nearby(lat=37.7749, lng=-122.4194, km=100, seeking_talent=True), [2])
+
+        res = self.client.get('/venues/nearby?near=San Francisco, CA&km=100')
+        self.assertIn(b'within 100.0 km of San Francisco, CA: 3', res.data)
+        self.assertIn(b'San Jose Venue', res.data)
+        self.assertNotIn(b'Sacramento Venue', res.data)
+        self.assertIn(b'seeking talent within 25 km: 1',
+                      self.client.get('/venues/nearby?lat=37.8044&lng=-122.2712&seeking_talent=1').data)
+        self.assertIn(b'within 500 km', self.client.get('/venues/nearby?near=Oakland, CA&km=20000').data)
+        self.assertIn(b'No location found for Atlantis, XX', self.client.get('/venues/nearby?near=Atlantis, XX').data)
+        for query in ('', '?lat=37.8', '?lat=91&lng=0', '?lat=0&lng=181', '?lat=0&lng=0&km=0'):
+            self.assertEqual(self.client.get('/venues/nearby' + query).status_code, 400, query)
+
+        # moved and deleted venues leave the index as they are committed
+        Venue.query.get(3).city = 'New York'
+        Venue.query.get(3).state = 'NY'
+        db.session.commit()
+        deletion.soft_delete(Venue, 2)
+        self.assertEqual(nearby(lat=37.7749, lng=-122.4194, km=100), [1])
+        self.assertEqual(nearby(lat=40.7128, lng=-74.0060, km=10), [3, 5])
+
+    def test_venues_grouped_by_area_with_upcoming_counts(self):
+        db.session.add_all([
+            Venue(id=2, name='Park Square Live Music & Coffee', city='San Francisco', state='CA', phone='0',
+                  genres=['Jazz']),
+            Venue(id=3, name='The Dueling Pianos Bar', city='New York', state='NY', phone='0', genres=['Jazz']),
+            Venue(id=4, name='Alamo Drafthouse', city='Austin', state='TX', phone='0'),
+        ])
+        later = datetime.now() + timedelta(days=7)
+        db.session.add_all([Show(venue_id=venue_id, artist_id=1, start_time=start_time) for venue_id, start_time in (
+            (1, later), (1, later + timedelta(days=1)), (1, datetime(2020, 1, 1)), (3, later))])
+        db.session.commit()
+        deletion.soft_delete(Venue, 4)
+
+        # areas by state then city, venues by name
+        self.assertEqual(queries.venue_areas(), [{
+            'city': 'San Francisco', 'state': 'CA', 'venues': [
+                {'id': 2, 'name': 'Park Square Live Music & Coffee', 'num_upcoming_shows': 0},
+                {'id': 1, 'name': 'The Musical Hop', 'num_upcoming_shows': 2}],
+        }, {
+            'city': 'New York', 'state': 'NY', 'venues': [
+                {'id': 3, 'name': 'The Dueling Pianos Bar', 'num_upcoming_shows': 1}],
+        }])
+
+        res = self.client.get('/venues?genre=jazz&city=San Francisco')
+        self.assertIn(b'Park Square Live Music', res.data)
+        self.assertNotIn(b'The Musical Hop', res.data)
+        self.assertNotIn(b'Dueling Pianos', res.data)
+        self.assertEqual(self.client.get('/venues?genre=polka').status_code, 400)
+
+        def statements(path):
+            found = []
+            listener = lambda *args: found.append(args[2])
+            event.listen(db.engine, 'before_cursor_execute', listener)
+            try:
+                self.client.get(path)
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', listener)
+            return len(found)
+
+        before = statements('/venues')
+        db.session.bulk_insert_mappings(Venue, [{
+            'id': id, 'name': 'Venue {}'.format(id), 'city': 'City {}'.format(id % 7), 'state': 'TX', 'phone': '0',
+        } for id in range(10, 110)])
+        db.session.commit()
+        self.assertEqual(statements('/venues'), before)
+
+    def test_detail_pages_list_a_page_of_each_show_list(self):
+        now = datetime(2024, 6, 1, 12)
+        db.session.add(Artist(id=2, name='Matt Quevedo', city='New York', state='NY', phone='0'))
+        db.session.bulk_insert_mappings(Show, [{
+            'venue_id': 1, 'artist_id': 1 + hours % 2, 'start_time': now + timedelta(hours=hours),
+        } for hours in range(-30, 20) if hours])
+        db.session.commit()
+
+        venue = queries.venue_detail(1, per_page=12, now=now)
+        self.assertEqual((venue['upcoming_shows_count'], venue['past_shows_count']), (19, 30))
+        self.assertEqual((venue['upcoming_shows_pages'], venue['past_shows_pages']), (2, 3))
+        self.assertEqual(venue['next_show_time'], now + timedelta(hours=1))
+        # upcoming soonest first, past most recent first
+        self.assertEqual([show['start_time'] for show in venue['upcoming_shows']],
+                         [now + timedelta(hours=hours) for hours in range(1, 13)])
+        self.assertEqual([show['start_time'] for show in venue['past_shows']],
+                         [now - timedelta(hours=hours) for hours in range(1, 13)])
+        self.assertEqual(venue['upcoming_shows'][0]['artist_name'], 'Matt Quevedo')
+
+        venue = queries.venue_detail(1, upcoming_page=2, past_page=3, per_page=12, now=now)
+        self.assertEqual(len(venue['upcoming_shows']), 7)
+        self.assertEqual(venue['past_shows'][-1]['start_time'], now - timedelta(hours=30))
+        self.assertEqual(queries.venue_detail(1, past_page=4, per_page=12, now=now)['past_shows'], [])
+
+        # the other side, and shows of hidden artists left out of both
+        artist = queries.artist_detail(2, per_page=12, now=now)
+        self.assertEqual((artist['upcoming_shows_count'], artist['past_shows_count']), (10, 15))
+        self.assertEqual(artist['upcoming_shows'][0]['venue_name'], 'The Musical Hop')
+        deletion.soft_delete(Artist, 2)
+        venue = queries.venue_detail(1, per_page=12, now=now)
+        self.assertEqual((venue['upcoming_shows_count'], venue['past_shows_count']), (9, 15))
+        self.assertIsNone(queries.artist_detail(2))
+        self.assertIsNone(queries.venue_detail(99))
+
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            queries.venue_detail(1, now=now)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        self.assertEqual(len(statements), 2)
+
+        res = self.client.get('/venues/1?past_page=2')
+        self.assertIn(b'Page 2 of', res.data)
+        self.assertEqual(self.client.get('/artists/2').status_code, 404)
+        self.assertEqual(self.client.get('/venues/99').status_code, 404)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
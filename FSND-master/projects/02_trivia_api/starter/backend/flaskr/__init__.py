@@ -1,17 +1,69 @@
 import os
-from flask import Flask, request, abort, jsonify
+from flask import Flask, Response, request, abort, jsonify, current_app
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 import random
 
-from models import setup_db, Question, Category
+from models import setup_db, db, Question, question_listeners, category_listeners
+from .categories import CategoryRegistry
+from .pagination import KeysetPaginator
+from .search import QuestionSearch
+from .quiz import QuizPool, QuizSessions
 
 QUESTIONS_PER_PAGE = 10
 
+'''
+of_app(app, listener)
+    listener, called only for writes made in app
+    the listener lists are process wide, each app's caches follow the
+    database that app is bound to
+'''
+def of_app(app, listener):
+  def notify(*args):
+    if current_app._get_current_object() is app:
+      listener(*args)
+  return notify
+
 def create_app(test_config=None):
   # create and configure the app
   app = Flask(__name__)
   setup_db(app)
+
+  '''
+  app.extensions['trivia'], the app's caches. nothing is read from the
+  database here: each cache loads on first use, from the database the app
+  is bound to by then
+
+  category_registry
+      the categories map, loaded once and rebuilt only after category writes
+  question_pages
+      keyset pagination over every question, ordered by id
+      the cached total is reset whenever a question is written
+  question_search
+      ranked substring search over the question text, backed by a pg_trgm
+      index on PostgreSQL or an incrementally updated in-process trigram index
+  quiz_pool
+      the question ids of every category, so a quiz question is drawn
+      in constant expected time instead of scanning its category
+  quiz_sessions
+      server-side quiz state for clients that opt into session mode
+  '''
+  category_registry = CategoryRegistry()
+  question_pages = KeysetPaginator(lambda: Question.query, Question.id, QUESTIONS_PER_PAGE)
+  question_search = QuestionSearch()
+  quiz_pool = QuizPool()
+  quiz_sessions = QuizSessions()
+  category_listeners.append(of_app(app, category_registry.invalidate))
+  question_listeners.append(of_app(app, question_pages.invalidate))
+  question_listeners.append(of_app(app, question_search.question_changed))
+  question_listeners.append(of_app(app, quiz_pool.question_changed))
+  app.extensions['trivia'] = {
+    'category_registry': category_registry,
+    'question_pages': question_pages,
+    'question_search': question_search,
+    'quiz_pool': quiz_pool,
+    'quiz_sessions': quiz_sessions,
+  }
   
   '''
   @TODO: Set up CORS. Allow '*' for origins. Delete the sample route after completing the TODOs
@@ -22,24 +74,52 @@ def create_app(test_config=None):
   '''
 
   '''
-  @TODO: 
-  Create an endpoint to handle GET requests 
-  for all available categories.
+  GET /categories
+  returns all available categories as {id: type},
+  served pre-serialized from category_registry with an ETag
   '''
+  @app.route('/categories')
+  def get_categories():
+    _, body, etag = category_registry.get()
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    return response.make_conditional(request)
 
 
   '''
-  @TODO: 
-  Create an endpoint to handle GET requests for questions, 
-  including pagination (every 10 questions). 
-  This endpoint should return a list of questions, 
-  number of total questions, current category, categories. 
+  GET /questions?page=<number> or GET /questions?cursor=<next_cursor>
+  returns one page of questions, number of total questions,
+  current category and categories.
+  pages are read with keyset pagination on the question id and
+  next_cursor can be passed back to get the following page,
+  total_questions is a cached count rather than a COUNT(*) per page.
 
   TEST: At this point, when you start the application
   you should see questions and categories generated,
   ten questions per page and pagination at the bottom of the screen for three pages.
   Clicking on the page numbers should update the questions. 
   '''
+  @app.route('/questions')
+  def get_questions():
+    cursor = request.args.get('cursor')
+    if cursor is not None:
+      try:
+        questions = question_pages.after(cursor)
+      except ValueError:
+        abort(400)
+    else:
+      questions = question_pages.page(request.args.get('page', 1, type=int))
+    if not questions:
+      abort(404)
+
+    return jsonify({
+      'success': True,
+      'questions': [question.format() for question in questions],
+      'total_questions': question_pages.count(),
+      'categories': category_registry.categories,
+      'current_category': None,
+      'next_cursor': question_pages.next_cursor(questions)
+    })
 
   '''
   @TODO: 
@@ -50,26 +130,53 @@ def create_app(test_config=None):
   '''
 
   '''
-  @TODO: 
-  Create an endpoint to POST a new question, 
-  which will require the question and answer text, 
-  category, and difficulty score.
+  POST /questions
+  with a searchTerm, returns the questions for whom the search term
+  is a substring of the question, best matches first and paginated
+  (every 10 questions, 'page' in the body selects the page).
+  otherwise creates a new question, which will require the question
+  and answer text, category, and difficulty score.
 
   TEST: When you submit a question on the "Add" tab, 
   the form will clear and the question will appear at the end of the last page
   of the questions list in the "List" tab.  
-  '''
-
-  '''
-  @TODO: 
-  Create a POST endpoint to get questions based on a search term. 
-  It should return any questions for whom the search term 
-  is a substring of the question. 
 
   TEST: Search by any phrase. The questions list will update to include 
   only question that include that string within their question. 
   Try using the word "title" to start. 
   '''
+  @app.route('/questions', methods=['POST'])
+  def post_question():
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+      abort(400)
+
+    if 'searchTerm' in body:
+      page = body.get('page', 1)
+      if not isinstance(body['searchTerm'], str) or not isinstance(page, int):
+        abort(400)
+      questions, total = question_search.search(body['searchTerm'], page, QUESTIONS_PER_PAGE)
+      return jsonify({
+        'success': True,
+        'questions': [question.format() for question in questions],
+        'total_questions': total,
+        'current_category': None
+      })
+
+    fields = ('question', 'answer', 'category', 'difficulty')
+    if any(not body.get(field) for field in fields):
+      abort(422)
+    try:
+      question = Question(*[body[field] for field in fields])
+      question.insert()
+    except Exception:
+      db.session.rollback()
+      abort(422)
+
+    return jsonify({
+      'success': True,
+      'created': question.id
+    })
 
   '''
   @TODO: 
@@ -82,22 +189,90 @@ def create_app(test_config=None):
 
 
   '''
-  @TODO: 
-  Create a POST endpoint to get questions to play the quiz. 
-  This endpoint should take category and previous question parameters 
-  and return a random questions within the given category, 
+  POST /quizzes
+  takes category and previous question parameters 
+  and returns a random questions within the given category, 
   if provided, and that is not one of the previous questions. 
+  the question is drawn from quiz_pool, question is null once
+  every question of the category has been played.
+
+  session mode: posting {"quiz_category": ..., "use_session": true}
+  starts a server-side quiz and the response carries a quiz_session id.
+  later turns post only {"quiz_session": id}, the server remembers which
+  questions were served. an unknown or expired session is a 404.
 
   TEST: In the "Play" tab, after a user selects "All" or a category,
   one question at a time is displayed, the user is allowed to answer
   and shown whether they were correct or not. 
   '''
+  @app.route('/quizzes', methods=['POST'])
+  def play_quiz():
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+      abort(400)
+
+    if 'quiz_session' in body:
+      session_id = body['quiz_session']
+      session = quiz_sessions.get(session_id) if isinstance(session_id, str) else None
+      if session is None:
+        abort(404)
+      return quiz_turn(session['category'], session['served'], session_id)
+
+    previous_questions = body.get('previous_questions', [])
+    quiz_category = body.get('quiz_category') or {}
+    if not isinstance(previous_questions, list) or not isinstance(quiz_category, dict):
+      abort(400)
+    if not all(isinstance(id, int) for id in previous_questions):
+      abort(400)
+
+    category = quiz_category.get('id') or None
+    if body.get('use_session'):
+      session_id = quiz_sessions.start(category)
+      session = quiz_sessions.get(session_id)
+      session['served'].update(previous_questions)
+      return quiz_turn(category, session['served'], session_id)
+    return quiz_turn(category, frozenset(previous_questions))
+
+  def quiz_turn(category, served, session_id=None):
+    question = quiz_pool.next_question(category, served)
+    response = {
+      'success': True,
+      'question': question.format() if question else None
+    }
+    if session_id is not None:
+      if question is not None:
+        served.add(question.id)
+      response['quiz_session'] = session_id
+    return jsonify(response)
 
   '''
   @TODO: 
   Create error handlers for all expected errors 
   including 404 and 422. 
   '''
+  @app.errorhandler(400)
+  def bad_request(error):
+    return jsonify({
+      'success': False,
+      'error': 400,
+      'message': 'bad request'
+    }), 400
+
+  @app.errorhandler(404)
+  def not_found(error):
+    return jsonify({
+      'success': False,
+      'error': 404,
+      'message': 'resource not found'
+    }), 404
+
+  @app.errorhandler(422)
+  def unprocessable(error):
+    return jsonify({
+      'success': False,
+      'error': 422,
+      'message': 'unprocessable'
+    }), 422
   
   return app
 
@@ -0,0 +1,63 @@
+import hashlib
+import json
+import threading
+
+from models import Category
+
+
+'''
+CategoryRegistry
+the categories table, loaded once and kept as ready to use dicts and bytes
+
+    get() returns (categories, body, etag) from a single load:
+    categories is the {id: type} map embedded in question listings,
+    body and etag are the serialized GET /categories response
+    invalidate() is registered as a category listener, so the next access
+    after a category write reloads. version increases on every invalidate,
+    a load that an invalidate overtook returns what it read but does not
+    keep it, the next access reads again
+'''
+class CategoryRegistry:
+  def __init__(self):
+    self.version = 0
+    self._state = None
+    self._lock = threading.Lock()
+
+  def load(self):
+    version = self.version
+    categories = {str(category.id): category.type for category in Category.query.order_by(Category.id)}
+    body = json.dumps({
+      'success': True,
+      'categories': categories
+    }).encode('utf-8')
+    state = (categories, body, hashlib.sha1(body).hexdigest())
+    with self._lock:
+      if self.version == version:
+        self._state = state
+    return state
+
+  def invalidate(self):
+    with self._lock:
+      self.version += 1
+      self._state = None
+
+  def get(self):
+    state = self._state
+    if state is None:
+      state = self.load()
+    return state
+
+  @property
+  def categories(self):
+    return self.get()[0]
+
+  @property
+  def body(self):
+    return self.get()[1]
+
+  @property
+  def etag(self):
+    return self.get()[2]
+
+  def __contains__(self, id):
+    return str(id) in self.categories
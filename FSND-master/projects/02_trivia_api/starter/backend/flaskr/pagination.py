@@ -0,0 +1,135 @@
+import base64
+import json
+import threading
+import time
+
+
+'''
+encode_cursor(key) / decode_cursor(cursor)
+    opaque page cursors, the cursor of a page is the key (an integer id)
+    of its last row
+    decode_cursor raises ValueError for anything it did not produce
+'''
+def encode_cursor(key):
+  return base64.urlsafe_b64encode(json.dumps({'after': key}).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+  try:
+    after = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))['after']
+  except Exception:
+    raise ValueError('invalid cursor')
+  # a crafted {"after": "x"} would otherwise reach the query
+  if not isinstance(after, int) or isinstance(after, bool):
+    raise ValueError('invalid cursor')
+  return after
+
+
+'''
+Page
+a list of rows that knows whether more rows follow it
+'''
+class Page(list):
+  def __init__(self, rows, has_next=False):
+    super().__init__(rows)
+    self.has_next = has_next
+
+
+'''
+KeysetPaginator
+keyset (seek) pagination over a unique, indexed key column
+
+    pages are fetched with WHERE key > :last_key ORDER BY key LIMIT per_page + 1,
+    so the cost of a page does not grow with its number or the table size,
+    and the extra row tells whether there is a next page
+    page numbers are supported by remembering the last key of every page
+    seen so far; jumping ahead scans only the key index once to fill the gap
+    the row count and page boundaries are cached until invalidate() is
+    called (on every write) or max_age seconds have passed, which bounds how
+    stale they can get when other processes write to the table
+
+    query is a callable returning the base query, so it is only built
+    inside an application context
+'''
+class KeysetPaginator:
+  def __init__(self, query, key, per_page, max_age=60, clock=time.monotonic):
+    self.query = query
+    self.key = key
+    self.per_page = per_page
+    self.max_age = max_age
+    self.clock = clock
+    self._lock = threading.Lock()
+    self.invalidate()
+
+  def invalidate(self, *args):
+    with self._lock:
+      self._count = None
+      self._boundaries = []
+      self._loaded_at = self.clock()
+
+  def _expire(self):
+    if self.clock() - self._loaded_at >= self.max_age:
+      self.invalidate()
+
+  '''
+  count()
+      the cached number of rows
+  '''
+  def count(self):
+    self._expire()
+    if self._count is None:
+      count = self.query().order_by(None).count()
+      with self._lock:
+        self._count = count
+    return self._count
+
+  '''
+  page(number)
+      the rows on the 1-based page number as a Page, empty past the last page
+  '''
+  def page(self, number):
+    if number < 1:
+      return Page([])
+    if number == 1:
+      return self.seek(None)
+    after = self._boundary(number - 1)
+    if after is None:
+      return Page([])
+    return self.seek(after)
+
+  '''
+  after(cursor)
+      the page following the one the cursor was issued for
+  '''
+  def after(self, cursor):
+    return self.seek(decode_cursor(cursor))
+
+  def seek(self, after):
+    query = self.query()
+    if after is not None:
+      query = query.filter(self.key > after)
+    rows = query.order_by(self.key).limit(self.per_page + 1).all()
+    return Page(rows[:self.per_page], len(rows) > self.per_page)
+
+  '''
+  next_cursor(rows)
+      the cursor of the page following rows (a Page), None on the last page
+  '''
+  def next_cursor(self, rows):
+    if not rows or not rows.has_next:
+      return None
+    return encode_cursor(getattr(rows[-1], self.key.key))
+
+  def _boundary(self, page):
+    # the key of the last row on page, None when there is no such page
+    self._expire()
+    with self._lock:
+      known = len(self._boundaries)
+      if page > known:
+        query = self.query().with_entities(self.key)
+        if known:
+          query = query.filter(self.key > self._boundaries[-1])
+        keys = [key for key, in query.order_by(self.key).limit((page - known) * self.per_page)]
+        self._boundaries.extend(keys[self.per_page - 1::self.per_page])
+      if page > len(self._boundaries):
+        return None
+      return self._boundaries[page - 1]
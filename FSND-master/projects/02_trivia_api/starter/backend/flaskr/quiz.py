@@ -0,0 +1,221 @@
+import random
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import select
+
+from models import db, Question
+
+
+'''
+IdPool
+an array of ids with O(1) add, remove and uniform random sampling
+
+    ids live in a list, positions maps each id to its index so a removal
+    can swap the last id into the freed slot
+'''
+class IdPool:
+  def __init__(self):
+    self.ids = []
+    self.positions = {}
+
+  def __len__(self):
+    return len(self.ids)
+
+  def __contains__(self, id):
+    return id in self.positions
+
+  def add(self, id):
+    if id not in self.positions:
+      self.positions[id] = len(self.ids)
+      self.ids.append(id)
+
+  def remove(self, id):
+    position = self.positions.pop(id, None)
+    if position is None:
+      return
+    last = self.ids.pop()
+    if position < len(self.ids):
+      self.ids[position] = last
+      self.positions[last] = position
+
+  '''
+  sample(exclude, rng)
+      a random id not in exclude, None when every id is excluded
+      draws are rejected while they hit exclude, which takes a constant
+      expected number of draws as long as most of the pool is still
+      available; once most of it is excluded the remaining ids are listed.
+      only the excluded ids in this pool count: exclude comes from the
+      client and may hold ids of other categories or no question at all
+  '''
+  def sample(self, exclude, rng=random):
+    size = len(self.ids)
+    if size == 0:
+      return None
+    excluded = sum(1 for id in exclude if id in self.positions)
+    if excluded * 2 < size:
+      while True:
+        id = self.ids[rng.randrange(size)]
+        if id not in exclude:
+          return id
+    remaining = [id for id in self.ids if id not in exclude]
+    if not remaining:
+      return None
+    return rng.choice(remaining)
+
+
+'''
+QuizPool
+the question ids of every category, kept in memory for quiz play
+
+    a pool per category plus one for all questions, loaded with a single
+    (id, category) query on first use and kept in sync through
+    question_changed, which is registered as a question listener.
+    changes are applied under the lock _load holds, and _load reads on a
+    connection of its own, so a question committed while the pools load
+    is either in its snapshot or applied once the load is done
+'''
+class QuizPool:
+  def __init__(self, rng=None):
+    self.rng = rng or random.Random()
+    self._loaded = False
+    self._lock = threading.Lock()
+    self._reset()
+
+  def _reset(self):
+    self._all = IdPool()
+    self._by_category = {}
+    self._categories = {}
+
+  def _add(self, id, category):
+    self._remove(id)
+    category = str(category)
+    self._all.add(id)
+    self._by_category.setdefault(category, IdPool()).add(id)
+    self._categories[id] = category
+
+  def _remove(self, id):
+    category = self._categories.pop(id, None)
+    if category is None:
+      return
+    self._all.remove(id)
+    self._by_category[category].remove(id)
+
+  def _load(self):
+    if self._loaded:
+      return
+    with self._lock:
+      if self._loaded:
+        return
+      self._reset()
+      # not db.session, whose transaction may have begun before changes
+      # that were already reported and skipped
+      with db.engine.connect() as connection:
+        for id, category in connection.execute(select([Question.id, Question.category])):
+          self._add(id, category)
+      self._loaded = True
+
+  def question_changed(self, action, questions):
+    with self._lock:
+      if action == 'reset':
+        self._loaded = False
+        return
+      if not self._loaded:
+        return
+      for question in questions:
+        if action == 'delete':
+          self._remove(question['id'])
+        else:
+          self._add(question['id'], question['category'])
+
+  '''
+  sample(category, exclude)
+      the id of a random question in category (all questions when category
+      is None) that is not in exclude, None when there is none left
+  '''
+  def sample(self, category=None, exclude=()):
+    self._load()
+    with self._lock:
+      pool = self._all if category is None else self._by_category.get(str(category))
+      if pool is None:
+        return None
+      return pool.sample(exclude, self.rng)
+
+  def discard(self, id):
+    with self._lock:
+      self._remove(id)
+
+  '''
+  next_question(category, exclude)
+      a random Question as in sample, loaded by primary key
+      ids that no longer exist in the database are dropped and redrawn
+  '''
+  def next_question(self, category=None, exclude=()):
+    while True:
+      id = self.sample(category, exclude)
+      if id is None:
+        return None
+      question = Question.query.get(id)
+      if question is not None:
+        return question
+      self.discard(id)
+
+
+'''
+QuizSessions
+server-side quiz state, so a client only sends its session id each turn
+
+    a session remembers its category and the set of question ids already
+    served. sessions idle for more than idle_timeout seconds are evicted,
+    checked from the least recently used end on every access, and at most
+    max_sessions are kept. sessions live in this process only
+'''
+class QuizSessions:
+  def __init__(self, idle_timeout=1800, max_sessions=10000, clock=time.monotonic):
+    self.idle_timeout = idle_timeout
+    self.max_sessions = max_sessions
+    self.clock = clock
+    self._sessions = OrderedDict()
+    self._lock = threading.Lock()
+
+  def __len__(self):
+    return len(self._sessions)
+
+  def _evict(self, now):
+    while self._sessions:
+      session_id, session = next(iter(self._sessions.items()))
+      if now - session['last_seen'] < self.idle_timeout and len(self._sessions) <= self.max_sessions:
+        break
+      del self._sessions[session_id]
+
+  '''
+  start(category)
+      opens a session for category (None for all questions), returns its id
+  '''
+  def start(self, category=None):
+    session_id = secrets.token_urlsafe(16)
+    now = self.clock()
+    with self._lock:
+      self._sessions[session_id] = {'category': category, 'served': set(), 'last_seen': now}
+      self._evict(now)
+    return session_id
+
+  '''
+  get(session_id)
+      the session dict, None when it is unknown or was evicted
+  '''
+  def get(self, session_id):
+    now = self.clock()
+    with self._lock:
+      self._evict(now)
+      session = self._sessions.get(session_id)
+      if session is not None:
+        session['last_seen'] = now
+        self._sessions.move_to_end(session_id)
+      return session
+
+  def end(self, session_id):
+    with self._lock:
+      self._sessions.pop(session_id, None)
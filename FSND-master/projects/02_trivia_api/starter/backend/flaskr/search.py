@@ -0,0 +1,177 @@
+import threading
+
+from sqlalchemy import func, select, text
+
+from models import db, Question
+
+
+'''
+trigrams(value)
+    the set of 3 character substrings of value
+'''
+def trigrams(value):
+  return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+'''
+TrigramIndex
+an in-process inverted index from trigrams to question ids
+
+    a substring search intersects the posting sets of the term's trigrams,
+    then confirms each candidate, so only questions sharing every trigram
+    of the term are looked at. terms shorter than 3 characters fall back to
+    scanning the indexed texts, which still avoids a table scan.
+    matching is case-insensitive, texts are stored lowercased
+'''
+class TrigramIndex:
+  def __init__(self):
+    self._texts = {}
+    self._postings = {}
+    self._lock = threading.Lock()
+
+  def __len__(self):
+    return len(self._texts)
+
+  def add(self, id, value):
+    with self._lock:
+      self._remove(id)
+      value = (value or '').lower()
+      self._texts[id] = value
+      for gram in trigrams(value):
+        self._postings.setdefault(gram, set()).add(id)
+
+  def remove(self, id):
+    with self._lock:
+      self._remove(id)
+
+  def _remove(self, id):
+    value = self._texts.pop(id, None)
+    if value is None:
+      return
+    for gram in trigrams(value):
+      posting = self._postings.get(gram)
+      if posting is not None:
+        posting.discard(id)
+        if not posting:
+          del self._postings[gram]
+
+  def clear(self):
+    with self._lock:
+      self._texts = {}
+      self._postings = {}
+
+  '''
+  search(term)
+      ids of the texts containing term, best matches first
+      matches at a word start rank above matches inside a word,
+      then earlier and shorter matches rank higher
+  '''
+  def search(self, term):
+    term = term.lower()
+    with self._lock:
+      grams = sorted(trigrams(term), key=lambda gram: len(self._postings.get(gram, ())))
+      if grams:
+        candidates = set(self._postings.get(grams[0], ()))
+        for gram in grams[1:]:
+          if not candidates:
+            break
+          candidates &= self._postings.get(gram, set())
+      else:
+        candidates = self._texts.keys()
+
+      ranked = []
+      for id in candidates:
+        value = self._texts[id]
+        position = value.find(term)
+        if position < 0:
+          continue
+        inside_word = position > 0 and value[position - 1].isalnum()
+        ranked.append((inside_word, position, len(value), id))
+    ranked.sort()
+    return [id for _, _, _, id in ranked]
+
+
+'''
+QuestionSearch
+substring search over Question.question, ranked and paginated
+
+    on PostgreSQL setup(), run on the first search, creates the pg_trgm
+    extension and a trigram GIN index on questions.question, so ILIKE '%term%' is an index scan that the
+    database keeps up to date; results are ranked by trigram similarity.
+    everywhere else (or when the extension cannot be created) an in-process
+    TrigramIndex is used, loaded on first search and kept in sync through
+    question_changed, which is registered as a question listener.
+    changes are applied under the lock _load holds, and _load reads on a
+    connection of its own, so a question committed while the index loads
+    is either in its snapshot or applied once the load is done
+'''
+class QuestionSearch:
+  def __init__(self):
+    self.index = TrigramIndex()
+    self.use_postgres = None
+    self._loaded = False
+    self._lock = threading.Lock()
+
+  def setup(self, engine):
+    self.use_postgres = False
+    if engine.dialect.name != 'postgresql':
+      return
+    try:
+      with engine.begin() as connection:
+        connection.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+        connection.execute(text(
+          'CREATE INDEX IF NOT EXISTS questions_question_trgm_idx '
+          'ON questions USING gin (question gin_trgm_ops)'
+        ))
+    except Exception:
+      return
+    self.use_postgres = True
+
+  def question_changed(self, action, questions):
+    with self._lock:
+      if action == 'reset':
+        self._loaded = False
+        self.index.clear()
+      elif self._loaded:
+        for question in questions:
+          if action == 'delete':
+            self.index.remove(question['id'])
+          else:
+            self.index.add(question['id'], question['question'])
+
+  def _load(self):
+    with self._lock:
+      if self._loaded:
+        return
+      self.index.clear()
+      # not db.session, whose transaction may have begun before changes
+      # that were already reported and skipped
+      with db.engine.connect() as connection:
+        for id, question in connection.execute(select([Question.id, Question.question])):
+          self.index.add(id, question)
+      self._loaded = True
+
+  '''
+  search(term, page, per_page)
+      returns (questions on the page, total number of matches)
+  '''
+  def search(self, term, page=1, per_page=10):
+    offset = (max(page, 1) - 1) * per_page
+    if self.use_postgres is None:
+      self.setup(db.engine)
+    if self.use_postgres:
+      pattern = '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+      query = Question.query.filter(Question.question.ilike(pattern, escape='\\'))
+      total = query.count()
+      questions = query \
+        .order_by(func.similarity(Question.question, term).desc(), Question.id) \
+        .offset(offset).limit(per_page).all()
+      return questions, total
+
+    self._load()
+    ids = self.index.search(term)
+    page_ids = ids[offset:offset + per_page]
+    if not page_ids:
+      return [], len(ids)
+    by_id = {question.id: question for question in Question.query.filter(Question.id.in_(page_ids))}
+    return [by_id[id] for id in page_ids if id in by_id], len(ids)
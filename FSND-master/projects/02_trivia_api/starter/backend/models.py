@@ -1,4 +1,6 @@
 import os
+from contextlib import contextmanager
+from functools import partial
 from sqlalchemy import Column, String, Integer, create_engine
 from flask_sqlalchemy import SQLAlchemy
 import json
@@ -19,6 +21,68 @@ def setup_db(app, database_path=database_path):
     db.init_app(app)
     db.create_all()
 
+'''
+unit_of_work()
+    groups model writes into a single transaction
+    insert/update/delete called inside the block only flush,
+    the outermost block commits once and rolls everything back on error
+    EXAMPLE
+        with unit_of_work():
+            for question in questions:
+                question.insert()
+'''
+@contextmanager
+def unit_of_work():
+  info = db.session.info
+  depth = info.get('unit_of_work', 0)
+  if depth == 0:
+    info['after_commit'] = []
+  info['unit_of_work'] = depth + 1
+  try:
+    yield db.session
+    if depth == 0:
+      db.session.commit()
+      for callback in info['after_commit']:
+        callback()
+  except Exception:
+    if depth == 0:
+      db.session.rollback()
+    raise
+  finally:
+    info['unit_of_work'] = depth
+    if depth == 0:
+      info['after_commit'] = []
+
+'''
+commit_session(after_commit)
+    commits the session, or only flushes it inside a unit_of_work
+    after_commit is called once the data is actually committed
+'''
+def commit_session(after_commit=None):
+  info = db.session.info
+  if info.get('unit_of_work'):
+    db.session.flush()
+    if after_commit is not None and after_commit not in info['after_commit']:
+      info['after_commit'].append(after_commit)
+    return
+  db.session.commit()
+  if after_commit is not None:
+    after_commit()
+
+'''
+question_listeners
+    callables invoked as listener(action, questions) after every committed
+    write to the questions table, so in-process caches can stay in sync
+    action is 'insert', 'update', 'delete' or 'reset', questions is a list
+    of Question.format() dicts (only 'id' is set for deletes, and the list
+    is empty for 'reset', which means anything may have changed)
+'''
+question_listeners = []
+
+def notify_question_listeners(action, questions=()):
+  for listener in question_listeners:
+    listener(action, list(questions))
+
 '''
 Question
 
@@ -40,14 +104,42 @@ class Question(db.Model):
 
   def insert(self):
     db.session.add(self)
-    db.session.commit()
+    db.session.flush()
+    commit_session(partial(notify_question_listeners, 'insert', [self.format()]))
   
   def update(self):
-    db.session.commit()
+    db.session.flush()
+    commit_session(partial(notify_question_listeners, 'update', [self.format()]))
 
   def delete(self):
+    deleted = {'id': self.id}
     db.session.delete(self)
-    db.session.commit()
+    commit_session(partial(notify_question_listeners, 'delete', [deleted]))
+
+  '''
+  bulk_insert(questions)
+      inserts many questions with one executemany in a single transaction
+      questions is a list of {'question', 'answer', 'category', 'difficulty'} dicts
+  '''
+  @classmethod
+  def bulk_insert(cls, questions):
+    with unit_of_work():
+      db.session.bulk_insert_mappings(cls, list(questions))
+      commit_session(partial(notify_question_listeners, 'reset'))
+
+  '''
+  bulk_delete(ids)
+      deletes the questions with the given ids in a single transaction,
+      without loading them into the session
+      returns the number of questions deleted
+  '''
+  @classmethod
+  def bulk_delete(cls, ids):
+    ids = list(ids)
+    with unit_of_work():
+      deleted = cls.query.filter(cls.id.in_(ids)).delete(synchronize_session=False)
+      commit_session(partial(notify_question_listeners, 'delete', [{'id': id} for id in ids]))
+    return deleted
 
   def format(self):
     return {
@@ -58,6 +150,16 @@ class Question(db.Model):
       'difficulty': self.difficulty
     }
 
+'''
+category_listeners
+    callables invoked as listener() after every committed category write
+'''
+category_listeners = []
+
+def notify_category_listeners():
+  for listener in category_listeners:
+    listener()
+
 '''
 Category
 
@@ -71,6 +173,17 @@ class Category(db.Model):
   def __init__(self, type):
     self.type = type
 
+  def insert(self):
+    db.session.add(self)
+    commit_session(notify_category_listeners)
+
+  def update(self):
+    commit_session(notify_category_listeners)
+
+  def delete(self):
+    db.session.delete(self)
+    commit_session(notify_category_listeners)
+
   def format(self):
     return {
       'id': self.id,
@@ -1,9 +1,15 @@
 import os
+import base64
+import random
 import unittest
 import json
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import Column, Integer, MetaData, Table, create_engine
+from sqlalchemy.orm import Session
 
 from flaskr import create_app
+from flaskr.pagination import KeysetPaginator
+from flaskr.quiz import IdPool
 from models import setup_db, Question, Category
 
 
@@ -34,6 +40,209 @@ class TriviaTestCase(unittest.TestCase):
     Write at least one test for each test for successful operation and for expected errors.
     """
 
+    def test_get_categories(self):
+        res = self.client().get('/categories')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(data['categories'])
+
+    def test_get_categories_not_modified(self):
+        etag = self.client().get('/categories').headers['ETag']
+        res = self.client().get('/categories', headers={'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 304)
+
+    def test_get_paginated_questions(self):
+        res = self.client().get('/questions?page=1')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(data['total_questions'])
+        self.assertTrue(data['categories'])
+        self.assertLessEqual(len(data['questions']), 10)
+
+    def test_cursor_continues_page_numbers(self):
+        first = json.loads(self.client().get('/questions?page=1').data)
+        if first['next_cursor'] is None:
+            self.skipTest('needs more than one page of questions')
+        by_cursor = json.loads(self.client().get('/questions?cursor=' + first['next_cursor']).data)
+        by_page = json.loads(self.client().get('/questions?page=2').data)
+
+        self.assertEqual(by_cursor['questions'], by_page['questions'])
+
+    def test_404_requesting_beyond_valid_page(self):
+        res = self.client().get('/questions?page=1000')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'resource not found')
+
+    def test_400_invalid_cursor(self):
+        res = self.client().get('/questions?cursor=not-a-cursor')
+
+        self.assertEqual(res.status_code, 400)
+
+    def test_400_crafted_cursor(self):
+        for after in ('"x"', '[1]', 'true', 'null'):
+            cursor = base64.urlsafe_b64encode(('{"after": ' + after + '}').encode()).decode()
+            res = self.client().get('/questions?cursor=' + cursor)
+
+            self.assertEqual(res.status_code, 400)
+
+    def test_search_questions(self):
+        res = self.client().post('/questions', json={'searchTerm': 'title'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(data['total_questions'])
+        for question in data['questions']:
+            self.assertIn('title', question['question'].lower())
+
+    def test_search_finds_created_question(self):
+        res = self.client().post('/questions', json={
+            'question': 'Which zyzzyva question was just created?',
+            'answer': 'This one',
+            'category': '1',
+            'difficulty': 1
+        })
+        created = json.loads(res.data)['created']
+        data = json.loads(self.client().post('/questions', json={'searchTerm': 'ZYZZYVA'}).data)
+        with self.app.app_context():
+            Question.query.get(created).delete()
+        after_delete = json.loads(self.client().post('/questions', json={'searchTerm': 'zyzzyva'}).data)
+
+        self.assertEqual([q['id'] for q in data['questions']], [created])
+        self.assertEqual(after_delete['total_questions'], 0)
+
+    def test_422_create_question_missing_fields(self):
+        res = self.client().post('/questions', json={'question': 'Incomplete?'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+
+    def test_play_quiz_never_repeats_questions(self):
+        previous_questions = []
+        while True:
+            res = self.client().post('/quizzes', json={
+                'previous_questions': previous_questions,
+                'quiz_category': {'type': 'Science', 'id': 1}
+            })
+            data = json.loads(res.data)
+            self.assertEqual(res.status_code, 200)
+            if data['question'] is None:
+                break
+            self.assertEqual(str(data['question']['category']), '1')
+            self.assertNotIn(data['question']['id'], previous_questions)
+            previous_questions.append(data['question']['id'])
+
+        with self.app.app_context():
+            self.assertEqual(len(previous_questions), Question.query.filter(Question.category == '1').count())
+
+    def test_play_quiz_session_mode(self):
+        res = self.client().post('/quizzes', json={
+            'quiz_category': {'type': 'Science', 'id': 1},
+            'use_session': True
+        })
+        data = json.loads(res.data)
+        session_id = data['quiz_session']
+        served = []
+        while data['question'] is not None:
+            self.assertNotIn(data['question']['id'], served)
+            served.append(data['question']['id'])
+            data = json.loads(self.client().post('/quizzes', json={'quiz_session': session_id}).data)
+
+        with self.app.app_context():
+            self.assertEqual(len(served), Question.query.filter(Question.category == '1').count())
+
+    def test_404_play_quiz_unknown_session(self):
+        res = self.client().post('/quizzes', json={'quiz_session': 'unknown'})
+
+        self.assertEqual(res.status_code, 404)
+
+    def test_400_play_quiz_without_body(self):
+        res = self.client().post('/quizzes')
+
+        self.assertEqual(res.status_code, 400)
+
+    def test_bulk_insert_and_delete_questions(self):
+        with self.app.app_context():
+            before = Question.query.count()
+            Question.bulk_insert([{
+                'question': 'Bulk question {}'.format(i),
+                'answer': 'Bulk answer',
+                'category': '1',
+                'difficulty': 1
+            } for i in range(20)])
+            ids = [q.id for q in Question.query.filter(Question.question.like('Bulk question %'))]
+
+            self.assertEqual(Question.query.count(), before + 20)
+            self.assertEqual(Question.bulk_delete(ids), 20)
+            self.assertEqual(Question.query.count(), before)
+
+
+class IdPoolTestCase(unittest.TestCase):
+    """The in-memory quiz pools, no database needed"""
+
+    def setUp(self):
+        self.pool = IdPool()
+        for id in range(10):
+            self.pool.add(id)
+
+    def test_sample_ignores_excluded_ids_outside_the_pool(self):
+        class DrawsOnly(random.Random):
+            def choice(self, ids):
+                raise AssertionError('the remaining ids were listed')
+
+        # other categories' ids and bogus ids keep the draws constant time
+        exclude = set(range(1000, 2000)) | {0}
+        rng = DrawsOnly(1)
+        for _ in range(100):
+            self.assertIn(self.pool.sample(exclude, rng), range(1, 10))
+
+    def test_sample_lists_the_last_ids(self):
+        self.assertEqual(self.pool.sample(set(range(9)) | {'bogus'}), 9)
+        self.assertIsNone(self.pool.sample(set(range(10))))
+
+
+class KeysetPaginatorTestCase(unittest.TestCase):
+    """Keyset pages over an in-memory sqlite table"""
+
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        self.table = Table('rows', MetaData(), Column('id', Integer, primary_key=True))
+        self.table.create(engine)
+        self.session = Session(engine)
+        self.session.execute(self.table.insert(), [{'id': id} for id in range(1, 31)])
+        self.paginator = KeysetPaginator(lambda: self.session.query(self.table), self.table.c.id, 10)
+
+    def tearDown(self):
+        self.session.close()
+
+    def walk(self):
+        pages, cursor = [], None
+        while True:
+            rows = self.paginator.page(1) if cursor is None else self.paginator.after(cursor)
+            pages.append([row.id for row in rows])
+            cursor = self.paginator.next_cursor(rows)
+            if cursor is None:
+                return pages
+
+    def test_exactly_full_last_page_has_no_cursor(self):
+        self.assertEqual(self.walk(), [list(range(1, 11)), list(range(11, 21)), list(range(21, 31))])
+        self.assertIsNone(self.paginator.next_cursor(self.paginator.page(3)))
+        self.assertEqual(self.paginator.page(4), [])
+
+    def test_short_last_page(self):
+        self.session.execute(self.table.delete().where(self.table.c.id > 25))
+        self.assertEqual([len(page) for page in self.walk()], [10, 10, 5])
+        self.assertIsNotNone(self.paginator.next_cursor(self.paginator.page(2)))
+
 
 # Make the tests conveniently executable
 if __name__ == "__main__":
@@ -0,0 +1,72 @@
+'''
+bench_menu.py
+    compares menu listing latency of the legacy json recipe column against
+    the ingredient table, on a throwaway in-memory sqlite database
+    'menu cache' is what GET /drinks actually pays once the menu is built
+
+    python bench_menu.py [drinks] [ingredients_per_drink]
+'''
+import json
+import sys
+import timeit
+
+from flask import Flask
+from sqlalchemy import text
+
+from src.database.models import setup_db, db, Drink, menu_cache
+
+
+def seed(drink_count, ingredient_count):
+    db.session.execute(text(
+        'CREATE TABLE drink_legacy (id INTEGER PRIMARY KEY, title VARCHAR(80), recipe TEXT NOT NULL)'
+    ))
+    legacy = []
+    drinks = []
+    for i in range(drink_count):
+        recipe = [
+            {'name': 'ingredient {}'.format(j), 'color': 'color {}'.format(j), 'parts': j + 1}
+            for j in range(ingredient_count)
+        ]
+        legacy.append({'id': i + 1, 'title': 'drink {}'.format(i), 'recipe': json.dumps(recipe)})
+        drinks.append(Drink(title='drink {}'.format(i), recipe=recipe))
+    db.session.execute(text('INSERT INTO drink_legacy (id, title, recipe) VALUES (:id, :title, :recipe)'), legacy)
+    db.session.add_all(drinks)
+    db.session.commit()
+
+
+def legacy_menu(representation):
+    rows = db.session.execute(text('SELECT id, title, recipe FROM drink_legacy ORDER BY id')).fetchall()
+    if representation == 'short':
+        return [{
+            'id': row.id,
+            'title': row.title,
+            'recipe': [{'color': r['color'], 'parts': r['parts']} for r in json.loads(row.recipe)]
+        } for row in rows]
+    return [{'id': row.id, 'title': row.title, 'recipe': json.loads(row.recipe)} for row in rows]
+
+
+def ingredient_menu(representation):
+    return Drink.menu(representation)
+
+
+def cached_menu(representation):
+    return menu_cache.get(representation)
+
+
+def main(drink_count=500, ingredient_count=5, number=20):
+    app = Flask(__name__)
+    setup_db(app, 'sqlite://')
+    with app.app_context():
+        db.create_all()
+        seed(drink_count, ingredient_count)
+        print('{} drinks x {} ingredients, best of 3 x {} runs'.format(drink_count, ingredient_count, number))
+        for representation in ('short', 'long'):
+            assert legacy_menu(representation) == ingredient_menu(representation)
+            for name, menu in (('legacy json', legacy_menu), ('ingredients', ingredient_menu),
+                               ('menu cache', cached_menu)):
+                best = min(timeit.repeat(lambda: menu(representation), number=number, repeat=3))
+                print('  {:5} {:12} {:8.3f} ms'.format(representation, name, best / number * 1000))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -2,12 +2,31 @@ import json
 from flask import request, _request_ctx_stack
 from functools import wraps
 from jose import jwt
-from urllib.request import urlopen
+
+from .jwks import JWKSCache, JWKSUnavailable
+from .token_cache import TokenCache
 
 
 AUTH0_DOMAIN = 'udacity-fsnd.auth0.com'
 ALGORITHMS = ['RS256']
 API_AUDIENCE = 'dev'
+# seconds a fetched key set is trusted before it is downloaded again
+JWKS_CACHE_TTL = 600
+# minimum seconds between key set fetches, failed ones included
+JWKS_MIN_REFRESH_INTERVAL = 30
+# seconds a key set fetch may take before it is given up
+JWKS_FETCH_TIMEOUT = 5
+
+jwks_cache = JWKSCache(
+    f'https://{AUTH0_DOMAIN}/.well-known/jwks.json',
+    ttl=JWKS_CACHE_TTL,
+    min_refresh_interval=JWKS_MIN_REFRESH_INTERVAL,
+    timeout=JWKS_FETCH_TIMEOUT
+)
+# number of verified tokens kept so repeat requests skip the RS256 check
+TOKEN_CACHE_SIZE = 1024
+
+token_cache = TokenCache(maxsize=TOKEN_CACHE_SIZE)
 
 ## AuthError Exception
 '''
@@ -20,10 +39,28 @@ class AuthError(Exception):
         self.status_code = status_code
 
 
+## Claims
+'''
+Claims
+a decoded jwt payload that also carries its permissions claim as a frozenset
+    the set is built once per token and is cached along with the payload
+    in token_cache, so permission checks are set lookups instead of list scans
+    permission_set is None when the token has no permissions claim
+'''
+class Claims(dict):
+    def __init__(self, payload):
+        super().__init__(payload)
+        permissions = payload.get('permissions')
+        if isinstance(permissions, (list, tuple)):
+            self.permission_set = frozenset(permissions)
+        else:
+            self.permission_set = None
+
+
 ## Auth Header
 
 '''
-@TODO implement get_token_auth_header() method
+get_token_auth_header() method
     it should attempt to get the header from the request
         it should raise an AuthError if no header is present
     it should attempt to split bearer and the token
@@ -31,10 +68,36 @@ class AuthError(Exception):
     return the token part of the header
 '''
 def get_token_auth_header():
-   raise Exception('Not Implemented')
+    auth = request.headers.get('Authorization', None)
+    if not auth:
+        raise AuthError({
+            'code': 'authorization_header_missing',
+            'description': 'Authorization header is expected.'
+        }, 401)
+
+    parts = auth.split()
+    if parts[0].lower() != 'bearer':
+        raise AuthError({
+            'code': 'invalid_header',
+            'description': 'Authorization header must start with "Bearer".'
+        }, 401)
+
+    elif len(parts) == 1:
+        raise AuthError({
+            'code': 'invalid_header',
+            'description': 'Token not found.'
+        }, 401)
+
+    elif len(parts) > 2:
+        raise AuthError({
+            'code': 'invalid_header',
+            'description': 'Authorization header must be bearer token.'
+        }, 401)
+
+    return parts[1]
 
 '''
-@TODO implement check_permissions(permission, payload) method
+check_permissions(permission, payload) method
     @INPUTS
         permission: string permission (i.e. 'post:drink')
         payload: decoded jwt payload
@@ -45,42 +108,140 @@ def get_token_auth_header():
     return true otherwise
 '''
 def check_permissions(permission, payload):
-    raise Exception('Not Implemented')
+    return check_permission_sets(payload, all_of=[permission] if permission else ())
 
 '''
-@TODO implement verify_decode_jwt(token) method
+check_permission_sets(payload, all_of, any_of) method
+    @INPUTS
+        payload: decoded jwt payload
+        all_of: permissions that must all be granted
+        any_of: permissions of which at least one must be granted
+
+    same failure modes as check_permissions, evaluated as a single check
+    against the precompiled permission set of the payload
+    return true otherwise
+'''
+def check_permission_sets(payload, all_of=(), any_of=()):
+    granted = getattr(payload, 'permission_set', None)
+    if granted is None:
+        permissions = payload.get('permissions')
+        if not isinstance(permissions, (list, tuple)):
+            raise AuthError({
+                'code': 'invalid_claims',
+                'description': 'Permissions not included in JWT.'
+            }, 400)
+        granted = frozenset(permissions)
+
+    if not granted.issuperset(all_of) or (any_of and granted.isdisjoint(any_of)):
+        raise AuthError({
+            'code': 'unauthorized',
+            'description': 'Permission not found.'
+        }, 403)
+    return True
+
+'''
+verify_decode_jwt(token) method
     @INPUTS
         token: a json web token (string)
 
     it should be an Auth0 token with key id (kid)
     it should verify the token using Auth0 /.well-known/jwks.json
+        the key set is served from jwks_cache, so the jwks url is only
+        fetched when the cached keys expire or an unknown kid shows up
+    it should skip verification for tokens already in token_cache
     it should decode the payload from the token
     it should validate the claims
-    return the decoded payload
+    return the decoded payload as Claims
 
     !!NOTE urlopen has a common certificate error described here: https://stackoverflow.com/questions/50236117/scraping-ssl-certificate-verify-failed-error-for-http-en-wikipedia-org
 '''
 def verify_decode_jwt(token):
-    raise Exception('Not Implemented')
+    payload = token_cache.get(token)
+    if payload is not None:
+        return payload
+
+    try:
+        unverified_header = jwt.get_unverified_header(token)
+    except jwt.JWTError:
+        raise AuthError({
+            'code': 'invalid_header',
+            'description': 'Unable to parse authentication token.'
+        }, 401)
+    if 'kid' not in unverified_header:
+        raise AuthError({
+            'code': 'invalid_header',
+            'description': 'Authorization malformed.'
+        }, 401)
+
+    try:
+        rsa_key = jwks_cache.get_key(unverified_header['kid'])
+    except JWKSUnavailable:
+        raise AuthError({
+            'code': 'jwks_unavailable',
+            'description': 'Unable to fetch the signing keys, please try again later.'
+        }, 503)
+    if not rsa_key:
+        raise AuthError({
+            'code': 'invalid_header',
+            'description': 'Unable to find the appropriate key.'
+        }, 400)
+
+    try:
+        payload = Claims(jwt.decode(
+            token,
+            rsa_key,
+            algorithms=ALGORITHMS,
+            audience=API_AUDIENCE,
+            issuer='https://' + AUTH0_DOMAIN + '/'
+        ))
+
+    except jwt.ExpiredSignatureError:
+        raise AuthError({
+            'code': 'token_expired',
+            'description': 'Token expired.'
+        }, 401)
+
+    except jwt.JWTClaimsError:
+        raise AuthError({
+            'code': 'invalid_claims',
+            'description': 'Incorrect claims. Please, check the audience and issuer.'
+        }, 401)
+
+    except Exception:
+        raise AuthError({
+            'code': 'invalid_header',
+            'description': 'Unable to parse authentication token.'
+        }, 400)
+
+    token_cache.set(token, payload)
+    return payload
 
 '''
-@TODO implement @requires_auth(permission) decorator method
+@requires_auth(permission, any_of, all_of) decorator method
     @INPUTS
         permission: string permission (i.e. 'post:drink')
+        any_of: optional list of permissions, at least one is required
+        all_of: optional list of permissions, all of them are required
 
     it should use the get_token_auth_header method to get the token
     it should use the verify_decode_jwt method to decode the jwt
-    it should use the check_permissions method validate claims and check the requested permission
+    it should use the check_permission_sets method validate claims and check the requested permissions
+        the required sets are built once when the route is decorated
     return the decorator which passes the decoded payload to the decorated method
 '''
-def requires_auth(permission=''):
+def requires_auth(permission='', any_of=None, all_of=None):
+    required_all = frozenset(all_of or ())
+    if permission:
+        required_all |= {permission}
+    required_any = frozenset(any_of or ())
+
     def requires_auth_decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
             token = get_token_auth_header()
             payload = verify_decode_jwt(token)
-            check_permissions(permission, payload)
+            check_permission_sets(payload, all_of=required_all, any_of=required_any)
             return f(payload, *args, **kwargs)
 
         return wrapper
-    return requires_auth_decorator
\ No newline at end of file
+    return requires_auth_decorator
@@ -0,0 +1,120 @@
+import json
+import threading
+import time
+from urllib.request import urlopen
+
+
+'''
+JWKSUnavailable
+raised when no key set could be fetched yet, the issuer is unreachable
+'''
+
+
+class JWKSUnavailable(Exception):
+    pass
+
+
+'''
+JWKSCache
+a process-wide store of the signing keys published at a JWKS url
+
+    keys are parsed once per fetch and indexed by their key id (kid)
+    the whole key set is refetched when it is older than ttl seconds
+    an unknown kid triggers a refetch (the issuer may have rotated keys)
+    fetches are made at most once every min_refresh_interval seconds,
+        failed ones included, so tokens carrying forged kids or an issuer
+        that is down cannot cause a fetch per request
+    if a refetch fails the previously fetched keys keep being served,
+        with no keys at all get_key raises JWKSUnavailable
+    a fetch gives up after timeout seconds
+
+    jwks_url may be any url understood by urlopen, so a local
+    file:///path/to/jwks.json or a stand-in http server works for testing
+'''
+
+
+class JWKSCache:
+    def __init__(self, jwks_url, ttl=600, min_refresh_interval=30,
+                 timeout=5, clock=time.monotonic):
+        self.jwks_url = jwks_url
+        self.timeout = timeout
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.clock = clock
+        self._keys = {}
+        self._fetched_at = None
+        self._attempted_at = None
+        self._lock = threading.Lock()
+
+    '''
+    get_key(kid)
+        returns the rsa key dict for kid, or None if the issuer does not
+        publish a key with that id
+        raises JWKSUnavailable when no key set could be fetched
+    '''
+
+    def get_key(self, kid):
+        now = self.clock()
+        if self._is_expired(now) or kid not in self._keys:
+            self._refresh(now)
+        return self._keys.get(kid)
+
+    '''
+    clear()
+        drops every cached key, the next lookup fetches the key set again
+    '''
+
+    def clear(self):
+        with self._lock:
+            self._keys = {}
+            self._fetched_at = None
+            self._attempted_at = None
+
+    def _is_expired(self, now):
+        return self._fetched_at is None or now - self._fetched_at >= self.ttl
+
+    def _refresh(self, now):
+        # while one thread fetches, the others keep serving the keys they
+        # have, they only wait on the lock when there are none yet
+        if not self._lock.acquire(blocking=not self._keys):
+            return
+        try:
+            # a fetch made or attempted moments ago, successful or not
+            # (another thread may have refreshed while we waited on the lock)
+            if self._attempted_at is not None and \
+                    now - self._attempted_at < self.min_refresh_interval:
+                if not self._keys:
+                    raise JWKSUnavailable(self.jwks_url)
+                return
+            self._attempted_at = now
+            try:
+                keys = self.fetch()
+            except Exception as error:
+                if not self._keys:
+                    raise JWKSUnavailable(self.jwks_url) from error
+                return
+            self._keys = keys
+            self._fetched_at = now
+        finally:
+            self._lock.release()
+
+    '''
+    fetch()
+        downloads and parses the key set, returning {kid: rsa_key}
+    '''
+
+    def fetch(self):
+        with urlopen(self.jwks_url, timeout=self.timeout) as jsonurl:
+            jwks = json.loads(jsonurl.read())
+        keys = {}
+        for key in jwks['keys']:
+            if 'kid' not in key:
+                continue
+            keys[key['kid']] = {
+                'kty': key['kty'],
+                'kid': key['kid'],
+                'use': key.get('use'),
+                'n': key['n'],
+                'e': key['e']
+            }
+        return keys
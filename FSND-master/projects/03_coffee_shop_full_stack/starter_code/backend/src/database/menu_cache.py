@@ -0,0 +1,49 @@
+import hashlib
+import json
+import threading
+
+
+'''
+MenuCache
+keeps the drink menu as ready to send json response bytes
+
+    one entry is kept per drink representation ('short' or 'long'), built
+    on first use by calling load(representation) for the list of drink dicts
+    invalidate() drops every entry, Drink.insert/update/delete call it after
+    each commit. a version counter makes sure a menu that was being built
+    while an invalidation happened is not stored
+'''
+
+
+class MenuCache:
+    def __init__(self, load):
+        self.load = load
+        self.version = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    '''
+    get(representation)
+        returns (body, etag) for the menu in the given representation
+    '''
+
+    def get(self, representation):
+        entry = self._entries.get(representation)
+        if entry is not None:
+            return entry
+
+        version = self.version
+        body = json.dumps({
+            'success': True,
+            'drinks': self.load(representation)
+        }).encode('utf-8')
+        entry = (body, hashlib.sha1(body).hexdigest())
+        with self._lock:
+            if version == self.version:
+                self._entries[representation] = entry
+        return entry
+
+    def invalidate(self):
+        with self._lock:
+            self.version += 1
+            self._entries = {}
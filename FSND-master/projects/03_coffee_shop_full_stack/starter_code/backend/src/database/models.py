@@ -1,8 +1,11 @@
 import os
-from sqlalchemy import Column, String, Integer
+from contextlib import contextmanager
+from sqlalchemy import Column, String, Integer, ForeignKey, inspect, text
 from flask_sqlalchemy import SQLAlchemy
 import json
 
+from .menu_cache import MenuCache
+
 database_filename = "database.db"
 project_dir = os.path.dirname(os.path.abspath(__file__))
 database_path = "sqlite:///{}".format(os.path.join(project_dir, database_filename))
@@ -15,13 +18,67 @@ setup_db(app)
 '''
 
 
-def setup_db(app):
+def setup_db(app, database_path=database_path):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
     db.app = app
     db.init_app(app)
 
 
+'''
+unit_of_work()
+    groups model writes into a single transaction
+    insert/update/delete called inside the block only flush,
+    the outermost block commits once and rolls everything back on error
+    EXAMPLE
+        with unit_of_work():
+            for drink in drinks:
+                drink.insert()
+'''
+
+
+@contextmanager
+def unit_of_work():
+    info = db.session.info
+    depth = info.get('unit_of_work', 0)
+    if depth == 0:
+        info['after_commit'] = []
+    info['unit_of_work'] = depth + 1
+    try:
+        yield db.session
+        if depth == 0:
+            db.session.commit()
+            for callback in info['after_commit']:
+                callback()
+    except Exception:
+        if depth == 0:
+            db.session.rollback()
+        raise
+    finally:
+        info['unit_of_work'] = depth
+        if depth == 0:
+            info['after_commit'] = []
+
+
+'''
+commit_session(after_commit)
+    commits the session, or only flushes it inside a unit_of_work
+    after_commit is called once the data is actually committed
+'''
+
+
+def commit_session(after_commit=None):
+    info = db.session.info
+    if info.get('unit_of_work'):
+        db.session.flush()
+        if after_commit is not None and after_commit not in info['after_commit']:
+            info['after_commit'].append(after_commit)
+        return
+    db.session.commit()
+    if after_commit is not None:
+        after_commit()
+
+
 '''
 db_drop_and_create_all()
     drops the database tables and starts fresh
@@ -39,10 +96,85 @@ def db_drop_and_create_all():
         recipe='[{"name": "water", "color": "blue", "parts": 1}]'
     )
 
+    drink.insert()
+
+
+'''
+migrate_legacy_recipes()
+    upgrades a database created before the ingredient table existed
+    the json recipe blob of every drink is moved into ingredient rows and
+    the drink table is rebuilt without its recipe column, in one transaction
+    does nothing but create missing tables on an already migrated or a new
+    (empty) database
+    returns the number of drinks migrated
+'''
+
+
+def migrate_legacy_recipes():
+    inspector = inspect(db.engine)
+    if 'drink' not in inspector.get_table_names() or \
+            'recipe' not in [column['name'] for column in inspector.get_columns('drink')]:
+        db.create_all()
+        return 0
+
+    with db.engine.begin() as connection:
+        legacy_drinks = connection.execute(text('SELECT id, title, recipe FROM drink')).fetchall()
+        connection.execute(text('ALTER TABLE drink RENAME TO drink_legacy'))
+        db.metadata.create_all(bind=connection, tables=[Drink.__table__, Ingredient.__table__])
+
+        drinks = []
+        ingredients = []
+        for drink_id, title, recipe in legacy_drinks:
+            drinks.append({'id': drink_id, 'title': title})
+            for position, ingredient in enumerate(normalize_recipe(recipe)):
+                ingredients.append(dict(ingredient, drink_id=drink_id, position=position))
+        if drinks:
+            connection.execute(Drink.__table__.insert(), drinks)
+        if ingredients:
+            connection.execute(Ingredient.__table__.insert(), ingredients)
+        connection.execute(text('DROP TABLE drink_legacy'))
+    return len(legacy_drinks)
+
+
+'''
+normalize_recipe(recipe)
+    accepts a recipe as a json string, a single ingredient dict or a list
+    returns a list of {'name', 'color', 'parts'} dicts
+'''
+
+
+def normalize_recipe(recipe):
+    if isinstance(recipe, str):
+        recipe = json.loads(recipe)
+    if isinstance(recipe, dict):
+        recipe = [recipe]
+    return [{'name': r['name'], 'color': r['color'], 'parts': r['parts']} for r in recipe]
 
-drink.insert()
 # ROUTES
 
+'''
+Ingredient
+one part of a drink recipe, stored as its own row so recipes are not
+parsed at read time and can be queried by ingredient name
+'''
+
+
+class Ingredient(db.Model):
+    id = Column(Integer, primary_key=True)
+    drink_id = Column(Integer, ForeignKey('drink.id', ondelete='CASCADE'), nullable=False, index=True)
+    # order of the ingredient within the recipe
+    position = Column(Integer, nullable=False)
+    name = Column(String(80), nullable=False, index=True)
+    color = Column(String(80), nullable=False)
+    parts = Column(Integer, nullable=False)
+
+    def short(self):
+        return {'color': self.color, 'parts': self.parts}
+
+    def long(self):
+        return {'name': self.name, 'color': self.color, 'parts': self.parts}
+
+
 '''
 Drink
 a persistent drink entity, extends the base SQLAlchemy Model
@@ -54,9 +186,27 @@ class Drink(db.Model):
     id = Column(Integer().with_variant(Integer, "sqlite"), primary_key=True)
     # String Title
     title = Column(String(80), unique=True)
-    # the ingredients blob - this stores a lazy json blob
-    # the required datatype is [{'color': string, 'name':string, 'parts':number}]
-    recipe = Column(String(180), nullable=False)
+    # the recipe, one Ingredient row per part, loaded for all listed drinks in one query
+    ingredients = db.relationship('Ingredient', order_by=Ingredient.position, lazy='selectin',
+                                  cascade='all, delete-orphan')
+
+    '''
+    recipe
+        the recipe as [{'color': string, 'name':string, 'parts':number}]
+        can be assigned a list, a single ingredient dict or a json string,
+        which replaces the drink's ingredients
+    '''
+
+    @property
+    def recipe(self):
+        return [ingredient.long() for ingredient in self.ingredients]
+
+    @recipe.setter
+    def recipe(self, recipe):
+        self.ingredients = [
+            Ingredient(position=position, **ingredient)
+            for position, ingredient in enumerate(normalize_recipe(recipe))
+        ]
 
     '''
     short()
@@ -64,12 +214,10 @@ class Drink(db.Model):
     '''
 
     def short(self):
-        print(json.loads(self.recipe))
-        short_recipe = [{'color': r['color'], 'parts': r['parts']} for r in json.loads(self.recipe)]
         return {
             'id': self.id,
             'title': self.title,
-            'recipe': short_recipe
+            'recipe': [ingredient.short() for ingredient in self.ingredients]
         }
 
     '''
@@ -81,7 +229,7 @@ class Drink(db.Model):
         return {
             'id': self.id,
             'title': self.title,
-            'recipe': json.loads(self.recipe)
+            'recipe': self.recipe
         }
 
     '''
@@ -96,7 +244,7 @@ class Drink(db.Model):
 
     def insert(self):
         db.session.add(self)
-        db.session.commit()
+        commit_session(menu_cache.invalidate)
 
     '''
     delete()
@@ -109,7 +257,7 @@ class Drink(db.Model):
 
     def delete(self):
         db.session.delete(self)
-        db.session.commit()
+        commit_session(menu_cache.invalidate)
 
     '''
     update()
@@ -122,7 +270,86 @@ class Drink(db.Model):
     '''
 
     def update(self):
-        db.session.commit()
+        commit_session(menu_cache.invalidate)
+
+    '''
+    bulk_insert(drinks)
+        inserts many drinks in a single transaction
+        drinks is a list of {'title': string, 'recipe': recipe} dicts
+        every ingredient row is written with one executemany
+        returns the ids of the new drinks, in order
+        EXAMPLE
+            Drink.bulk_insert([{'title': 'Latte', 'recipe': latte_recipe}, ...])
+    '''
+
+    @classmethod
+    def bulk_insert(cls, drinks):
+        drinks = [{'title': drink['title'], 'recipe': normalize_recipe(drink['recipe'])} for drink in drinks]
+        rows = [{'title': drink['title']} for drink in drinks]
+        with unit_of_work():
+            # return_defaults fills in the generated id of every row
+            db.session.bulk_insert_mappings(cls, rows, return_defaults=True)
+            db.session.bulk_insert_mappings(Ingredient, [
+                dict(ingredient, drink_id=row['id'], position=position)
+                for row, drink in zip(rows, drinks)
+                for position, ingredient in enumerate(drink['recipe'])
+            ])
+            commit_session(menu_cache.invalidate)
+        return [row['id'] for row in rows]
+
+    '''
+    bulk_delete(ids)
+        deletes the drinks with the given ids and their ingredients
+        in a single transaction, without loading them into the session
+        returns the number of drinks deleted
+    '''
+
+    @classmethod
+    def bulk_delete(cls, ids):
+        ids = list(ids)
+        with unit_of_work():
+            Ingredient.query.filter(Ingredient.drink_id.in_(ids)).delete(synchronize_session=False)
+            deleted = cls.query.filter(cls.id.in_(ids)).delete(synchronize_session=False)
+            commit_session(menu_cache.invalidate)
+        return deleted
+
+    '''
+    menu(representation)
+        the short() or long() form of every drink, ordered by id
+        built from one drink/ingredient join that selects plain columns, so
+        listing the menu neither parses json nor loads model instances
+    '''
+
+    @classmethod
+    def menu(cls, representation='short'):
+        keys = ('color', 'parts')
+        columns = [Ingredient.color, Ingredient.parts]
+        if representation == 'long':
+            keys = ('name',) + keys
+            columns.insert(0, Ingredient.name)
+        rows = db.session.query(cls.id, cls.title, *columns) \
+            .outerjoin(Ingredient) \
+            .order_by(cls.id, Ingredient.position)
+
+        menu = []
+        drink = None
+        for row in rows:
+            if drink is None or drink['id'] != row[0]:
+                drink = {'id': row[0], 'title': row[1], 'recipe': []}
+                menu.append(drink)
+            if row[-1] is not None:
+                drink['recipe'].append(dict(zip(keys, row[2:])))
+        return menu
 
     def __repr__(self):
         return json.dumps(self.short())
+
+
+'''
+menu_cache
+    the serialized GET /drinks and /drinks-detail responses
+    menu_cache.get('short') and menu_cache.get('long') return (body, etag)
+'''
+
+
+menu_cache = MenuCache(Drink.menu)
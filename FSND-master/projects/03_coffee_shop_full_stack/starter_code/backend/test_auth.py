@@ -0,0 +1,287 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from http.server import HTTPServer, SimpleHTTPRequestHandler
+from functools import partial
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from flask import Flask
+from jose import jwk, jwt
+
+from src.auth import auth
+from src.auth.jwks import JWKSCache, JWKSUnavailable
+from src.auth.token_cache import TokenCache
+
+
+def generate_key(kid):
+    """An RS256 private key in PEM and its public JWK with the given kid"""
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption()).decode('ascii')
+    public = jwk.construct(pem, 'RS256').public_key().to_dict()
+    public.update({'kid': kid, 'use': 'sig'})
+    return pem, public
+
+
+class Clock:
+    """A clock that only moves when told to"""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class JWKSCacheTestCase(unittest.TestCase):
+    """JWKSCache against a key set in a local file"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'jwks.json')
+        self.url = 'file://' + self.path
+        self.clock = Clock()
+        self.fetches = 0
+        self.cache = self.make_cache(self.url)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def make_cache(self, url):
+        cache = JWKSCache(url, ttl=600, min_refresh_interval=30, clock=self.clock)
+        fetch = cache.fetch
+
+        def counting_fetch():
+            self.fetches += 1
+            return fetch()
+        cache.fetch = counting_fetch
+        return cache
+
+    def publish(self, *kids):
+        with open(self.path, 'w') as file:
+            json.dump({'keys': [generate_key(kid)[1] for kid in kids]}, file)
+
+    def test_keys_are_fetched_once_until_the_ttl(self):
+        self.publish('a')
+        key = self.cache.get_key('a')
+        self.assertEqual((key['kid'], key['kty']), ('a', 'RSA'))
+        self.clock.now += 599
+        self.cache.get_key('a')
+        self.assertEqual(self.fetches, 1)
+
+        # rotated, seen once the key set expires
+        self.publish('b')
+        self.clock.now += 1
+        self.assertIsNone(self.cache.get_key('a'))
+        self.assertEqual(self.cache.get_key('b')['kid'], 'b')
+        self.assertEqual(self.fetches, 2)
+
+    def test_unknown_kid_refetches_at_most_once_per_interval(self):
+        self.publish('a')
+        self.cache.get_key('a')
+        self.publish('a', 'b')
+
+        # the first unknown kid refetches early and finds the new key
+        self.clock.now += 30
+        self.assertEqual(self.cache.get_key('b')['kid'], 'b')
+        self.assertEqual(self.fetches, 2)
+
+        # forged kids do not cause a fetch per request
+        for kid in range(100):
+            self.assertIsNone(self.cache.get_key('forged-{}'.format(kid)))
+            self.clock.now += 0.1
+        self.assertEqual(self.fetches, 2)
+        self.clock.now += 30
+        self.cache.get_key('forged')
+        self.assertEqual(self.fetches, 3)
+
+    def test_unavailable_key_set(self):
+        # nothing fetched yet, every lookup raises, fetching once per interval
+        with self.assertRaises(JWKSUnavailable):
+            self.cache.get_key('a')
+        with self.assertRaises(JWKSUnavailable):
+            self.cache.get_key('a')
+        self.assertEqual(self.fetches, 1)
+
+        self.clock.now += 30
+        self.publish('a')
+        self.assertEqual(self.cache.get_key('a')['kid'], 'a')
+
+        # once keys were fetched, a failed refetch keeps serving them
+        os.remove(self.path)
+        self.clock.now += 600
+        self.assertEqual(self.cache.get_key('a')['kid'], 'a')
+        self.assertEqual(self.fetches, 3)
+
+    def test_keys_served_over_http(self):
+        self.publish('a')
+        handler = partial(SimpleHTTPRequestHandler, directory=self.directory)
+        handler.log_message = lambda *args: None
+        server = HTTPServer(('127.0.0.1', 0), handler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            cache = self.make_cache('http://127.0.0.1:{}/jwks.json'.format(server.server_port))
+            self.assertEqual(cache.get_key('a')['kid'], 'a')
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+class VerifyDecodeJWTTestCase(unittest.TestCase):
+    """verify_decode_jwt with its keys read from a local file"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        path = os.path.join(self.directory, 'jwks.json')
+        self.pem, public = generate_key('a')
+        with open(path, 'w') as file:
+            json.dump({'keys': [public]}, file)
+        self.jwks_cache = auth.jwks_cache
+        auth.jwks_cache = JWKSCache('file://' + path)
+        auth.token_cache.clear()
+
+    def tearDown(self):
+        auth.jwks_cache = self.jwks_cache
+        auth.token_cache.clear()
+        shutil.rmtree(self.directory)
+
+    def token(self, kid='a', **claims):
+        payload = {
+            'iss': 'https://' + auth.AUTH0_DOMAIN + '/',
+            'aud': auth.API_AUDIENCE,
+            'exp': int(time.time()) + 3600,
+            'permissions': ['get:drinks-detail'],
+        }
+        payload.update(claims)
+        return jwt.encode(payload, self.pem, algorithm='RS256', headers={'kid': kid})
+
+    def test_valid_token(self):
+        payload = auth.verify_decode_jwt(self.token())
+        self.assertEqual(payload['permissions'], ['get:drinks-detail'])
+        self.assertEqual(payload.permission_set, frozenset(['get:drinks-detail']))
+
+    def test_unknown_key_and_bad_claims(self):
+        with self.assertRaises(auth.AuthError) as error:
+            auth.verify_decode_jwt(self.token(kid='b'))
+        self.assertEqual(error.exception.status_code, 400)
+        with self.assertRaises(auth.AuthError) as error:
+            auth.verify_decode_jwt(self.token(aud='other'))
+        self.assertEqual(error.exception.error['code'], 'invalid_claims')
+        with self.assertRaises(auth.AuthError) as error:
+            auth.verify_decode_jwt(self.token(exp=int(time.time()) - 10))
+        self.assertEqual(error.exception.error['code'], 'token_expired')
+
+    def test_verified_token_is_served_from_the_cache(self):
+        token = self.token()
+        payload = auth.verify_decode_jwt(token)
+        # the key set is not needed again until the token expires
+        auth.jwks_cache = JWKSCache('file://' + os.path.join(self.directory, 'missing.json'))
+        self.assertIs(auth.verify_decode_jwt(token), payload)
+        with self.assertRaises(auth.AuthError):
+            auth.verify_decode_jwt(self.token(sub='other'))
+
+    def test_requires_auth_checks_the_required_permissions(self):
+        app = Flask(__name__)
+        view = auth.requires_auth('get:drinks-detail', any_of=['post:drinks', 'patch:drinks'])(
+            lambda payload: payload['sub'])
+
+        def call(permissions):
+            token = self.token(sub='barista', permissions=permissions)
+            with app.test_request_context(headers={'Authorization': 'Bearer ' + token}):
+                return view()
+
+        self.assertEqual(call(['get:drinks-detail', 'patch:drinks']), 'barista')
+        for permissions in (['get:drinks-detail'], ['post:drinks', 'patch:drinks']):
+            with self.assertRaises(auth.AuthError) as error:
+                call(permissions)
+            self.assertEqual(error.exception.status_code, 403)
+
+    def test_unavailable_key_set_is_a_503(self):
+        auth.jwks_cache = JWKSCache('file://' + os.path.join(self.directory, 'missing.json'))
+        with self.assertRaises(auth.AuthError) as error:
+            auth.verify_decode_jwt(self.token())
+        self.assertEqual(error.exception.status_code, 503)
+        self.assertEqual(error.exception.error['code'], 'jwks_unavailable')
+
+
+class TokenCacheTestCase(unittest.TestCase):
+    """TokenCache expiry and eviction, on a clock that only moves when told to"""
+
+    def setUp(self):
+        self.clock = Clock()
+        self.cache = TokenCache(maxsize=2, clock=self.clock)
+
+    def test_payload_expires_at_exp(self):
+        self.cache.set('token', {'sub': 'a', 'exp': 1010})
+        self.assertEqual(self.cache.get('token'), {'sub': 'a', 'exp': 1010})
+        self.clock.now = 1009.9
+        self.assertIsNotNone(self.cache.get('token'))
+        self.clock.now = 1010
+        self.assertIsNone(self.cache.get('token'))
+        self.assertEqual(self.cache.stats()['size'], 0)
+
+    def test_tokens_without_exp_are_not_cached(self):
+        self.cache.set('token', {'sub': 'a'})
+        self.cache.set('other', {'sub': 'a', 'exp': 'never'})
+        self.assertIsNone(self.cache.get('token'))
+        self.assertIsNone(self.cache.get('other'))
+
+    def test_least_recently_used_is_evicted(self):
+        for token in ('a', 'b'):
+            self.cache.set(token, {'sub': token, 'exp': 2000})
+        self.cache.get('a')
+        self.cache.set('c', {'sub': 'c', 'exp': 2000})
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual([self.cache.get(token)['sub'] for token in ('a', 'c')], ['a', 'c'])
+        self.assertEqual(self.cache.stats(), {'hits': 3, 'misses': 1, 'size': 2, 'maxsize': 2})
+
+    def test_raw_token_is_not_kept(self):
+        self.cache.set('secret-token', {'exp': 2000})
+        self.assertNotIn('secret-token', self.cache._entries)
+
+
+class PermissionsTestCase(unittest.TestCase):
+    """check_permission_sets, on Claims and on plain decoded payloads"""
+
+    def assertStatus(self, status_code, payload, **required):
+        with self.assertRaises(auth.AuthError) as error:
+            auth.check_permission_sets(payload, **required)
+        self.assertEqual(error.exception.status_code, status_code)
+
+    def test_all_of_and_any_of(self):
+        decoded = {'permissions': ['get:drinks-detail', 'post:drinks']}
+        for payload in (auth.Claims(decoded), decoded):
+            check = partial(auth.check_permission_sets, payload)
+            self.assertTrue(check())
+            self.assertTrue(check(all_of=['get:drinks-detail', 'post:drinks']))
+            self.assertTrue(check(any_of=['patch:drinks', 'post:drinks']))
+            self.assertTrue(check(all_of=['get:drinks-detail'], any_of=['delete:drinks', 'post:drinks']))
+            # every one of all_of, at least one of any_of
+            self.assertStatus(403, payload, all_of=['get:drinks-detail', 'patch:drinks'])
+            self.assertStatus(403, payload, any_of=['patch:drinks', 'delete:drinks'])
+            self.assertStatus(403, payload, all_of=['post:drinks'], any_of=['patch:drinks'])
+
+    def test_check_permissions(self):
+        payload = auth.Claims({'permissions': ['post:drinks']})
+        self.assertTrue(auth.check_permissions('post:drinks', payload))
+        self.assertTrue(auth.check_permissions('', payload))
+        self.assertStatus(403, auth.Claims({'permissions': []}), all_of=['post:drinks'])
+
+    def test_missing_permissions_claim(self):
+        for payload in ({}, auth.Claims({}), {'permissions': 'post:drinks'}):
+            self.assertStatus(400, payload)
+            with self.assertRaises(auth.AuthError):
+                auth.check_permissions('post:drinks', payload)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()